@@ -76,57 +76,50 @@ class Closure:
         for item in self.privileges:
             print("\t{0}".format(item))
 
+    def _lookup_many(self, klass, conn, keys):
+        newitems = []
+        for result in klass.lookup_many(conn, keys):
+            if not result.ok():
+                raise result.error
+            newitems.append(result.value)
+        return newitems
+
     def close(self, conn, group='Default'):
         closed = False
         while not closed:
             closed = True
 
-            newitems = []
-            for key in self.servers:
-                item = self.servers[key]
-                if item is None:
-                    closed = False
-                    newitems.append(Server.lookup(conn, key, group))
+            keys = [(key, group) for key in self.servers if self.servers[key] is None]
+            closed = closed and not keys
+            newitems = self._lookup_many(Server, conn, keys)
 
             for server in newitems:
                 self._close_over_server(server)
 
-            newitems = []
-            for key in self.databases:
-                item = self.databases[key]
-                if item is None:
-                    closed = False
-                    newitems.append(Database.lookup(conn, key))
+            keys = [key for key in self.databases if self.databases[key] is None]
+            closed = closed and not keys
+            newitems = self._lookup_many(Database, conn, keys)
 
             for database in newitems:
                 self._close_over_database(database)
 
-            newitems = []
-            for key in self.forests:
-                item = self.forests[key]
-                if item is None:
-                    closed = False
-                    newitems.append(Forest.lookup(conn, key))
+            keys = [key for key in self.forests if self.forests[key] is None]
+            closed = closed and not keys
+            newitems = self._lookup_many(Forest, conn, keys)
 
             for forest in newitems:
                 self._close_over_forest(forest)
 
-            newitems = []
-            for key in self.users:
-                item = self.users[key]
-                if item is None:
-                    closed = False
-                    newitems.append(User.lookup(conn, key))
+            keys = [key for key in self.users if self.users[key] is None]
+            closed = closed and not keys
+            newitems = self._lookup_many(User, conn, keys)
 
             for user in newitems:
                 self._close_over_user(user)
 
-            newitems = []
-            for key in self.roles:
-                item = self.roles[key]
-                if item is None:
-                    closed = False
-                    newitems.append(Role.lookup(conn, key))
+            keys = [key for key in self.roles if self.roles[key] is None]
+            closed = closed and not keys
+            newitems = self._lookup_many(Role, conn, keys)
 
             for role in newitems:
                 self._close_over_role(role)
@@ -23,23 +23,27 @@ import math
 import os
 import re
 import sys
+import time
 import uuid
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from marklogic.connection import Connection
-from requests.auth import HTTPDigestAuth
+from marklogic.auth import DigestAuth
 from marklogic.client.clientutils import ClientUtils
 from marklogic.client.documents import Documents
+from marklogic.client.batching import BatchSizer
 from marklogic.client.bulkloader import BulkLoader
 from marklogic.client.transactions import Transactions
-from requests_toolbelt import MultipartDecoder
+from marklogic.client.multipart import MultipartReader
 
 CONFIGFILE = ".mldbmirror-config.json"
 BULKTHRESHOLD = 10 * 1000 * 1024      # 10Mb
 BATCHSIZE = 1000
+TARGETLATENCY = 5.0                   # seconds
 
 class MarkLogicDatabaseMirror:
     def __init__(self):
+        self.adaptive = False
         self.batchsize = BATCHSIZE
         self.cdir = None
         self.config = None
@@ -55,6 +59,7 @@ class MarkLogicDatabaseMirror:
         self.management_port = None
         self.regex = []
         self.root = None
+        self.target_latency = TARGETLATENCY
         self.threshold = BULKTHRESHOLD
         self.ucdir = None
         self.umdir = None
@@ -112,6 +117,7 @@ class MarkLogicDatabaseMirror:
             logging.getLogger("requests").setLevel(logging.INFO)
             logging.getLogger("marklogic").setLevel(logging.DEBUG)
 
+        self.adaptive = args['adaptive']
         self.batchsize = args['batchsize']
         self.database = args['database']
         self.dryrun = args['dryrun']
@@ -119,6 +125,7 @@ class MarkLogicDatabaseMirror:
         self.mirror = args['mirror']
         self.regex = args['regex']
         self.root = args['root']
+        self.target_latency = args['target_latency']
         self.threshold = args['threshold']
         self.verbose = args['verbose']
 
@@ -129,8 +136,9 @@ class MarkLogicDatabaseMirror:
             self.root = self.root[0:len(self.root)-1]
 
         self.connection \
-          = Connection(self.hostname, HTTPDigestAuth(adminuser, adminpass), \
-                           port=self.port, management_port=self.management_port)
+          = Connection(self.hostname, DigestAuth(adminuser, adminpass), \
+                           port=self.port, management_port=self.management_port, \
+                           preauthenticate=True)
 
         self.utils = ClientUtils(self.connection)
 
@@ -264,7 +272,17 @@ class MarkLogicDatabaseMirror:
 
         docs = Documents(self.connection)
 
-        bulk = BulkLoader(self.connection)
+        # The loader posts each batch on a background thread once it
+        # holds threshold bytes of content.
+        sizer = None
+        if self.adaptive:
+            sizer = BatchSizer(initial=self.threshold,
+                               floor=max(1, self.threshold // 10),
+                               ceiling=self.threshold * 10,
+                               target_latency=self.target_latency,
+                               unit=BatchSizer.BYTES)
+        bulk = BulkLoader(self.connection, max_bytes=self.threshold,
+                          batch_sizer=sizer)
         bulk.set_database(self.database)
         bulk.set_txid(trans.txid())
 
@@ -272,6 +290,7 @@ class MarkLogicDatabaseMirror:
         done = not files
         upload_size = 0
         ulcount = 0
+        batchcount = 0
         while not done:
             doc = files.pop(0)
             done = not files
@@ -339,16 +358,16 @@ class MarkLogicDatabaseMirror:
                 del urihash[target]
 
             ulcount += 1
+            batchcount += 1
             statinfo = os.stat(source)
             upload_size += statinfo.st_size
 
             docs.set_uri(target)
 
-            datafile = open(source, "rb")
-            docs.set_content(datafile.read(), body_content_type)
-            datafile.close()
+            docs.set_content_file(source, body_content_type)
 
-            bulk.add(docs)
+            if not self.dryrun:
+                bulk.add(docs)
 
             if self.verbose:
                 print("-> {}".format(target))
@@ -356,21 +375,19 @@ class MarkLogicDatabaseMirror:
             if upload_size > self.threshold:
                 perc = (float(ulcount) / upload_count) * 100.0
                 print("{0:.0f}% ... {1} files, {2} bytes" \
-                          .format(perc, bulk.size(), upload_size))
-                if self.dryrun:
-                    bulk.clear_content()
-                else:
-                    bulk.post()
+                          .format(perc, batchcount, upload_size))
                 upload_size = 0
+                batchcount = 0
 
-        if bulk.size() > 0:
+        if batchcount > 0:
             perc = (float(ulcount) / upload_count) * 100.0
             print("{0:.0f}% ... {1} files, {2} bytes" \
-                      .format(perc, bulk.size(), upload_size))
-            if self.dryrun:
-                bulk.clear_content()
-            else:
-                bulk.post()
+                      .format(perc, batchcount, upload_size))
+
+        # Wait for the last batches to be posted
+        bulk.close()
+        if sizer is not None:
+            print("Upload batch size settled at {} bytes".format(sizer.size))
 
         docs.clear()
         docs.set_txid(trans.txid())
@@ -540,6 +557,14 @@ class MarkLogicDatabaseMirror:
         else:
             docs.set_category('content')
 
+        sizer = None
+        if self.adaptive:
+            sizer = BatchSizer(initial=self.batchsize,
+                               floor=max(1, self.batchsize // 10),
+                               ceiling=self.batchsize * 10,
+                               target_latency=self.target_latency)
+        batchsize = self.batchsize
+
         dlprog = 0
         dlcount = 0
         for uri in down_map.keys():
@@ -549,13 +574,16 @@ class MarkLogicDatabaseMirror:
             if uri in filehash:
                 del filehash[uri]
 
-            if dlcount >= self.batchsize:
+            if dlcount >= batchsize:
                 dlprog += dlcount
                 perc = (float(dlprog) / download_count) * 100.0
                 print("{0:.0f}% ... {1}/{2} files" \
                           .format(perc, dlprog, download_count))
 
+                start = time.time()
                 self._download_batch(docs, down_map)
+                if sizer is not None:
+                    batchsize = sizer.record(time.time() - start)
                 docs.clear()
                 docs.set_database(self.database)
                 docs.set_txid(trans.txid())
@@ -599,41 +627,22 @@ class MarkLogicDatabaseMirror:
         self.logger.debug("Downloading batch")
         self.logger.debug(docs)
 
-        resp = docs.get()
-        decoder = MultipartDecoder.from_response(resp)
-
-        self.logger.debug("Downloaded {} bytes in {} parts" \
-                              .format(len(resp.text), len(decoder.parts)))
-
-        meta_part = None
-        content_part = None
-        splitregex = re.compile(';\\s*')
-
-        if not decoder.parts:
+        resp = docs.get(stream=True)
+        if resp.status_code == 404:
             raise RuntimeError("FAILED TO GET ANY PARTS!?")
 
-        for mimepart in decoder.parts:
-            disp = mimepart.headers[b'Content-Disposition'].decode('utf-8')
-            if 'category=metadata' in disp:
-                if meta_part is not None:
+        # Decode the parts as they arrive, so a batch of large documents
+        # doesn't have to fit in memory
+        count = 0
+        with MultipartReader.from_response(resp) as reader:
+            for filename, meta_part, content_part in reader.documents():
+                if content_part is None:
                     raise RuntimeError("More than one metadata part!?")
-                meta_part = mimepart
-            else:
-                content_part = mimepart
-
-                disp = content_part.headers[b'Content-Disposition'].decode('utf-8')
-                dispositions = splitregex.split(disp)
-                filename = None
-                for disp in dispositions:
-                    if disp.startswith("filename="):
-                        filename = disp[10:len(disp)-1]
-
-                body_content_type = content_part.headers[b'Content-Type'].decode('utf-8')
-
                 if filename is None:
                     raise RuntimeError("Multipart without filename!?")
+                count += 1
 
-                #print("FN:",filename)
+                body_content_type = content_part.content_type
 
                 last_modified = None
                 stanza = down_map[filename]
@@ -643,8 +652,11 @@ class MarkLogicDatabaseMirror:
                     if last_modified is not None:
                         stanza['timestamp'] = last_modified
                 self._store_content(content_part, stanza)
-                meta_part = None
-                content_part = None
+
+        if count == 0:
+            raise RuntimeError("FAILED TO GET ANY PARTS!?")
+
+        self.logger.debug("Downloaded {} documents".format(count))
 
     def _store_metadata(self, meta_part, stanza, body_content_type, uri):
         # fromstring() doesn't return an an xml.etree.ElementTree and
@@ -697,7 +709,8 @@ class MarkLogicDatabaseMirror:
                 os.makedirs(os.path.dirname(contfn))
 
             dataf = open(contfn, 'wb')
-            dataf.write(content_part.content)
+            for chunk in content_part.iter_content():
+                dataf.write(chunk)
             dataf.close()
             if stamp is not None:
                 os.utime(contfn, (stamp.timestamp(), stamp.timestamp()))
@@ -905,6 +918,12 @@ def main():
                         help='Size of upload batches (bytes)')
     parser.add_argument('--batchsize', type=int, default=BATCHSIZE,
                         help='Size of download batches (number of files)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adjust the batch sizes to the server\'s response')
+    parser.add_argument('--target-latency', type=float, default=TARGETLATENCY,
+                        metavar="seconds",
+                        help='How long a batch may take before --adaptive '
+                        'makes batches smaller')
     parser.add_argument('--regex', action='append',
                         help='Regex(es) to match for URIs')
     parser.add_argument('--list', default=None,
@@ -39,14 +39,15 @@ class ReadEverything:
 
     def readClass(self, kind, klass, max_read=sys.maxsize):
         names = klass.list(self.connection)
-        for name in names:
-            if max_read > 0:
-                if name.find("|") > 0:
-                    parts = name.split("|")
-                    rsrc = klass.lookup(self.connection, parts[0], parts[1])
-                else:
-                    rsrc = klass.lookup(self.connection, name)
-                max_read = max_read - 1
+        keys = []
+        for name in names[0:max_read]:
+            if name.find("|") > 0:
+                keys.append(tuple(name.split("|")))
+            else:
+                keys.append(name)
+        for result in klass.lookup_many(self.connection, keys):
+            if not result.ok():
+                raise result.error
         print("{}: {}".format(kind, len(names)))
 
     def readPrivileges(self):
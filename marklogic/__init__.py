@@ -19,7 +19,6 @@ A MarkLogic server
 """
 
 import logging
-import requests
 import json
 from marklogic.connection import Connection
 from marklogic.models.cluster import LocalCluster
@@ -31,7 +30,7 @@ from marklogic.models.role import Role
 from marklogic.models.group import Group
 from marklogic.models.database import Database
 from marklogic.models.forest import Forest
-from requests.auth import HTTPDigestAuth
+from marklogic.auth import DigestAuth
 from marklogic.models.server import Server, HttpServer, WebDAVServer
 from marklogic.models.server import OdbcServer, XdbcServer
 from marklogic.exceptions import InvalidAPIRequest, UnexpectedManagementAPIResponse
@@ -473,14 +472,15 @@ class MarkLogic:
         logger.debug("Initializing security for {0}".format(host))
 
         # N.B. Can't use conn.post here because we don't need auth yet
-        response = requests.post(uri, json=payload,
-                                 headers={'content-type': 'application/json',
-                                          'accept': 'application/json'})
+        response = conn.session.post(uri, json=payload,
+                                     headers={'content-type': 'application/json',
+                                              'accept': 'application/json'})
 
         if response.status_code != 202:
             raise UnexpectedManagementAPIResponse(response.text)
 
         # From now on connections require auth...
-        conn = Connection(host, HTTPDigestAuth(admin, password))
+        conn = Connection(host, DigestAuth(admin, password),
+                          session=conn.session)
         data = json.loads(response.text)
         conn.wait_for_restart(data["restart"]["last-startup"][0]["value"])
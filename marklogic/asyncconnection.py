@@ -0,0 +1,226 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Asyncio flavored connection and management API classes.
+
+These classes run the ordinary, blocking API on a bounded pool of
+worker threads, so a single event loop can keep many management
+requests in flight. They return the same model objects as the
+blocking API.
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from marklogic import MarkLogic
+from marklogic.connection import Connection
+
+
+class AsyncConnection:
+    """
+    The AsyncConnection class wraps a :class:`marklogic.connection.Connection`
+    and exposes coroutine versions of its methods.
+
+    At most `max_in_flight` requests are sent concurrently. A connection
+    created by this class keeps at least that many pooled connections
+    to each host.
+    """
+    def __init__(self, host, auth, max_in_flight=64, loop=None, **kwargs):
+        if kwargs.get('pool_maxsize', 0) < max_in_flight:
+            kwargs['pool_maxsize'] = max_in_flight
+        self._init(Connection(host, auth, **kwargs), max_in_flight, loop)
+        self._owns_connection = True
+
+    def _init(self, connection, max_in_flight, loop):
+        self.connection = connection
+        self._owns_connection = False
+        self.max_in_flight = max_in_flight
+        self.loop = loop
+        self.logger = logging.getLogger("marklogic.asyncconnection")
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    @classmethod
+    def from_connection(cls, connection, max_in_flight=64, loop=None):
+        """
+        Wrap an existing connection. Its session (and so its pool)
+        is shared with the blocking API, and it isn't closed by
+        :meth:`close`.
+        """
+        result = cls.__new__(cls)
+        result._init(connection, max_in_flight, loop)
+        return result
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run a blocking callable on a worker thread and return an
+        awaitable for its result.
+        """
+        loop = self.loop
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor,
+                                    functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        """
+        Shut down the worker threads, and close the connection if this
+        object created it.
+        """
+        self._executor.shutdown(wait=True)
+        if self._owns_connection:
+            self.connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    async def head(self, uri, **kwargs):
+        return await self.run(self.connection.head, uri, **kwargs)
+
+    async def get(self, uri, **kwargs):
+        return await self.run(self.connection.get, uri, **kwargs)
+
+    async def post(self, uri, **kwargs):
+        return await self.run(self.connection.post, uri, **kwargs)
+
+    async def put(self, uri, **kwargs):
+        return await self.run(self.connection.put, uri, **kwargs)
+
+    async def delete(self, uri, **kwargs):
+        return await self.run(self.connection.delete, uri, **kwargs)
+
+    async def lookup(self, klass, *args, **kwargs):
+        """
+        Look up a resource, for example
+        ``await conn.lookup(Database, "Documents")``.
+
+        :param klass: A model class with a `lookup` classmethod
+        :return: The model object, as returned by `klass.lookup`
+        """
+        return await self.run(klass.lookup, self.connection, *args, **kwargs)
+
+    async def list(self, klass, *args, **kwargs):
+        """
+        List resources, for example ``await conn.list(Database)``.
+
+        :param klass: A model class with a `list` classmethod
+        :return: The list, as returned by `klass.list`
+        """
+        return await self.run(klass.list, self.connection, *args, **kwargs)
+
+    async def read(self, model):
+        """Read the current configuration of a model object."""
+        return await self.run(model.read, self.connection)
+
+    async def update(self, model):
+        """Save the configuration of a model object on the server."""
+        return await self.run(model.update, self.connection)
+
+    async def lookup_many(self, klass, names):
+        """
+        Look up several resources concurrently.
+
+        :param klass: A model class with a `lookup` classmethod
+        :param names: The names to look up
+        :return: A list of model objects in the order of `names`
+        """
+        return await asyncio.gather(*[self.lookup(klass, name)
+                                      for name in names])
+
+
+class AsyncMarkLogic:
+    """
+    The AsyncMarkLogic class mirrors :class:`marklogic.MarkLogic` with
+    coroutines.
+    """
+    def __init__(self, connection):
+        """
+        Create an AsyncMarkLogic object.
+
+        :param connection: An :class:`AsyncConnection`
+        """
+        self.connection = connection
+        self.marklogic = MarkLogic(connection.connection)
+        self.logger = logging.getLogger("marklogic")
+
+    def _run(self, name, *args, **kwargs):
+        return self.connection.run(getattr(self.marklogic, name),
+                                   *args, **kwargs)
+
+    async def cluster(self):
+        """Get information about the local cluster."""
+        return await self._run("cluster")
+
+    async def groups(self):
+        """Get a list of the groups in the local cluster."""
+        return await self._run("groups")
+
+    async def group(self, group_name):
+        """Get the named group."""
+        return await self._run("group", group_name)
+
+    async def hosts(self):
+        """Get a list of the hosts in the local cluster."""
+        return await self._run("hosts")
+
+    async def host(self, host_name):
+        """Get the named host."""
+        return await self._run("host", host_name)
+
+    async def databases(self):
+        """Get a list of the databases in the local cluster."""
+        return await self._run("databases")
+
+    async def database(self, database_name, host=None):
+        """Get the named database."""
+        return await self._run("database", database_name, host=host)
+
+    async def forests(self):
+        """Get a list of the forests in the local cluster."""
+        return await self._run("forests")
+
+    async def forest(self, forest_name, host=None):
+        """Get the named forest."""
+        return await self._run("forest", forest_name, host=host)
+
+    async def servers(self):
+        """Get a list of the servers in the local cluster."""
+        return await self._run("servers")
+
+    async def http_server(self, name, group='Default'):
+        """Get the named HTTP server."""
+        return await self._run("http_server", name, group=group)
+
+    async def users(self):
+        """Get a list of the users in the local cluster."""
+        return await self._run("users")
+
+    async def user(self, user_name):
+        """Get the named user."""
+        return await self._run("user", user_name)
+
+    async def roles(self):
+        """Get a list of the roles in the local cluster."""
+        return await self._run("roles")
+
+    async def role(self, role_name):
+        """Get the named role."""
+        return await self._run("role", role_name)
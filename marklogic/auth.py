@@ -0,0 +1,117 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Authentication classes for connections to MarkLogic.
+"""
+
+import threading
+from urllib.parse import urlparse
+from requests.auth import HTTPDigestAuth
+
+
+class _DigestState:
+    """
+    The digest challenge most recently accepted by one server.
+    """
+    def __init__(self, chal):
+        self.chal = chal
+        self.last_nonce = ""
+        self.nonce_count = 0
+
+
+class DigestAuth(HTTPDigestAuth):
+    """
+    Digest authentication that reuses the server nonce.
+
+    The :class:`requests.auth.HTTPDigestAuth` class keeps the digest
+    challenge in thread local storage, so every new thread (and every
+    new auth object) has to take a 401 round trip before its first
+    request succeeds. This class keeps one challenge per server
+    (scheme, host and port), shared by all threads, and increments the
+    nonce count under a lock. Every request after the first is sent
+    with an ``Authorization`` header straight away.
+
+    When the server reports that the nonce is stale, the request is
+    challenged again and the new nonce replaces the cached one.
+    """
+    def __init__(self, username, password):
+        super(DigestAuth, self).__init__(username, password)
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @staticmethod
+    def _origin(url):
+        parsed = urlparse(url)
+        return "{0}://{1}".format(parsed.scheme, parsed.netloc)
+
+    def has_challenge(self, url):
+        """
+        Return True if a nonce is cached for the server addressed by `url`.
+        """
+        with self._lock:
+            return self._origin(url) in self._states
+
+    def forget(self, url=None):
+        """
+        Discard the cached nonce for `url`, or for all servers.
+        """
+        with self._lock:
+            if url is None:
+                self._states = {}
+            else:
+                self._states.pop(self._origin(url), None)
+
+    def init_per_thread_state(self):
+        super(DigestAuth, self).init_per_thread_state()
+        if not hasattr(self._thread_local, "challenged"):
+            self._thread_local.challenged = False
+
+    def __call__(self, r):
+        self.init_per_thread_state()
+        with self._lock:
+            state = self._states.get(self._origin(r.url))
+        # The parent class only builds a header up front if it thinks
+        # it has a nonce; build_digest_header() supplies the real one.
+        if state is None:
+            self._thread_local.last_nonce = ""
+        else:
+            self._thread_local.last_nonce = state.last_nonce
+        return super(DigestAuth, self).__call__(r)
+
+    def handle_401(self, r, **kwargs):
+        self._thread_local.challenged = True
+        try:
+            return super(DigestAuth, self).handle_401(r, **kwargs)
+        finally:
+            self._thread_local.challenged = False
+
+    def build_digest_header(self, method, url):
+        local = self._thread_local
+        origin = self._origin(url)
+        with self._lock:
+            state = self._states.get(origin)
+            if local.challenged or state is None:
+                state = _DigestState(local.chal)
+                self._states[origin] = state
+            else:
+                local.chal = state.chal
+            local.last_nonce = state.last_nonce
+            local.nonce_count = state.nonce_count
+            header = super(DigestAuth, self).build_digest_header(method, url)
+            state.last_nonce = local.last_nonce
+            state.nonce_count = local.nonce_count
+        return header
@@ -0,0 +1,231 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Per-host circuit breakers.
+"""
+
+import logging
+import threading
+import time
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
+from marklogic.exceptions import CircuitOpenError
+
+
+class _Circuit:
+    """
+    The state of the circuit to one host.
+    """
+    def __init__(self):
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.total_failures = 0
+        self.calls = 0
+        self.latency = None
+        self.opened_at = None
+        self.probes = 0
+
+    def snapshot(self, reset_timeout):
+        retry_at = None
+        if self.opened_at is not None:
+            retry_at = self.opened_at + reset_timeout
+        return {'state': self.state,
+                'consecutive-failures': self.failures,
+                'failures': self.total_failures,
+                'calls': self.calls,
+                'latency': self.latency,
+                'opened-at': self.opened_at,
+                'retry-at': retry_at}
+
+
+class CircuitBreaker:
+    """
+    The CircuitBreaker class stops requests to a host that keeps failing.
+
+    Each host starts *closed*: requests flow normally. After
+    `failure_threshold` consecutive failures the circuit *opens* and
+    requests to the host raise
+    :class:`marklogic.exceptions.CircuitOpenError` at once instead of
+    waiting for a timeout. After `reset_timeout` seconds the circuit
+    is *half-open*: up to `half_open_calls` requests are let through
+    as probes. If a probe succeeds the circuit closes; if it fails the
+    circuit opens again.
+
+    A failure is a connection error or timeout, a response whose
+    status is in `statuses`, or, if `slow_threshold` is not None, a
+    response that took longer than `slow_threshold` seconds. An
+    exponentially weighted average of each host's latency is kept.
+
+    Pass an instance to a :class:`marklogic.connection.Connection` as
+    `breaker`; several connections may share one. Use :meth:`states`
+    or :meth:`available` to route work away from hosts that are failing.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    FAILURE_STATUSES = frozenset([502, 503, 504])
+    ERRORS = (ConnectionError, ChunkedEncodingError, Timeout)
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 half_open_calls=1, slow_threshold=None, statuses=None,
+                 latency_weight=0.2):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.slow_threshold = slow_threshold
+        if statuses is None:
+            statuses = self.FAILURE_STATUSES
+        self.statuses = frozenset(statuses)
+        self.latency_weight = latency_weight
+        self.logger = logging.getLogger("marklogic.breaker")
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def _circuit(self, host):
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = _Circuit()
+            self._circuits[host] = circuit
+        return circuit
+
+    def _expired(self, circuit):
+        return (circuit.state == self.OPEN
+                and time.time() >= circuit.opened_at + self.reset_timeout)
+
+    def available(self, host):
+        """
+        Return True if a request to `host` would be let through now.
+        """
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == self.CLOSED:
+                return True
+            if circuit.state == self.HALF_OPEN:
+                return circuit.probes < self.half_open_calls
+            return self._expired(circuit)
+
+    def acquire(self, host):
+        """
+        Let a request to `host` through, or raise
+        :class:`marklogic.exceptions.CircuitOpenError`.
+        """
+        with self._lock:
+            circuit = self._circuit(host)
+            if self._expired(circuit):
+                self.logger.info("Circuit to {0} is half-open".format(host))
+                circuit.state = self.HALF_OPEN
+                circuit.probes = 0
+            if circuit.state == self.CLOSED:
+                return
+            if (circuit.state == self.HALF_OPEN
+                    and circuit.probes < self.half_open_calls):
+                circuit.probes += 1
+                return
+            retry_at = None
+            if circuit.opened_at is not None:
+                retry_at = circuit.opened_at + self.reset_timeout
+        raise CircuitOpenError(host, retry_at)
+
+    def failed(self, elapsed, response=None, error=None):
+        """
+        Decide whether a request counts as a failure.
+
+        :return: True for a failure, False for a success, or None if
+        the outcome says nothing about the host
+        """
+        if error is not None:
+            return True if isinstance(error, self.ERRORS) else None
+        if response is not None and response.status_code in self.statuses:
+            return True
+        return self.slow_threshold is not None and elapsed > self.slow_threshold
+
+    def record(self, host, elapsed, response=None, error=None):
+        """
+        Record the outcome of a request let through by :meth:`acquire`.
+        """
+        failed = self.failed(elapsed, response, error)
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == self.HALF_OPEN and circuit.probes > 0:
+                circuit.probes -= 1
+            if failed is None:
+                return
+            circuit.calls += 1
+            if circuit.latency is None:
+                circuit.latency = elapsed
+            else:
+                circuit.latency += self.latency_weight * (elapsed
+                                                          - circuit.latency)
+            if failed:
+                circuit.failures += 1
+                circuit.total_failures += 1
+                if (circuit.state == self.HALF_OPEN
+                        or (circuit.state == self.CLOSED
+                            and circuit.failures >= self.failure_threshold)):
+                    self.logger.warning("Circuit to {0} is open after {1} "
+                                        "failures".format(host,
+                                                          circuit.failures))
+                    circuit.state = self.OPEN
+                    circuit.opened_at = time.time()
+            else:
+                if circuit.state != self.CLOSED:
+                    self.logger.info("Circuit to {0} is closed".format(host))
+                circuit.state = self.CLOSED
+                circuit.failures = 0
+                circuit.opened_at = None
+
+    def state(self, host):
+        """Return the state of the circuit to `host`."""
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                return self.CLOSED
+            if self._expired(circuit):
+                return self.HALF_OPEN
+            return circuit.state
+
+    def states(self):
+        """
+        Return the state of every circuit.
+
+        :return: A dictionary mapping host names to dictionaries with
+        the state, the number of consecutive and total failures, the
+        number of calls, the average latency in seconds, and when the
+        circuit opened and will next let a probe through
+        """
+        with self._lock:
+            result = {}
+            for host in self._circuits:
+                snapshot = self._circuits[host].snapshot(self.reset_timeout)
+                if self._expired(self._circuits[host]):
+                    snapshot['state'] = self.HALF_OPEN
+                result[host] = snapshot
+            return result
+
+    def open_hosts(self):
+        """Return the hosts whose circuits are open."""
+        return [host for host in list(self._circuits)
+                if self.state(host) == self.OPEN]
+
+    def reset(self, host=None):
+        """Close the circuit to `host`, or every circuit."""
+        with self._lock:
+            if host is None:
+                self._circuits = {}
+            else:
+                self._circuits.pop(host, None)
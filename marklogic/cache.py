@@ -0,0 +1,108 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+A cache of management resources, revalidated with etags.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    The ResponseCache class holds the models read from the Management
+    API, keyed by resource URI, with the etag the server returned.
+
+    Pass an instance to a :class:`marklogic.connection.Connection` as
+    `cache`. Reads of a cached resource are sent with ``If-None-Match``;
+    if the server answers 304 (Not Modified), a copy of the cached model
+    is returned instead of downloading and unmarshalling the properties
+    again.
+
+    At most `max_entries` resources are kept; the least recently used
+    is evicted first.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def etag(self, uri):
+        """Return the etag of the cached resource, or None."""
+        with self._lock:
+            entry = self._entries.get(uri)
+            return None if entry is None else entry[0]
+
+    def get(self, uri, etag=None):
+        """
+        Return a copy of the cached model for `uri`, or None.
+
+        If `etag` is not None, the model is only returned if it was
+        cached with that etag.
+        """
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is None or (etag is not None and entry[0] != etag):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uri)
+            self.hits += 1
+        return self._copy(entry[1])
+
+    def put(self, uri, etag, model):
+        """Cache a copy of `model`, read from `uri` with `etag`."""
+        if etag is None or self.max_entries <= 0:
+            return
+        model = self._copy(model)
+        with self._lock:
+            self._entries[uri] = (etag, model)
+            self._entries.move_to_end(uri)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, uri=None):
+        """Forget the resource at `uri`, or every resource."""
+        with self._lock:
+            if uri is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(uri, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the number of entries, hits, misses and evictions."""
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def _copy(self, model):
+        # Callers modify the models they get back, so each one gets its
+        # own copy; a saved connection is shared, not copied.
+        memo = {}
+        connection = getattr(model, 'connection', None)
+        if connection is not None:
+            memo[id(connection)] = connection
+        return copy.deepcopy(model, memo)
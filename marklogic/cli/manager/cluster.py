@@ -25,7 +25,7 @@ A class to manage clusters.
 """
 
 import inspect, json, logging, re, sys
-from requests.auth import HTTPDigestAuth
+from marklogic.auth import DigestAuth
 from marklogic.connection import Connection
 from marklogic.cli.manager import Manager
 from marklogic.models.cluster import LocalCluster
@@ -76,7 +76,7 @@ class ClusterManager(Manager):
                    args['couple_credentials'])
             sys.exit(1)
 
-        altconn = Connection(args['host'], HTTPDigestAuth(username, password))
+        altconn = Connection(args['host'], DigestAuth(username, password))
         altcluster = LocalCluster(connection=altconn)
 
         cluster.couple(altcluster, connection=connection,
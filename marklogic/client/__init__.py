@@ -18,3 +18,7 @@ from marklogic.client.eval import Eval
 from marklogic.client.clientutils import ClientUtils
 from marklogic.client.transactions import Transactions
 from marklogic.client.documents import Documents
+from marklogic.client.multipart import MultipartReader
+from marklogic.client.content import ContentSource
+from marklogic.client.batching import BatchSizer
+from marklogic.client.routing import ForestRouter
@@ -0,0 +1,126 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Adaptive batch sizes for bulk reads and writes.
+"""
+
+import logging
+import threading
+from marklogic.client.exceptions import InvalidAPIRequest
+
+
+class BatchSizer:
+    """
+    The BatchSizer class chooses the size of batches from how the
+    batches sent so far fared, by additive increase and multiplicative
+    decrease (AIMD).
+
+    After each batch that succeeds within `target_latency` seconds, the
+    size grows by `increase`; after a batch that fails, or that takes
+    longer than `target_latency`, the size is multiplied by `decrease`.
+    The size never leaves the range from `floor` to `ceiling`. The size
+    is a number of documents, or of bytes if `unit` is ``"bytes"``.
+    The bounds that aren't given default to :attr:`DEFAULTS` for the
+    unit: 100 documents, from 10 to 10,000, or 1 MB, from 64 KB to
+    64 MB.
+
+    The target is the latency of a whole batch, not of a document or a
+    byte, so that the sizer finds the largest batch that still comes
+    back within `target_latency`. Choose a target that a batch of the
+    initial size can meet on the link in use; if even the floor can't,
+    the size stays at the floor.
+
+    Each change of size is logged on the ``marklogic.client.batching``
+    logger. Pass an instance to a
+    :class:`marklogic.client.bulkloader.BulkLoader` as `batch_sizer`,
+    or call :meth:`record` after each batch and read :attr:`size`.
+    """
+    DOCUMENTS = "documents"
+    BYTES = "bytes"
+    # (initial, floor, ceiling) for each unit
+    DEFAULTS = {DOCUMENTS: (100, 10, 10000),
+                BYTES: (1024 * 1024, 64 * 1024, 64 * 1024 * 1024)}
+
+    def __init__(self, initial=None, floor=None, ceiling=None, increase=None,
+                 decrease=0.5, target_latency=1.0, unit=DOCUMENTS):
+        if unit not in self.DEFAULTS:
+            raise InvalidAPIRequest("Unknown unit: {0}".format(unit))
+        defaults = self.DEFAULTS[unit]
+        if initial is None:
+            initial = defaults[0]
+        if floor is None:
+            floor = min(defaults[1], initial)
+        if ceiling is None:
+            ceiling = max(defaults[2], initial)
+        if floor > ceiling:
+            raise InvalidAPIRequest("The floor must not be above the ceiling")
+        if increase is None:
+            increase = max(1, int(initial * 0.1))
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.unit = unit
+        self.logger = logging.getLogger("marklogic.client.batching")
+        self._lock = threading.Lock()
+        self._size = min(ceiling, max(floor, initial))
+        self._stats = {'batches': 0, 'failures': 0, 'slow': 0,
+                       'smallest': self._size, 'largest': self._size}
+
+    @property
+    def size(self):
+        """The size of the next batch."""
+        return self._size
+
+    def record(self, elapsed, failed=False):
+        """
+        Record how long a batch took, and whether it failed.
+
+        :return: The size of the next batch
+        """
+        with self._lock:
+            old = self._size
+            self._stats['batches'] += 1
+            if failed or elapsed > self.target_latency:
+                if failed:
+                    self._stats['failures'] += 1
+                else:
+                    self._stats['slow'] += 1
+                self._size = max(self.floor, int(old * self.decrease))
+            else:
+                self._size = min(self.ceiling, old + self.increase)
+            self._stats['smallest'] = min(self._stats['smallest'], self._size)
+            self._stats['largest'] = max(self._stats['largest'], self._size)
+            size = self._size
+
+        if size != old:
+            self.logger.info("Batch size {0} -> {1} {2} after {3}batch "
+                             "in {4:.2f}s".format(old, size, self.unit,
+                                                  "failed " if failed else "",
+                                                  elapsed))
+        return size
+
+    def stats(self):
+        """
+        Return the current size, the number of batches recorded, how
+        many failed or were slow, and the smallest and largest sizes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+        return stats
@@ -25,21 +25,86 @@ Support the v1/documents bulk loader
 """
 
 from __future__ import unicode_literals, print_function, absolute_import
+import io
+import json
 import logging
+import queue
+import threading
+import time
+from requests import Response
+from requests.structures import CaseInsensitiveDict
 from marklogic.utilities import PropertyLists
 from marklogic.client.exceptions import InvalidAPIRequest
 from marklogic.client.documents import Documents
-from requests.packages.urllib3.fields import RequestField
-from requests.packages.urllib3.filepost import encode_multipart_formdata
+from marklogic.client.multipart import MultipartBody
+from marklogic.retry import RetryPolicy
+
+# Tells a background thread to stop
+_CLOSE = object()
+
+class _Batch:
+    """
+    A batch of documents taken from the loader to be posted.
+    """
+    def __init__(self, fields, uris, size):
+        self.fields = fields
+        self.uris = uris
+        self.size = size
 
 class BulkLoader(PropertyLists):
     """
     The Documents class encapsulates a collection of documents to
     be uploaded in a batch.
+
+    If share_metadata is True (the default), the metadata of each
+    document is sent as request-level default metadata, and only when
+    it differs from the metadata of the document before it, so a batch
+    of documents with the same collections, permissions, properties
+    and quality carries their metadata once.
     """
-    def __init__(self, connection=None, save_connection=True):
+    def __init__(self, connection=None, save_connection=True,
+                 max_documents=None, max_bytes=None, max_age=None,
+                 max_in_flight=1, max_pending=None, retries=0,
+                 on_batch=None, on_error=None, batch_sizer=None,
+                 router=None):
         """
         Create a BulkLoader object.
+
+        If any of max_documents, max_bytes or max_age is specified, the
+        loader flushes on its own: as soon as a batch holds max_documents
+        documents or max_bytes bytes of content, or its first document
+        was added max_age seconds ago, the batch is posted in the
+        background. Call :meth:`close`, or use the loader as a context
+        manager, to post what remains and wait for the uploads to finish.
+
+        Up to max_in_flight batches are posted at once, each on its own
+        thread, so batches may finish out of order. At most max_pending
+        flushed batches wait to be posted, twice max_in_flight by
+        default; after that, flushing (and so adding) waits for a batch
+        to finish. Pass max_pending=0 to let batches wait without limit.
+
+        A batch that fails with a connection error or timeout is posted
+        again up to retries times; only ask for retries if reposting a
+        batch is safe. After each batch, on_batch is called with the
+        response and the URIs in the batch. If a batch fails, on_error
+        is called with the error and the URIs; if there is no on_error,
+        the first error is raised by :meth:`close`. The callbacks are
+        called on the background threads.
+
+        If a :class:`marklogic.client.batching.BatchSizer` is given as
+        batch_sizer, it chooses the number of documents (or bytes) in
+        each batch, in place of max_documents (or max_bytes), from the
+        latency and failures of the batches posted so far.
+
+        If a :class:`marklogic.client.routing.ForestRouter` is given as
+        router, each batch is split by the host of the forest each
+        document is assigned to, and each part is posted directly to
+        its host. The parts count as batches in the report and each is
+        passed to on_batch or on_error on its own. If the forests can't
+        be found, the batch is posted to the host of the connection.
+        Batches in a transaction are not routed, because the transaction
+        exists only on the host that created it. Nor are batches for a
+        database other than the router's.
         """
         self._config = {}
         if save_connection:
@@ -50,8 +115,46 @@ class BulkLoader(PropertyLists):
         self.field_count = 0
         self.fields = []
         self.transparams = []
+        self.share_metadata = True
+        self.chunked = False
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.retries = retries
+        self.on_batch = on_batch
+        self.on_error = on_error
+        self.batch_sizer = batch_sizer
+        self.router = router
+        self.batch_bytes = 0
+        self.posted = 0
+        self._uris = []
+        self._batch_started = None
+        self._default_metadata = None
+        self._lock = threading.RLock()
+        self._queue = None
+        self._flushers = []
+        self._errors = []
+        self._stats = {}
+        self._started = None
+        self._finished = None
 
         self.clear()
+        self.reset_report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception:
+                self.logger.exception("Failed to flush bulk loader")
+        return False
 
     def add(self, document):
         """Add a document to the list of bulk uploads"""
@@ -67,29 +170,207 @@ class BulkLoader(PropertyLists):
         else:
             target = target[0]
 
-        self.field_count += 1
-        metaname = "meta{}".format(self.field_count)
-        dataname = "data{}".format(self.field_count)
+        disposition = 'attachment; filename="{}"'.format(target)
+        metadata = (document.metadata(), document.metadata_content_type())
+        content = document.content()
+
+        with self._lock:
+            self.field_count += 1
+
+            self.logger.debug("Bulk[{}] = {}".format(self.field_count, target))
+
+            if not self.share_metadata:
+                self.fields.append(({'Content-Disposition':
+                                     disposition + '; category=metadata',
+                                     'Content-Type': metadata[1]}, metadata[0]))
+            elif metadata != self._default_metadata:
+                self._default_metadata = metadata
+                self.fields.append(({'Content-Disposition':
+                                     'inline; category=metadata',
+                                     'Content-Type': metadata[1]}, metadata[0]))
+
+            # File-backed content is only read when the batch is posted
+            self.fields.append(({'Content-Disposition': disposition,
+                                 'Content-Type': document.content_type()},
+                                content))
+            self._uris.append(target)
+
+            self.batch_bytes += len(content)
+            if self._batch_started is None:
+                self._batch_started = time.time()
+                self._finished = None
+                if self._started is None:
+                    self._started = self._batch_started
+            max_documents, max_bytes = self.max_documents, self.max_bytes
+            sizer = self.batch_sizer
+            if sizer is not None:
+                if sizer.unit == sizer.BYTES:
+                    max_bytes = sizer.size
+                else:
+                    max_documents = sizer.size
+            full = ((max_documents is not None
+                     and self.field_count >= max_documents)
+                    or (max_bytes is not None
+                        and self.batch_bytes >= max_bytes))
+
+        if full:
+            self.flush()
+        elif self.max_age is not None:
+            self._start()
 
-        self.logger.debug("Bulk[{}] = {}".format(self.field_count, target))
+    def size(self):
+        return self.field_count
 
-        rf = RequestField(name=metaname, data=document.metadata(), filename=target)
-        rf.make_multipart(content_disposition='attachment; category=metadata', \
-                              content_type=document.metadata_content_type())
-        self.fields.append(rf)
+    def post(self, connection=None, idempotent=None):
+        """
+        Upload the documents added so far in a single request.
 
-        rf = RequestField(name=dataname, data=document.content(), filename=target)
-        rf.make_multipart(content_disposition='attachment', \
-                              content_type=document.content_type())
-        self.fields.append(rf)
+        If the connection has a retry policy, pass idempotent=True to
+        allow the upload to be retried; this is safe unless a transform
+        has side effects.
 
-    def size(self):
-        return self.field_count
+        The body is encoded as it is sent. It is sent with a
+        Content-Length if the length of all the content is known, and
+        with chunked transfer encoding if it isn't or if chunked is True.
+        A chunked upload can't be retried.
 
-    def post(self, connection=None):
+        If there is a router, a request is made to each host, and the
+        response lists the documents written by all of them; if any
+        request fails, its response is returned instead.
+
+        If the upload raises an error, the documents that weren't
+        posted are kept, so that they can be posted again.
+        """
         if connection is None:
             connection = self.connection
 
+        with self._lock:
+            batch = self._take()
+            if self._started is None:
+                self._started = time.time()
+        parts = self._route(batch, connection)
+        responses = []
+        for index, (host, part) in enumerate(parts):
+            try:
+                responses.append(self._post(part, connection, idempotent,
+                                            host))
+            except Exception:
+                with self._lock:
+                    for host, part in reversed(parts[index:]):
+                        self._restore(part)
+                raise
+        if len(responses) == 1:
+            return responses[0]
+        return self._merge(responses)
+
+    def _take(self):
+        """Internal method to take the current batch; hold the lock."""
+        batch = _Batch(self.fields, self._uris, self.batch_bytes)
+        self.clear_content()
+        return batch
+
+    def _restore(self, batch):
+        """
+        Internal method to put a batch that wasn't posted back in front
+        of the documents added since; hold the lock.
+        """
+        self.fields = batch.fields + self.fields
+        self._uris = batch.uris + self._uris
+        self.field_count += len(batch.uris)
+        self.batch_bytes += batch.size
+        if self._batch_started is None:
+            self._batch_started = time.time()
+
+    def _route(self, batch, connection):
+        """
+        Internal method to split a batch by the host of the forest each
+        document is assigned to.
+
+        :return: A list of (host, batch) pairs; the host is None for
+        documents that go to the host of the connection
+        """
+        if self.router is None or not batch.uris:
+            return [(None, batch)]
+        if 'txid' in self._config:
+            # A transaction lives on the host that created it
+            return [(None, batch)]
+        database = self.database()
+        if database is not None and database != self.router.database:
+            self.logger.warning("Not routing: the router is for {}, not {}"
+                                .format(self.router.database, database))
+            return [(None, batch)]
+        try:
+            hosts = self.router.hosts(batch.uris, connection)
+        except Exception as err:
+            self.logger.warning("Can't route {} documents: {}"
+                                .format(len(batch.uris), err))
+            return [(None, batch)]
+        if len(set(hosts)) == 1:
+            return [(hosts[0], batch)]
+
+        # Default metadata applies to the documents after it, and
+        # document metadata to the document after it, so each part
+        # carries the metadata of its own documents.
+        parts = {}
+        default = None
+        pending = None
+        index = 0
+        for field in batch.fields:
+            disposition = field[0]['Content-Disposition']
+            if disposition.startswith('inline'):
+                default = field
+                continue
+            if disposition.endswith('category=metadata'):
+                pending = field
+                continue
+            host = hosts[index]
+            if host not in parts:
+                parts[host] = (_Batch([], [], 0), [None])
+            part, sent = parts[host]
+            if default is not None and sent[0] is not default:
+                part.fields.append(default)
+                sent[0] = default
+            if pending is not None:
+                part.fields.append(pending)
+                pending = None
+            part.fields.append(field)
+            part.uris.append(batch.uris[index])
+            part.size += len(field[1])
+            index += 1
+
+        self.logger.debug("Routed {} documents to {} hosts"
+                          .format(len(batch.uris), len(parts)))
+        return [(host, parts[host][0]) for host in parts]
+
+    def _merge(self, responses):
+        """
+        Internal method to merge the responses of the requests that
+        posted the parts of a batch into one response.
+        """
+        documents = []
+        for response in responses:
+            if response.status_code != 200:
+                return response
+            documents.extend(json.loads(response.text).get('documents', []))
+        first = responses[0]
+        body = json.dumps({'documents': documents}).encode("utf-8")
+        merged = Response()
+        merged.status_code = first.status_code
+        merged.reason = first.reason
+        merged.url = first.url
+        merged.request = first.request
+        merged.headers = CaseInsensitiveDict(first.headers)
+        merged.headers['content-type'] = "application/json"
+        merged.headers['content-length'] = str(len(body))
+        merged.headers.pop('content-encoding', None)
+        merged.encoding = "utf-8"
+        merged.raw = io.BytesIO(body)
+        merged._content = body
+        merged._content_consumed = True
+        return merged
+
+    def _post(self, batch, connection, idempotent=None, host=None):
+        """Internal method to post a batch, to host if it's not None."""
         params = []
         for key in ['database', 'transform', 'txid', \
                         'temporal-collection', 'system-time']:
@@ -98,20 +379,199 @@ class BulkLoader(PropertyLists):
         for pair in self.transparams:
             params.append("trans:{}={}".format(pair[0], pair[1]))
 
-        uri = connection.client_uri("documents")
+        uri = connection.client_uri("documents", host=host)
         if params:
             uri = uri + "?" + "&".join(params)
 
-        self.logger.debug("Bulk POST {}: {}".format(self.field_count, uri))
+        self.logger.debug("Bulk POST {}: {}".format(len(batch.uris), uri))
+
+        body = MultipartBody(batch.fields)
+        payload = body
+        if self.chunked:
+            payload = iter(body)
+        sizer = self.batch_sizer
+        start = time.time()
+        try:
+            response = connection.post(uri, payload=payload,
+                                       content_type=body.content_type,
+                                       idempotent=idempotent)
+        except Exception:
+            if sizer is not None:
+                sizer.record(time.time() - start, failed=True)
+            raise
+        finally:
+            body.close()
+        if sizer is not None:
+            sizer.record(time.time() - start)
+        with self._lock:
+            self.posted += len(batch.uris)
+            self._stats['documents'] += len(batch.uris)
+            self._stats['bytes'] += batch.size
+            self._stats['batches'] += 1
+        return response
 
-        post_body, content_type = encode_multipart_formdata(self.fields)
+    def flush(self):
+        """
+        Hand the documents added so far to a background thread to be
+        posted. Unlike :meth:`post`, this doesn't wait for the upload,
+        unless max_pending batches are already waiting.
+        """
+        with self._lock:
+            if not self.fields:
+                return
+            batch = self._take()
+        self._start()
+        self._queue.put(batch)
+
+    def close(self):
+        """
+        Post the documents that remain and wait for the background
+        threads to finish.
 
-        post_ct = ''.join(('multipart/mixed',) \
-                              + content_type.partition(';')[1:])
+        If a background upload failed and there is no on_error callback,
+        the first error is raised.
 
-        response = connection.post(uri, payload=post_body, content_type=post_ct)
-        self.clear_content()
-        return response
+        :return: The report (see :meth:`report`)
+        """
+        self.flush()
+        with self._lock:
+            flushers, self._flushers = self._flushers, []
+        for flusher in flushers:
+            self._queue.put(_CLOSE)
+        for flusher in flushers:
+            flusher.join()
+        with self._lock:
+            self._finished = time.time()
+        report = self.report()
+        self.logger.info("Loaded {documents} documents ({bytes} bytes) in "
+                         "{batches} batches, {failed-batches} failed, "
+                         "{retries} retries, {elapsed:.2f}s"
+                         .format(**report))
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        return report
+
+    def report(self):
+        """
+        Report on the uploads so far.
+
+        :return: A dictionary with the number of documents, bytes of
+        content and batches posted, the number of batches and documents
+        that failed, the number of retries, the elapsed time in
+        seconds from the first document added to :meth:`close`, and,
+        if there is a batch sizer, the batch size it chose last
+        """
+        with self._lock:
+            report = dict(self._stats)
+            if self.batch_sizer is not None:
+                report['batch-size'] = self.batch_sizer.size
+            report['elapsed'] = 0.0
+            if self._started is not None:
+                finished = self._finished
+                if finished is None:
+                    finished = time.time()
+                report['elapsed'] = finished - self._started
+        return report
+
+    def reset_report(self):
+        """Start a new report."""
+        with self._lock:
+            self._stats = {'documents': 0, 'bytes': 0, 'batches': 0,
+                           'failed-batches': 0, 'failed-documents': 0,
+                           'retries': 0}
+            self._started = None
+            self._finished = None
+
+    def _start(self):
+        """Internal method to start the background threads."""
+        with self._lock:
+            if self._flushers:
+                return
+            maxsize = self.max_pending
+            if maxsize is None:
+                maxsize = 2 * max(1, self.max_in_flight)
+            self._queue = queue.Queue(maxsize)
+            for index in range(max(1, self.max_in_flight)):
+                flusher = threading.Thread(
+                    target=self._flush_loop, args=(self._queue, index == 0),
+                    name="marklogic-bulkloader-{}".format(index))
+                flusher.daemon = True
+                flusher.start()
+                self._flushers.append(flusher)
+
+    def _flush_loop(self, batches, watch_age):
+        """Internal method run by the background threads."""
+        while True:
+            timeout = None
+            if watch_age and self.max_age is not None:
+                with self._lock:
+                    started = self._batch_started
+                if started is None:
+                    timeout = self.max_age
+                else:
+                    timeout = max(0.0, started + self.max_age - time.time())
+            try:
+                batch = batches.get(timeout=timeout)
+            except queue.Empty:
+                with self._lock:
+                    if (self._batch_started is None or time.time()
+                            < self._batch_started + self.max_age):
+                        continue
+                    batch = self._take()
+            if batch is _CLOSE:
+                return
+            self._post_batch(batch)
+
+    def _post_batch(self, batch):
+        """Internal method to post a batch, routed if there's a router."""
+        for host, part in self._route(batch, self.connection):
+            self._post_part(part, host)
+
+    def _post_part(self, batch, host):
+        """Internal method to post (part of) a batch, retrying if allowed."""
+        attempt = 0
+        while True:
+            try:
+                response = self._post(batch, self.connection, host=host)
+                break
+            except RetryPolicy.ERRORS as err:
+                if attempt >= self.retries:
+                    self._failed(batch, err)
+                    return
+                delay = min(30.0, 0.5 * 2 ** attempt)
+                attempt += 1
+                self.logger.debug("Retry {} of bulk POST in {:.2f}s..."
+                                  .format(attempt, delay))
+                with self._lock:
+                    self._stats['retries'] += 1
+                time.sleep(delay)
+            except Exception as err:
+                self._failed(batch, err)
+                return
+
+        if self.on_batch is not None:
+            try:
+                self.on_batch(response, batch.uris)
+            except Exception:
+                self.logger.exception("Bulk loader on_batch callback failed")
+
+    def _failed(self, batch, err):
+        """Internal method to record a batch that failed."""
+        self.logger.warning("Bulk POST of {} documents failed: {}"
+                            .format(len(batch.uris), err))
+        with self._lock:
+            self._stats['failed-batches'] += 1
+            self._stats['failed-documents'] += len(batch.uris)
+        if self.on_error is None:
+            with self._lock:
+                self._errors.append(err)
+            return
+        try:
+            self.on_error(err, batch.uris)
+        except Exception:
+            self.logger.exception("Bulk loader on_error callback failed")
 
     def _get(self, name):
         """Internal method to conditionally get a config variable"""
@@ -236,13 +696,16 @@ class BulkLoader(PropertyLists):
         """Clear the documents object. This removes all previous settings
         and returns the object to its initial state."""
         self._config = {}
-        self.field_count = 0
-        self.fields = []
         self.transparams = []
+        self.clear_content()
 
     def clear_content(self):
         """Clear the documents object. This removes all previous settings
         and returns the object to its initial state."""
         self.fields = []
         self.field_count = 0
+        self._uris = []
+        self.batch_bytes = 0
+        self._batch_started = None
+        self._default_metadata = None
 
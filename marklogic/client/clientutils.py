@@ -28,7 +28,26 @@ from __future__ import unicode_literals, print_function, absolute_import
 import logging
 import json
 from marklogic.client.eval import Eval
-from requests_toolbelt import MultipartDecoder
+from marklogic.client.exceptions import InvalidAPIRequest
+from marklogic.client.multipart import MultipartReader
+
+# Deletes at most $limit of the documents that match the query in one
+# transaction; returns the number deleted and an estimate of the number
+# that remain.
+_DELETE_BATCH = """xquery version '1.0-ml';
+declare variable $collection as xs:string external := "";
+declare variable $directory as xs:string external := "";
+declare variable $query as xs:string external := "";
+declare variable $limit as xs:integer external;
+let $queries := (
+  if ($collection = "") then () else cts:collection-query($collection),
+  if ($directory = "") then () else cts:directory-query($directory, "infinity"),
+  if ($query = "") then () else cts:query(xdmp:unquote($query)/node()))
+let $q := cts:and-query($queries)
+let $uris := cts:uris((), ("limit=" || $limit), $q)
+let $_ := for $uri in $uris return xdmp:document-delete($uri)
+return (count($uris), max((0, xdmp:estimate(cts:search(fn:doc(), $q)) - count($uris))))
+"""
 
 class ClientUtils:
     """
@@ -70,13 +89,14 @@ class ClientUtils:
                                   .format(version, root))
 
         mleval.set_database(database)
-        response = mleval.eval()
+        response = mleval.eval(stream=True)
 
-        if 'content-type' in response.headers:
-            if response.headers['content-type'].startswith("multipart/mixed"):
-                decoder = MultipartDecoder.from_response(response)
-                for part in decoder.parts:
+        try:
+            if MultipartReader.is_multipart(response):
+                for part in MultipartReader.from_response(response):
                     uris.append(part.text)
+        finally:
+            response.close()
 
         return uris
 
@@ -116,16 +136,77 @@ class ClientUtils:
         #print(xquery)
         mleval.set_xquery(xquery)
         mleval.set_database(database)
-        response = mleval.eval()
+        response = mleval.eval(stream=True)
 
         data = None
-        if 'content-type' in response.headers:
-            if response.headers['content-type'].startswith("multipart/mixed"):
-                decoder = MultipartDecoder.from_response(response)
-                for part in decoder.parts:
+        try:
+            if MultipartReader.is_multipart(response):
+                for part in MultipartReader.from_response(response):
                     if data is None:
                         data = json.loads(part.text)
                     else:
                         raise RuntimeError("Multipart reply to timestamp query!?")
+        finally:
+            response.close()
 
         return data
+
+    def delete_documents(self, database, collection=None, directory=None,
+                         query=None, batch_size=1000, progress=None,
+                         txid=None, connection=None):
+        """Delete the documents in a collection, in a directory, or that
+        match a query, without fetching their URIs.
+
+        The criteria that are given are combined with an and-query.
+        The query is a cts:query serialized as XML.
+        The documents are deleted on the server, at most batch_size in
+        each request. After each batch, progress, if it isn't None, is
+        called with the number of documents deleted so far and an
+        estimate of the number that remain.
+
+        Returns the number of documents deleted.
+        """
+        # An empty criterion is ignored; with none, everything would match
+        if not (collection or directory or query):
+            raise InvalidAPIRequest("Specify a collection, directory, or query")
+
+        if connection is None:
+            connection = self.connection
+
+        mleval = Eval(connection)
+        mleval.set_xquery(_DELETE_BATCH)
+        mleval.set_database(database)
+        if txid is not None:
+            mleval.set_txid(txid)
+
+        variables = {'limit': batch_size}
+        if collection is not None:
+            variables['collection'] = collection
+        if directory is not None:
+            variables['directory'] = directory
+        if query is not None:
+            variables['query'] = query
+        mleval.set_vars(variables)
+
+        total = 0
+        while True:
+            response = mleval.eval(stream=True)
+            values = []
+            try:
+                if MultipartReader.is_multipart(response):
+                    for part in MultipartReader.from_response(response):
+                        values.append(int(part.text))
+            finally:
+                response.close()
+
+            if len(values) != 2:
+                raise RuntimeError("Unexpected reply to delete query!?")
+
+            deleted, remaining = values
+            total += deleted
+            self.logger.debug("Deleted {} documents, about {} remain"
+                              .format(total, remaining))
+            if progress is not None:
+                progress(total, remaining)
+            if deleted < batch_size or remaining == 0:
+                return total
@@ -0,0 +1,167 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Document content that is read as it is sent
+"""
+
+import io
+import mmap
+import os
+
+
+class ContentSource:
+    """
+    The ContentSource class stands for document content that is read
+    while the request is sent instead of being held in memory as
+    ``bytes``.
+
+    The source may be a file name (a string or path object), an open
+    binary file, or an object that supports the buffer protocol, such
+    as a ``memoryview`` or an ``mmap``. Files are read in blocks; a
+    named file is opened only while it is sent. Buffers are sent as
+    slices of the original memory, so nothing is copied.
+
+    The length is known unless the source is a file that can't seek,
+    such as a pipe; such a source can only be sent once. An mmap can't
+    be closed while a ContentSource refers to it.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.path = None
+        self._file = None
+        self._buffer = None
+        self._start = 0
+        if isinstance(source, str) or hasattr(source, '__fspath__'):
+            self.path = os.fspath(source)
+            self.length = os.stat(self.path).st_size
+        elif hasattr(source, 'read') and not isinstance(source, mmap.mmap):
+            self._file = source
+            self.length = None
+            try:
+                self._start = source.tell()
+                self.length = source.seek(0, io.SEEK_END) - self._start
+                source.seek(self._start)
+            except (AttributeError, OSError, ValueError):
+                self.length = None
+        else:
+            self._buffer = memoryview(source).cast("B")
+            self.length = self._buffer.nbytes
+
+    @classmethod
+    def wraps(cls, data):
+        """
+        Return True if `data` is content that should be wrapped in a
+        ContentSource: a path object, a file, a memoryview or an mmap.
+        Strings and bytes are content in their own right.
+        """
+        return (isinstance(data, (memoryview, mmap.mmap))
+                or hasattr(data, '__fspath__')
+                or (hasattr(data, 'read')
+                    and not isinstance(data, (str, bytes, bytearray,
+                                              ContentSource))))
+
+    def open(self):
+        """
+        Return a file-like reader positioned at the start of the content.
+        """
+        return ContentReader(self)
+
+    def read(self):
+        """Read all of the content into memory."""
+        reader = self.open()
+        try:
+            return bytes(reader.read())
+        finally:
+            reader.close()
+
+    def __len__(self):
+        return self.length or 0
+
+    def __repr__(self):
+        return "<ContentSource {0!r}, {1} bytes>".format(
+            self.path if self.path is not None else type(self.source).__name__,
+            self.length)
+
+
+class ContentReader:
+    """
+    A file-like reader for a :class:`ContentSource`.
+
+    The reader has a length, and can tell its position and go back,
+    so that a request can be retried or re-sent after an
+    authentication challenge.
+    """
+    def __init__(self, source):
+        self._source = source
+        self._file = None
+        self._position = 0
+
+    def __len__(self):
+        return len(self._source)
+
+    def __bool__(self):
+        # Content of unknown length is still content
+        return True
+
+    def _open(self):
+        if self._file is None:
+            source = self._source
+            if source.path is not None:
+                self._file = open(source.path, "rb")
+            else:
+                self._file = source._file
+                if source.length is not None:
+                    self._file.seek(source._start)
+        return self._file
+
+    def read(self, size=-1):
+        """
+        Read at most `size` bytes, or all of the rest if `size` is
+        negative. The data from a buffer is a ``memoryview`` slice.
+        """
+        source = self._source
+        if source._buffer is not None:
+            end = source.length
+            if size is not None and size >= 0:
+                end = min(end, self._position + size)
+            data = source._buffer[self._position:end]
+        else:
+            data = self._open().read(size)
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        """Return the position in the content."""
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Go to a position relative to the start of the content."""
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can only seek from the start")
+        source = self._source
+        if source._buffer is None and offset != self._position:
+            if source.length is None:
+                raise io.UnsupportedOperation("The content can't seek")
+            self._open().seek(source._start + offset)
+        self._position = offset
+        return offset
+
+    def close(self):
+        """Close the file, if the reader opened it."""
+        if self._file is not None and self._source.path is not None:
+            self._file.close()
+        self._file = None
@@ -24,12 +24,88 @@
 Support the v1/documents endpoint
 """
 
+import io
+import json
 import logging
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
 from urllib import parse
 from marklogic.utilities import PropertyLists
 from marklogic.client.exceptions import InvalidAPIRequest, UnsupportedOperation
-from requests.packages.urllib3.fields import RequestField
-from requests.packages.urllib3.filepost import encode_multipart_formdata
+from marklogic.client.exceptions import UnexpectedAPIResponse
+from marklogic.client.content import ContentReader, ContentSource
+from marklogic.client.multipart import MultipartBody, MultipartReader
+from marklogic.client.multipart import encode_multipart
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from xml.sax.saxutils import escape
+
+
+@lru_cache(maxsize=1024)
+def _serialize_metadata(quality, collections, permissions, properties,
+                        metadata_format):
+    """
+    Internal function to serialize metadata. Documents with the same
+    metadata share the same, cached, string.
+    """
+    if metadata_format == "json":
+        data = OrderedDict()
+        if quality is not None:
+            data['quality'] = int(quality)
+        if collections:
+            data['collections'] = list(collections)
+        if permissions:
+            capabilities = OrderedDict()
+            for role, capability in permissions:
+                capabilities.setdefault(role, []).append(capability)
+            data['permissions'] = [{'role-name': role,
+                                    'capabilities': capabilities[role]}
+                                   for role in capabilities]
+        if properties:
+            props = OrderedDict()
+            for name, value in properties:
+                if name not in props:
+                    props[name] = value
+                elif isinstance(props[name], list):
+                    props[name].append(value)
+                else:
+                    props[name] = [props[name], value]
+            data['properties'] = props
+        return json.dumps(data)
+
+    xml = ['<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api" '
+           'xmlns:prop="http://marklogic.com/xdmp/property">\n']
+
+    if quality is not None:
+        xml.append("<rapi:quality>{}</rapi:quality>\n".format(escape(quality)))
+
+    if collections:
+        xml.append("<rapi:collections>\n")
+        for collection in collections:
+            xml.append("<rapi:collection>{}</rapi:collection>\n"
+                       .format(escape(collection)))
+        xml.append("</rapi:collections>\n")
+
+    if permissions:
+        xml.append("<rapi:permissions>\n")
+        for role, capability in permissions:
+            xml.append("<rapi:permission>\n"
+                       "  <rapi:role-name>{}</rapi:role-name>\n"
+                       "  <rapi:capability>{}</rapi:capability>\n"
+                       "</rapi:permission>\n"
+                       .format(escape(role), escape(capability)))
+        xml.append("</rapi:permissions>\n")
+
+    if properties:
+        xml.append("<prop:properties>\n")
+        for name, value in properties:
+            xml.append("<{0}>{1}</{0}>\n".format(name, escape(str(value))))
+        xml.append("</prop:properties>\n")
+
+    xml.append("</rapi:metadata>")
+    return "".join(xml)
 
 class Documents(PropertyLists):
     """
@@ -46,10 +122,13 @@ class Documents(PropertyLists):
         else:
             self.connection = None
         self.logger = logging.getLogger("marklogic.client.documents")
+        self.max_url_length = 8000
+        self.max_in_flight = 4
 
         self._content = None
         self._metadata = None
         self._metadata_content_type = None
+        self._metadata_format = "xml"
         self.permissions = []
         self.properties = []
         self.transparams = []
@@ -473,6 +552,8 @@ class Documents(PropertyLists):
         Return None if arbitrary metadata has not been assigned.
         """
         if self._metadata_content_type is None:
+            if self._metadata_format == "json":
+                return "application/json"
             return "application/xml"
         else:
             return self._metadata_content_type
@@ -482,40 +563,35 @@ class Documents(PropertyLists):
 
         If arbitrary metadata was assigned, it is returned and the format
         parameter is ignored. If not, then metadata is returned as
-        an XML string.
+        an XML string, or a JSON string if the metadata format is "json".
+        Documents with the same metadata share one serialization.
         """
         if self._metadata:
             return self._metadata
 
-        xml = '<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api" ' \
-          + 'xmlns:prop="http://marklogic.com/xdmp/property">\n'
+        return _serialize_metadata(self._config.get('quality'),
+                                   tuple(self._config['collection']),
+                                   # The cache needs hashable pairs
+                                   tuple(tuple(pair)
+                                         for pair in self.permissions),
+                                   tuple(tuple(pair)
+                                         for pair in self.properties),
+                                   self._metadata_format)
 
-        if 'quality' in self._config:
-            xml += "<rapi:quality>{}</rapi:quality>\n".format(self._config['quality'])
-
-        if self._config['collection']:
-            xml += "<rapi:collections>\n"
-            for collection in self._config['collection']:
-                xml += "<rapi:collection>{}</rapi:collection>\n".format(collection)
-            xml += "</rapi:collections>\n"
-
-        if self.permissions:
-            xml += "<rapi:permissions>\n"
-            for pair in self.permissions:
-                xml += "<rapi:permission>\n"
-                xml += "  <rapi:role-name>{}</rapi:role-name>".format(pair[0])
-                xml += "  <rapi:capability>{}</rapi:capability>".format(pair[1])
-                xml += "</rapi:permission>\n"
-            xml += "</rapi:permissions>\n"
+    def set_metadata_format(self, metadata_format):
+        """Set the format, "xml" or "json", of the metadata.
 
-        if self.properties:
-            xml += "<prop:properties>\n"
-            for pair in self.properties:
-                xml += "<{}>{}</{}>\n".format(pair[0], pair[1], pair[0])
-            xml += "</rapi:properties>\n"
+        This applies to metadata built from the collections, permissions,
+        properties and quality, not to arbitrary metadata.
+        """
+        if metadata_format not in ["xml", "json"]:
+            raise InvalidAPIRequest("Metadata format must be 'xml' or 'json'")
+        self._metadata_format = metadata_format
+        return self
 
-        xml += "</rapi:metadata>"
-        return xml
+    def metadata_format(self):
+        """Get the format of the metadata."""
+        return self._metadata_format
 
     def set_content(self, data, content_type=None):
         """Set content.
@@ -523,12 +599,27 @@ class Documents(PropertyLists):
         For single documents, you can simply pass the data to the put method.
         However, if you want to use the BulkLoader, you must set the content
         before adding it to the bulk loader.
+
+        The data may be a string or bytes. It may also be a path object,
+        an open binary file, a memoryview or an mmap, in which case it is
+        wrapped in a :class:`marklogic.client.content.ContentSource` and
+        read only as it's sent.
         """
+        if ContentSource.wraps(data):
+            data = ContentSource(data)
         self._content = data
         if content_type is not None:
             self.set_content_type(content_type)
         return self
 
+    def set_content_file(self, filename, content_type=None):
+        """Set the content to the contents of a file.
+
+        The file is not read until the document is sent, and then only
+        a block at a time.
+        """
+        return self.set_content(ContentSource(filename), content_type)
+
     def content(self):
         """Return the content, if any"""
         return self._content
@@ -549,7 +640,7 @@ class Documents(PropertyLists):
         self.properties = []
         self.transparams = []
 
-    def get(self, uri=None, connection=None):
+    def get(self, uri=None, connection=None, stream=False):
         """
         Perform an HTTP GET on the document(s) described by this object.
 
@@ -557,18 +648,26 @@ class Documents(PropertyLists):
         in the object. If it isn't specified, the object URI(s) will be used.
 
         If more than one URI is specified, the response will be a
-        multipart/mixed payload.
+        multipart/mixed payload. If the URIs don't fit in a request URI of
+        max_url_length characters, they are read with several concurrent
+        requests and the parts of the responses are merged into one.
+
+        If stream is True, the response body is not read; see
+        :meth:`iter_get` to read it in chunks.
         """
         if connection is None:
             connection = self.connection
 
-        params = []
         if uri is None:
-            for uri in self._config['uri']:
-                params.append("uri=" + parse.quote(uri))
+            uris = self._config['uri']
         else:
-            params.append("uri=" + parse.quote(uri))
+            uris = [uri]
 
+        return self._get_uris(uris, connection, self._config['accept'], stream)
+
+    def _get_uris(self, uris, connection, accept, stream):
+        """Internal method to GET a list of URIs"""
+        params = []
         for key in ['database', 'format', 'transform', 'txid']:
             if key in self._config:
                 params.append("{}={}".format(key, self._config[key]))
@@ -579,12 +678,176 @@ class Documents(PropertyLists):
         for pair in self.transparams:
             params.append("trans:{}={}".format(pair[0], pair[1]))
 
-        uri = connection.client_uri("documents")
+        request_uris = self._split_uris(connection, uris, params)
+        if len(request_uris) == 1:
+            return connection.get(request_uris[0], accept=accept, stream=stream)
 
-        uri = uri + "?" + "&".join(params)
+        self.logger.debug("Reading {0} URIs in {1} requests"
+                          .format(len(uris), len(request_uris)))
+        responses = self._concurrently(
+            lambda uri: connection.get(uri, accept="multipart/mixed"),
+            request_uris)
+        return self._merge(responses)
 
-        response = connection.get(uri, accept=self._config['accept'])
-        return response
+    def _split_uris(self, connection, uris, params):
+        """
+        Internal method to build the request URIs for a list of document
+        URIs, splitting them so that no request URI is longer than
+        max_url_length.
+        """
+        base = connection.client_uri("documents") + "?"
+        suffix = "&".join(params)
+        request_uris = []
+        batch = []
+        length = len(base) + len(suffix)
+        for uri in uris:
+            param = "uri=" + parse.quote(uri)
+            if batch and length + len(param) + 1 > self.max_url_length:
+                request_uris.append(base + "&".join(batch + params))
+                batch = []
+                length = len(base) + len(suffix)
+            batch.append(param)
+            length += len(param) + 1
+        if batch or not request_uris:
+            request_uris.append(base + "&".join(batch + params))
+        return request_uris
+
+    def _concurrently(self, func, request_uris):
+        """Internal method to send several requests at once"""
+        workers = max(1, min(self.max_in_flight, len(request_uris)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, request_uris))
+
+    def _merge(self, responses):
+        """
+        Internal method to merge the multipart responses to several
+        requests into one response.
+        """
+        parts = []
+        first = None
+        for response in responses:
+            if response.status_code == 404:
+                continue
+            if first is None:
+                first = response
+            if MultipartReader.is_multipart(response):
+                reader = MultipartReader([response.content],
+                                         response.headers['content-type'])
+                for part in reader:
+                    parts.append((part.headers, part.content))
+                continue
+            # A request for one document may get just that document
+            uris = parse.parse_qs(parse.urlparse(response.url).query) \
+                        .get('uri', [])
+            if len(uris) != 1:
+                raise UnexpectedAPIResponse(
+                    "Expected a multipart response, got {0}".format(
+                        response.headers.get('content-type')))
+            parts.append(({'Content-Type': response.headers.get(
+                               'content-type', "application/octet-stream"),
+                           'Content-Disposition':
+                               'attachment; filename="{0}"; '
+                               'category=content'.format(uris[0])},
+                          response.content))
+        if first is None:
+            return responses[0]
+
+        body, content_type = encode_multipart(parts)
+        merged = Response()
+        merged.status_code = first.status_code
+        merged.reason = first.reason
+        merged.url = first.url
+        merged.request = first.request
+        merged.headers = CaseInsensitiveDict(first.headers)
+        merged.headers['content-type'] = content_type
+        merged.headers['content-length'] = str(len(body))
+        merged.headers.pop('content-encoding', None)
+        # The body is already read, but may still be streamed and closed
+        merged.raw = io.BytesIO(body)
+        merged._content = body
+        merged._content_consumed = True
+        return merged
+
+    def fetch(self, uris, batch_size=100, max_in_flight=4, ordered=True,
+              connection=None):
+        """
+        Read many documents, a batch at a time, with several batches
+        in flight at once.
+
+        The URIs may be any iterable; it is consumed as batches are
+        sent, so at most max_in_flight batches are held in memory.
+        The database, format, transform, transaction and categories of
+        this object apply to every batch.
+
+        Yields a (uri, metadata, content) tuple for each document found,
+        where metadata and content are bytes, or None if that category
+        wasn't requested. If ordered is True, documents are returned in
+        the order of uris; otherwise each batch is returned as soon as it
+        arrives. Documents that don't exist are skipped.
+        """
+        if connection is None:
+            connection = self.connection
+
+        uris = iter(uris)
+        pending = deque()
+
+        def submit():
+            batch = list(islice(uris, batch_size))
+            if not batch:
+                return False
+            pending.append(executor.submit(self._fetch_batch, batch,
+                                           connection))
+            return True
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            more = True
+            while more and len(pending) < max_in_flight:
+                more = submit()
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done = wait(pending, return_when=FIRST_COMPLETED).done
+                    future = done.pop()
+                    pending.remove(future)
+                documents = future.result()
+                if more:
+                    more = submit()
+                for document in documents:
+                    yield document
+
+    def _fetch_batch(self, uris, connection):
+        """Internal method to read one batch of documents"""
+        self.logger.debug("Fetching {0} documents".format(len(uris)))
+        response = self._get_uris(uris, connection, "multipart/mixed", True)
+        if response.status_code == 404:
+            return []
+
+        documents = []
+        with MultipartReader.from_response(response) as reader:
+            for uri, metadata, content in reader.documents():
+                if metadata is not None:
+                    metadata = metadata.content
+                if content is not None:
+                    content = content.content
+                documents.append((uri, metadata, content))
+        return documents
+
+    def iter_get(self, uri=None, connection=None, chunk_size=64 * 1024):
+        """
+        Perform an HTTP GET as for :meth:`get` and iterate over the body
+        of the response in chunks of at most chunk_size bytes.
+
+        Nothing is yielded if the document(s) are not found.
+        """
+        if connection is None:
+            connection = self.connection
+
+        response = self.get(uri, connection, stream=True)
+        if response.status_code == 404:
+            return
+        for chunk in connection.iter_content(response, chunk_size):
+            yield chunk
 
     def put(self, data=None, uri=None, connection=None):
         """
@@ -595,7 +858,8 @@ class Documents(PropertyLists):
         URI.
 
         The data must be specified. For application/json data, a Python
-        dictionary may be specified.
+        dictionary may be specified. File-backed content (see
+        :meth:`set_content`) is streamed.
         """
         if connection is None:
             connection = self.connection
@@ -604,6 +868,8 @@ class Documents(PropertyLists):
             if self._content is None:
                 raise InvalidAPIRequest("Attempt to upload doc with no content")
             data = self._content
+        elif ContentSource.wraps(data):
+            data = ContentSource(data)
 
         if uri is None:
             if len(self._config['uri']) != 1:
@@ -661,9 +927,15 @@ class Documents(PropertyLists):
 
         uri = uri + "?" + "&".join(params)
 
-        response = connection.put(uri, payload=data, \
-                                      content_type=self._config['content-type'], \
-                                      accept=self._config['accept'])
+        if isinstance(data, ContentSource):
+            data = data.open()
+        try:
+            response = connection.put(uri, payload=data, \
+                                          content_type=self._config['content-type'], \
+                                          accept=self._config['accept'])
+        finally:
+            if isinstance(data, ContentReader):
+                data.close()
         return response
 
     def _put_mixed(self, data, target, connection):
@@ -692,24 +964,23 @@ class Documents(PropertyLists):
             uri = uri + "?" + "&".join(params)
 
         datact = self._config['content-type']
-
-        fields = []
-        rf = RequestField(name="meta1", data=meta, filename=target)
-        rf.make_multipart(content_disposition='attachment; category=metadata', \
-                              content_type=metact)
-        fields.append(rf)
-
-        rf = RequestField(name="data1", data=data, filename=target)
-        rf.make_multipart(content_disposition='attachment', \
-                              content_type=datact)
-        fields.append(rf)
-
-        post_body, content_type = encode_multipart_formdata(fields)
-
-        post_ct = ''.join(('multipart/mixed',) \
-                              + content_type.partition(';')[1:])
-
-        response = connection.post(uri, payload=post_body, content_type=post_ct)
+        if isinstance(data, (dict, list)):
+            data = json.dumps(data)
+
+        disposition = 'attachment; filename="{}"'.format(target)
+        body = MultipartBody([
+            ({'Content-Disposition': disposition + '; category=metadata',
+              'Content-Type': metact}, meta),
+            ({'Content-Disposition': disposition,
+              'Content-Type': datact}, data)])
+
+        # This replaces a single document, so it's as idempotent as a PUT
+        try:
+            response = connection.post(uri, payload=body,
+                                       content_type=body.content_type,
+                                       idempotent=True)
+        finally:
+            body.close()
 
         return response
 
@@ -719,18 +990,22 @@ class Documents(PropertyLists):
 
         If a URI is specified, it will be used irrespective of the URI setting
         in the object. If it isn't specified, all of the URIs specified in
-        the object will be deleted.
+        the object will be deleted. If the URIs don't fit in a request URI
+        of max_url_length characters, they are deleted with several
+        concurrent requests. Every request is completed before an error
+        from any of them is raised. Otherwise, the first response that
+        isn't a success (a 404) is returned, or else the response to the
+        first request. The number of requests is logged.
         """
         if connection is None:
             connection = self.connection
 
-        params = []
         if uri is None:
-            for uri in self._config['uri']:
-                params.append("uri=" + uri)
+            uris = self._config['uri']
         else:
-            params.append("uri=" + uri)
+            uris = [uri]
 
+        params = []
         for key in ['database', 'txid', 'temporal-collection', 'system-time']:
             if key in self._config:
                 params.append("{}={}".format(key, self._config[key]))
@@ -738,10 +1013,15 @@ class Documents(PropertyLists):
         for value in self._config['category']:
             params.append("category={}".format(value))
 
-        uri = connection.client_uri("documents")
+        request_uris = self._split_uris(connection, uris, params)
+        if len(request_uris) == 1:
+            return connection.delete(request_uris[0])
 
-        uri = uri + "?" + "&".join(params)
+        responses = self._concurrently(connection.delete, request_uris)
 
-        response = connection.delete(uri)
-
-        return response
+        self.logger.debug("Deleted {0} URIs in {1} requests"
+                          .format(len(uris), len(responses)))
+        for response in responses:
+            if response.status_code >= 300:
+                return response
+        return responses[0]
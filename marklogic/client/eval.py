@@ -122,8 +122,12 @@ class Eval:
         """Clear the Eval object; return it to its initial state."""
         self._config = {}
 
-    def eval(self, connection=None):
-        """Perform the evaluation specified."""
+    def eval(self, connection=None, stream=False):
+        """Perform the evaluation specified.
+
+        If stream is True, the response body is not read; decode it with
+        a :class:`marklogic.client.multipart.MultipartReader`.
+        """
         if connection is None:
             connection = self.connection
 
@@ -138,6 +142,7 @@ class Eval:
         uri = connection.client_uri("eval")
         response = connection.post(uri, payload=data, \
                                        content_type="application/x-www-form-urlencoded", \
-                                       accept="multipart/mixed")
+                                       accept="multipart/mixed",
+                                       stream=stream)
         return response
 
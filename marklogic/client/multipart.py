@@ -0,0 +1,469 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Incremental decoding of multipart/mixed responses, and encoding of
+multipart/mixed request bodies
+"""
+
+import io
+import re
+import uuid
+from requests.structures import CaseInsensitiveDict
+from marklogic.client.content import ContentSource
+from marklogic.client.exceptions import UnexpectedAPIResponse
+
+_DISPOSITION = re.compile(r'([\w-]+)=(?:"([^"]*)"|([^;\s]*))')
+
+
+def parse_disposition(value):
+    """
+    Parse the parameters of a Content-Disposition header into a
+    dictionary, for example ``filename`` and ``category``.
+    """
+    result = {}
+    if value is not None:
+        for match in _DISPOSITION.finditer(value):
+            if match.group(2) is not None:
+                result[match.group(1)] = match.group(2)
+            else:
+                result[match.group(1)] = match.group(3)
+    return result
+
+
+def _part_head(boundary, headers):
+    head = "--{0}\r\n".format(boundary)
+    for name in headers:
+        head += "{0}: {1}\r\n".format(name, headers[name])
+    return (head + "\r\n").encode("utf-8")
+
+
+def iter_multipart(parts, boundary, chunk_size=64 * 1024):
+    """
+    Encode a multipart/mixed body a piece at a time.
+
+    The parts are (headers, content) pairs, where the content is a
+    string, bytes, or a :class:`marklogic.client.content.ContentSource`.
+    Each part's headers are encoded only when it is reached, and the
+    content of a ContentSource is read `chunk_size` bytes at a time, so
+    the body can be sent while it is being encoded.
+    """
+    for headers, content in parts:
+        yield _part_head(boundary, headers)
+        if isinstance(content, ContentSource):
+            reader = content.open()
+            try:
+                while True:
+                    data = reader.read(chunk_size)
+                    if not len(data):
+                        break
+                    yield data
+            finally:
+                reader.close()
+        else:
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            view = memoryview(content)
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+        yield b"\r\n"
+    yield "--{0}--\r\n".format(boundary).encode("ascii")
+
+
+def encode_multipart(parts):
+    """
+    Encode a list of (headers, body) pairs as a multipart/mixed body.
+
+    :return: The body and its content type
+    """
+    boundary = uuid.uuid4().hex
+    sized = []
+    for headers, content in parts:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        headers = {name: headers[name] for name in headers
+                   if name.lower() != "content-length"}
+        headers['Content-Length'] = len(content)
+        sized.append((headers, content))
+    body = b"".join(iter_multipart(sized, boundary))
+    return body, "multipart/mixed; boundary=" + boundary
+
+
+class MultipartBody:
+    """
+    A multipart/mixed request body that is encoded as it is read.
+
+    The parts are (headers, content) pairs, where the content is a
+    string, bytes, or a :class:`marklogic.client.content.ContentSource`.
+    The body is never built as one large ``bytes`` object: it is read
+    from :func:`iter_multipart`, so encoding overlaps with sending.
+
+    The body is a file-like object. If the length of every part is
+    known, requests sends it with a Content-Length; if not, it is sent
+    with chunked transfer encoding. Iterating over the body yields the
+    encoded pieces; pass ``iter(body)`` to force chunked transfer
+    encoding. The file-like body can go back to the start, so a request
+    can be retried or re-sent after an authentication challenge.
+    """
+    def __init__(self, parts, boundary=None, chunk_size=64 * 1024):
+        if boundary is None:
+            boundary = uuid.uuid4().hex
+        self.boundary = boundary
+        self.content_type = "multipart/mixed; boundary=" + boundary
+        self.chunk_size = chunk_size
+        self._parts = []
+        self.length = 0
+        for headers, content in parts:
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            self._parts.append((headers, content))
+            if self.length is not None:
+                if isinstance(content, ContentSource) \
+                        and content.length is None:
+                    self.length = None
+                else:
+                    self.length += (len(_part_head(boundary, headers))
+                                    + len(content) + 2)
+        if self.length is not None:
+            self.length += len(boundary) + 6
+
+        self._chunks = None
+        self._pending = None
+        self._position = 0
+
+    def __len__(self):
+        return self.length or 0
+
+    def __bool__(self):
+        # A body of unknown length is still a body
+        return True
+
+    def __iter__(self):
+        return iter_multipart(self._parts, self.boundary, self.chunk_size)
+
+    def read(self, size=-1):
+        """
+        Read at most `size` bytes of the body, or all of the rest of
+        it if `size` is negative.
+        """
+        if size is None or size < 0:
+            data = bytearray()
+            while True:
+                chunk = self.read(self.chunk_size)
+                if not chunk:
+                    return bytes(data)
+                data += chunk
+
+        if self._chunks is None:
+            self._chunks = iter(self)
+        while self._pending is None or not len(self._pending):
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return b""
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        """Return the position in the body."""
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Go back to the start of the body."""
+        if offset == self._position and whence == io.SEEK_SET:
+            return offset
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can only seek to the start")
+        self._reset()
+        return 0
+
+    def _reset(self):
+        if self._chunks is not None:
+            # Closing the generator closes any file it's reading
+            self._chunks.close()
+        self._chunks = None
+        self._pending = None
+        self._position = 0
+
+    def close(self):
+        """
+        Close any file that is being read and let go of the content;
+        the body can't be read after it is closed.
+        """
+        self._reset()
+        self._parts = []
+
+
+def _boundary(content_type):
+    for param in content_type.split(";")[1:]:
+        name, sep, value = param.strip().partition("=")
+        if sep and name.lower() == "boundary":
+            return value.strip('"')
+    raise UnexpectedAPIResponse("No boundary in " + content_type)
+
+
+class MultipartPart:
+    """
+    One part of a multipart response.
+
+    The headers are available as soon as the part is returned; the body
+    is read from the response as it is consumed with :meth:`read` or
+    :meth:`iter_content`. Reading :attr:`content` or :attr:`text` reads
+    the whole body into memory. A part must be consumed before the next
+    part is read; whatever is left of it is skipped.
+    """
+    def __init__(self, reader, headers):
+        self._reader = reader
+        self.headers = headers
+        self.disposition = parse_disposition(
+            headers.get('content-disposition'))
+        self.length = 0
+        self._content = None
+        self._offset = 0
+
+    @property
+    def content_type(self):
+        """The content type of the part."""
+        return self.headers.get('content-type')
+
+    @property
+    def filename(self):
+        """The filename (the document URI), if any."""
+        return self.disposition.get('filename')
+
+    @property
+    def category(self):
+        """The category, ``content`` or ``metadata``, of the part."""
+        return self.disposition.get('category', "content")
+
+    def read(self, size=-1):
+        """
+        Read at most `size` bytes of the body, or all of the rest of
+        it if `size` is negative. Returns an empty string at the end.
+        """
+        if self._content is not None:
+            # The body is in memory; read it from there
+            end = len(self._content)
+            if size is not None and size >= 0:
+                end = min(end, self._offset + size)
+            data = self._content[self._offset:end]
+            self._offset = end
+            return data
+        data = self._reader._read_body(self, size)
+        self.length += len(data)
+        return data
+
+    def iter_content(self, chunk_size=64 * 1024):
+        """Iterate over the body in chunks of at most chunk_size bytes."""
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    @property
+    def content(self):
+        """The whole body, read into memory."""
+        if self._content is None:
+            self._content = self._reader._read_body(self, -1)
+            self.length += len(self._content)
+        return self._content
+
+    @property
+    def text(self):
+        """The whole body, decoded."""
+        encoding = "utf-8"
+        content_type = self.content_type
+        if content_type is not None and "charset=" in content_type:
+            encoding = content_type.split("charset=")[1].split(";")[0]
+        return self.content.decode(encoding.strip('"'))
+
+    def close(self):
+        """Skip whatever is left of the body."""
+        self._reader._skip(self)
+
+
+class MultipartReader:
+    """
+    The MultipartReader class decodes a multipart/mixed body as it
+    arrives, rather than reading all of it first.
+
+    Iterating over a reader yields :class:`MultipartPart` objects in
+    order; :meth:`documents` pairs the metadata and content parts of
+    a v1/documents response. Only the data not yet consumed, at most a
+    chunk or so, is held in memory.
+
+    Use :meth:`from_response` with a response requested with
+    ``stream=True`` to read from the socket. Close the reader when done
+    so that the response's connection is returned to the pool.
+    """
+    def __init__(self, chunks, content_type, response=None):
+        self._chunks = iter(chunks)
+        self._delimiter = b"\r\n--" + _boundary(content_type).encode("ascii")
+        # A leading CRLF lets the first delimiter match like the others
+        self._buffer = bytearray(b"\r\n")
+        self._response = response
+        self._part = None
+        self._part_done = True
+        self._started = False
+        self._finished = False
+
+    @classmethod
+    def from_response(cls, response, chunk_size=64 * 1024):
+        """Create a reader for the body of a multipart response."""
+        return cls(response.iter_content(chunk_size),
+                   response.headers.get('content-type', ""), response)
+
+    @classmethod
+    def is_multipart(cls, response):
+        """Return True if the response has a multipart/mixed body."""
+        return response.headers.get('content-type', "") \
+                       .startswith("multipart/mixed")
+
+    def close(self):
+        """Close the response."""
+        self._finished = True
+        if self._response is not None:
+            self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __iter__(self):
+        while True:
+            part = self.next_part()
+            if part is None:
+                return
+            yield part
+
+    def _fill(self):
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += chunk
+                return
+        raise UnexpectedAPIResponse("Multipart body ends unexpectedly")
+
+    def _find(self, data):
+        while True:
+            index = self._buffer.find(data)
+            if index >= 0:
+                return index
+            self._fill()
+
+    def next_part(self):
+        """Return the next part, or None after the last one."""
+        if self._finished:
+            return None
+        if self._part is not None:
+            self._skip(self._part)
+
+        if not self._started:
+            self._started = True
+            index = self._find(self._delimiter)
+            del self._buffer[:index + len(self._delimiter)]
+
+        while len(self._buffer) < 2:
+            self._fill()
+        if self._buffer[:2] == b"--":
+            # Read the (short) epilogue, so the whole body is consumed
+            for chunk in self._chunks:
+                pass
+            self.close()
+            return None
+
+        # Skip any padding after the delimiter, then read the headers
+        index = self._find(b"\r\n")
+        del self._buffer[:index + 2]
+        headers = CaseInsensitiveDict()
+        while True:
+            index = self._find(b"\r\n")
+            line = bytes(self._buffer[:index]).decode("utf-8")
+            del self._buffer[:index + 2]
+            if not line:
+                break
+            name, sep, value = line.partition(":")
+            headers[name.strip()] = value.strip()
+
+        self._part = MultipartPart(self, headers)
+        self._part_done = False
+        return self._part
+
+    def _read_body(self, part, size):
+        if part is not self._part or self._part_done:
+            return b""
+        if size is None or size < 0:
+            data = bytearray()
+            while True:
+                chunk = self._read_body(part, 64 * 1024)
+                if not chunk:
+                    return bytes(data)
+                data += chunk
+
+        keep = len(self._delimiter) - 1
+        while True:
+            index = self._buffer.find(self._delimiter)
+            if index >= 0:
+                if index <= size:
+                    data = bytes(self._buffer[:index])
+                    del self._buffer[:index + len(self._delimiter)]
+                    self._part_done = True
+                    return data
+                data = bytes(self._buffer[:size])
+                del self._buffer[:size]
+                return data
+            available = len(self._buffer) - keep
+            if available > 0:
+                count = min(size, available)
+                data = bytes(self._buffer[:count])
+                del self._buffer[:count]
+                return data
+            self._fill()
+
+    def _skip(self, part):
+        while self._read_body(part, 64 * 1024):
+            pass
+
+    def documents(self):
+        """
+        Iterate over the documents in a v1/documents response.
+
+        Yields a (uri, metadata, content) tuple for each document, where
+        metadata is the metadata part, already read, or None if metadata
+        wasn't requested, and content is the content part, to be read as
+        a stream, or None if content wasn't requested.
+        """
+        metadata = None
+        for part in self:
+            if part.category == "metadata":
+                if metadata is not None:
+                    yield metadata.filename, metadata, None
+                # Read the metadata now; the reader moves past it
+                part.content
+                metadata = part
+                continue
+            if metadata is not None and metadata.filename != part.filename:
+                yield metadata.filename, metadata, None
+                metadata = None
+            yield part.filename, metadata, part
+            metadata = None
+        if metadata is not None:
+            yield metadata.filename, metadata, None
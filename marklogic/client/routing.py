@@ -0,0 +1,159 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Routing documents to the hosts of the forests they belong in.
+"""
+
+import json
+import logging
+import threading
+from marklogic.client.eval import Eval
+from marklogic.client.exceptions import InvalidAPIRequest
+from marklogic.client.multipart import MultipartReader
+from marklogic.models.database import Database
+from marklogic.models.forest import Forest
+
+# Returns the name of the forest each URI is assigned to, in order.
+_ASSIGN = """xquery version '1.0-ml';
+declare variable $uris as xs:string external;
+declare variable $policy as xs:string external;
+let $forests := xdmp:database-forests(xdmp:database())
+let $count := count($forests)
+for $uri in json:array-values(xdmp:from-json-string($uris))
+return xdmp:forest-name($forests[xdmp:document-assign($uri, $count, $policy)])
+"""
+
+class ForestRouter:
+    """
+    The ForestRouter class finds the host of the forest that each
+    document will be stored in, so that a
+    :class:`marklogic.client.bulkloader.BulkLoader` can send the
+    document to that host and spare the cluster from forwarding it.
+
+    Only the *bucket* and *legacy* assignment policies place a document
+    by its URI alone. For a database with another policy, or with a
+    single host, the router routes nothing and documents go to the host
+    of the connection.
+
+    By default the forests are assigned by the server, which knows the
+    hash of each policy: one eval per batch sends the URIs (and nothing
+    else) and returns the forest names. If `placement` is given, it is
+    called with a URI and the list of forest names and returns the name
+    of a forest, and no eval is made.
+
+    The forests are not named in the uploads, so the server still has
+    the last word on where a document goes; a document routed to the
+    wrong host is forwarded, as it would have been without a router.
+    """
+    DETERMINISTIC = ['bucket', 'legacy']
+
+    def __init__(self, connection, database, placement=None):
+        self.connection = connection
+        self.database = database
+        self.placement = placement
+        self.logger = logging.getLogger("marklogic.client.routing")
+        self._lock = threading.Lock()
+        self.policy = None
+        self.forest_hosts = {}
+        self.forest_names = []
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read the assignment policy, the forests of the database and
+        their hosts again, for example after forests have been added.
+        """
+        database = Database.lookup(self.connection, self.database)
+        if database is None:
+            raise InvalidAPIRequest("No such database: {0}"
+                                    .format(self.database))
+        policy = database.assignment_policy()
+        if isinstance(policy, dict):
+            policy = policy.get('policy-name')
+        if policy is None:
+            policy = "bucket"
+
+        names = database.forest_names() or []
+        if isinstance(names, str):
+            names = [names]
+        forest_hosts = {}
+        for name in names:
+            forest = Forest.lookup(self.connection, name)
+            if forest is not None:
+                forest_hosts[name] = forest.host()
+
+        with self._lock:
+            self.policy = policy
+            self.forest_names = list(names)
+            self.forest_hosts = forest_hosts
+
+        self.logger.debug("Routing {0} with the {1} policy: {2}"
+                          .format(self.database, policy, forest_hosts))
+        return self
+
+    def enabled(self):
+        """
+        Return True if routing can send documents anywhere but the
+        host of the connection.
+        """
+        with self._lock:
+            return (self.policy in self.DETERMINISTIC
+                    and len(set(self.forest_hosts.values())) > 1)
+
+    def forests(self, uris, connection=None):
+        """
+        Return the name of the forest that each of the URIs is assigned
+        to, in the same order.
+        """
+        with self._lock:
+            names = list(self.forest_names)
+            policy = self.policy
+        if self.placement is not None:
+            return [self.placement(uri, names) for uri in uris]
+
+        if connection is None:
+            connection = self.connection
+
+        mleval = Eval(connection)
+        mleval.set_xquery(_ASSIGN)
+        mleval.set_database(self.database)
+        mleval.set_vars({'uris': json.dumps(list(uris)), 'policy': policy})
+        response = mleval.eval(stream=True)
+
+        forests = []
+        try:
+            if MultipartReader.is_multipart(response):
+                for part in MultipartReader.from_response(response):
+                    forests.append(part.text)
+        finally:
+            response.close()
+
+        if len(forests) != len(uris):
+            raise RuntimeError("Unexpected reply to forest assignment!?")
+        return forests
+
+    def hosts(self, uris, connection=None):
+        """
+        Return the host that each of the URIs should be sent to, in the
+        same order. The host is None where routing doesn't apply.
+        """
+        if not self.enabled():
+            return [None] * len(uris)
+        with self._lock:
+            forest_hosts = dict(self.forest_hosts)
+        return [forest_hosts.get(forest)
+                for forest in self.forests(uris, connection)]
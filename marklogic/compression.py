@@ -0,0 +1,210 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compression of request and response bodies.
+"""
+
+import gzip
+import io
+import json
+import threading
+import zlib
+from marklogic.client.multipart import MultipartBody
+from marklogic.exceptions import InvalidAPIRequest
+
+
+class _CompressedBody:
+    """
+    A request body that compresses a :class:`MultipartBody` as it is
+    sent, with chunked transfer encoding.
+
+    Each iteration compresses the body again from the start, so the
+    request can be retried or re-sent after an authentication challenge.
+    """
+    def __init__(self, compression, body):
+        self._compression = compression
+        self._body = body
+        self._counted = False
+
+    def __bool__(self):
+        # A body of unknown length is still a body
+        return True
+
+    def __iter__(self):
+        compressor = self._compression._compressor()
+        length = 0
+        wire = 0
+        for chunk in self._body:
+            length += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                wire += len(data)
+                yield data
+        data = compressor.flush()
+        wire += len(data)
+        yield data
+        if not self._counted:
+            self._counted = True
+            self._compression._count(request_bytes=length,
+                                     request_wire_bytes=wire)
+
+    def tell(self):
+        return 0
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can only seek to the start")
+        return 0
+
+
+class Compression:
+    """
+    The Compression class compresses request bodies and negotiates
+    compressed responses for a connection.
+
+    Request bodies of at least `threshold` bytes are compressed with
+    `encoding` (``gzip`` or ``deflate``) and sent with a
+    ``Content-Encoding`` header; smaller bodies are sent as is. A
+    multipart body that is encoded as it is sent
+    (:class:`marklogic.client.multipart.MultipartBody`) is compressed as
+    it is sent too, with chunked transfer encoding, unless it is known
+    to be smaller than `threshold`. Other bodies that are streamed from
+    files or iterators are sent as is, and counted as skipped. If
+    `compress_requests` is False, only responses are compressed.
+
+    Responses are requested with an ``Accept-Encoding`` of
+    `accept_encoding` and decompressed transparently.
+
+    The compression achieved is available from :meth:`stats`.
+    """
+    ENCODINGS = ["gzip", "deflate"]
+
+    def __init__(self, encoding="gzip", threshold=1024, level=6,
+                 compress_requests=True, accept_encoding="gzip, deflate"):
+        if encoding not in self.ENCODINGS:
+            raise InvalidAPIRequest("Unsupported encoding: {0}"
+                                    .format(encoding))
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self.compress_requests = compress_requests
+        self.accept_encoding = accept_encoding
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Reset the statistics."""
+        with self._lock:
+            self._stats = {'requests-compressed': 0,
+                           'requests-skipped': 0,
+                           'request-bytes': 0,
+                           'request-wire-bytes': 0,
+                           'responses-compressed': 0,
+                           'response-bytes': 0,
+                           'response-wire-bytes': 0}
+
+    def _count(self, **kwargs):
+        with self._lock:
+            for key in kwargs:
+                self._stats[key.replace("_", "-")] += kwargs[key]
+
+    def _encode(self, body):
+        if self.encoding == "gzip":
+            return gzip.compress(body, self.level)
+        return zlib.compress(body, self.level)
+
+    def _compressor(self):
+        # 16 + MAX_WBITS writes a gzip header and trailer
+        if self.encoding == "gzip":
+            return zlib.compressobj(self.level, zlib.DEFLATED,
+                                    16 + zlib.MAX_WBITS)
+        return zlib.compressobj(self.level)
+
+    def prepare(self, kwargs):
+        """
+        Compress the body of a request, if appropriate.
+
+        :param kwargs: The keyword arguments of the request; the body
+        and headers are updated in place
+        """
+        headers = kwargs.get('headers')
+        if headers is None:
+            headers = {}
+            kwargs['headers'] = headers
+        headers['accept-encoding'] = self.accept_encoding
+
+        if not self.compress_requests:
+            return
+
+        if 'json' in kwargs:
+            body = json.dumps(kwargs['json']).encode("utf-8")
+        else:
+            body = kwargs.get('data')
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+
+        if isinstance(body, MultipartBody):
+            if ('content-encoding' in headers or (body.length is not None
+                                                  and body.length
+                                                  < self.threshold)):
+                self._count(requests_skipped=1)
+                return
+            kwargs['data'] = _CompressedBody(self, body)
+            headers['content-encoding'] = self.encoding
+            self._count(requests_compressed=1)
+            return
+        if not isinstance(body, (bytes, bytearray)):
+            if hasattr(body, 'read') or hasattr(body, '__next__'):
+                self._count(requests_skipped=1)
+            return
+        if len(body) < self.threshold or 'content-encoding' in headers:
+            self._count(requests_skipped=1)
+            return
+
+        compressed = self._encode(body)
+        kwargs.pop('json', None)
+        kwargs['data'] = compressed
+        headers['content-encoding'] = self.encoding
+        self._count(requests_compressed=1, request_bytes=len(body),
+                    request_wire_bytes=len(compressed))
+
+    def record_response(self, response):
+        """
+        Record the compression of a response whose body has been read.
+        """
+        encoding = response.headers.get('content-encoding')
+        length = response.headers.get('content-length')
+        if encoding not in self.ENCODINGS or length is None:
+            return
+        self._count(responses_compressed=1,
+                    response_bytes=len(response.content),
+                    response_wire_bytes=int(length))
+
+    def stats(self):
+        """
+        Return the compression statistics, including the ratio of
+        uncompressed to compressed bytes for requests and responses.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        for kind in ['request', 'response']:
+            wire = stats[kind + '-wire-bytes']
+            if wire:
+                stats[kind + '-ratio'] = stats[kind + '-bytes'] / float(wire)
+            else:
+                stats[kind + '-ratio'] = None
+        return stats
@@ -23,15 +23,15 @@ import json
 import logging
 import requests
 import time
-from http.client import BadStatusLine
+from marklogic.auth import DigestAuth
+from marklogic.exceptions import CircuitOpenError
 from marklogic.exceptions import UnexpectedManagementAPIResponse
 from marklogic.exceptions import UnauthorizedAPIRequest
-from requests.auth import HTTPDigestAuth
+from marklogic.restart import RestartWaiter
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
-from requests.exceptions import ReadTimeout
-from requests.packages.urllib3.exceptions import ProtocolError
-from requests.packages.urllib3.exceptions import ReadTimeoutError
 from requests.packages import urllib3
+from urllib.parse import urlparse
 
 """
 Connection related classes and method to connect to MarkLogic.
@@ -42,10 +42,52 @@ class Connection:
     """
     The connection class encapsulates the information to connect to
     a MarkLogic server.
+
+    Requests are sent through a pooled :class:`requests.Session`, so
+    TCP (and TLS) connections are kept alive and reused across calls.
+    The `pool_connections` parameter is the number of hosts for which
+    a pool is kept; `pool_maxsize` is the number of connections kept
+    open to each host. If `pooling` is False, every request opens
+    a fresh connection, which was the historical behavior.
+
+    Pass an existing `session` to share a pool between connections,
+    for example between connections to different hosts in a cluster.
+
+    If `preauthenticate` is True and `auth` is a
+    :class:`marklogic.auth.DigestAuth`, a request with a body that
+    goes to a server for which no nonce is cached is preceded by
+    a HEAD request to obtain one, so the body is only uploaded once.
+
+    A :class:`marklogic.tracing.Tracer` passed as `tracer` records an
+    event for each request. A :class:`marklogic.retry.RetryPolicy`
+    passed as `retry_policy` retries transient failures; the methods
+    that send requests accept `idempotent=True` to allow retrying
+    requests (such as POST) that the policy would otherwise not retry.
+    A :class:`marklogic.metrics.Metrics` passed as `metrics` records
+    latency, status and byte counts for each endpoint. A
+    :class:`marklogic.compression.Compression` passed as `compression`
+    compresses large request bodies and negotiates compressed responses.
+    A :class:`marklogic.cache.ResponseCache` passed as `cache` keeps the
+    models read by :meth:`get_model` and revalidates them with etags.
+    The :class:`marklogic.restart.RestartWaiter` passed as
+    `restart_waiter` decides how long to wait for hosts to restart.
+    A :class:`marklogic.breaker.CircuitBreaker` passed as `breaker`
+    fails requests to a host fast once it has failed repeatedly.
+    A :class:`marklogic.recording.Recorder` passed as `recorder` captures
+    every request and response, so they can be replayed without a server.
+
+    Payload logging on the
+    ``marklogic.connection.payloads`` logger costs nothing unless that
+    logger is enabled for debug output.
     """
     def __init__(self, host, auth,
                  protocol="http", port=8000, management_port=8002,
-                 root="manage", version="v2", client_version="v1"):
+                 root="manage", version="v2", client_version="v1",
+                 pooling=True, pool_connections=10, pool_maxsize=10,
+                 session=None, preauthenticate=False, tracer=None,
+                 retry_policy=None, metrics=None, compression=None,
+                 cache=None, restart_waiter=None, breaker=None,
+                 recorder=None):
         self.host = host
         self.auth = auth
         self.protocol = protocol
@@ -60,6 +102,151 @@ class Connection:
         self.verify = False # Danger, Will Robinson!
         urllib3.disable_warnings()
 
+        self.pooling = pooling
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.preauthenticate = preauthenticate
+        self.tracer = tracer
+        self.retry_policy = retry_policy
+        self.metrics = metrics
+        self.compression = compression
+        self.cache = cache
+        self.breaker = breaker
+        self.recorder = recorder
+        if restart_waiter is None:
+            restart_waiter = RestartWaiter()
+        self.restart_waiter = restart_waiter
+        self._host_ids = {}
+        if session is None:
+            session = self._make_session()
+        self.session = session
+
+    def _make_session(self):
+        """Create the session used to send requests."""
+        session = requests.Session()
+        if self.pooling:
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize)
+        else:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.headers['connection'] = 'close'
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        """Close the pooled connections held by this connection."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _send(self, method, uri, idempotent=None, **kwargs):
+        """Send a request, retrying it if the retry policy allows."""
+        if self.compression is not None:
+            self.compression.prepare(kwargs)
+
+        policy = self.retry_policy
+        if policy is None:
+            return self._send_once(method, uri, **kwargs)
+
+        if policy.budget is not None:
+            policy.budget.deposit()
+
+        body = kwargs.get('data')
+        position = None
+        if hasattr(body, 'seek') and hasattr(body, 'tell'):
+            position = body.tell()
+        elif not (body is None or isinstance(body, (str, bytes, bytearray))):
+            idempotent = False  # an iterator can't be sent twice
+
+        if not policy.applies(method, kwargs.get('headers'), idempotent):
+            return self._send_once(method, uri, **kwargs)
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self._send_once(method, uri, **kwargs)
+                if response.status_code < 500:
+                    return response
+                if not policy.should_retry(attempt, response=response):
+                    return response
+            except policy.ERRORS as err:
+                if not policy.should_retry(attempt, error=err):
+                    raise
+
+            delay = policy.delay(attempt, response)
+            attempt += 1
+            self.logger.debug("Retry {0} of {1} {2} in {3:.2f}s..."
+                              .format(attempt, method, uri, delay))
+            if response is not None:
+                response.close()
+            if position is not None:
+                body.seek(position)
+            time.sleep(delay)
+
+    def _send_once(self, method, uri, **kwargs):
+        """Send a request through the session and save the response."""
+        breaker = self.breaker
+        if breaker is not None:
+            host = urlparse(uri).hostname
+            breaker.acquire(host)
+        if (self.preauthenticate and ('data' in kwargs or 'json' in kwargs)
+                and isinstance(self.auth, DigestAuth)
+                and not self.auth.has_challenge(uri)):
+            self.logger.debug("Preauthenticating {0}...".format(uri))
+            start = time.time()
+            try:
+                self.session.head(uri, auth=self.auth, verify=self.verify)
+            except Exception as err:
+                # Release the request let through by the breaker
+                if breaker is not None:
+                    breaker.record(host, time.time() - start, error=err)
+                raise
+        tracer = self.tracer
+        if tracer is not None and not tracer.sampled():
+            tracer = None
+        metrics = self.metrics
+        if tracer is None and metrics is None and breaker is None:
+            response = self.session.request(method, uri, auth=self.auth,
+                                            verify=self.verify, **kwargs)
+        else:
+            if metrics is not None:
+                key = metrics.started(method, uri)
+            start = time.time()
+            try:
+                response = self.session.request(method, uri, auth=self.auth,
+                                                verify=self.verify, **kwargs)
+            except Exception as err:
+                elapsed = time.time() - start
+                if tracer is not None:
+                    tracer.trace(method, uri, None, None, elapsed, error=err)
+                if metrics is not None:
+                    metrics.finished(key, None, None, elapsed, error=err)
+                if breaker is not None:
+                    breaker.record(host, elapsed, error=err)
+                raise
+            elapsed = time.time() - start
+            if tracer is not None:
+                tracer.trace(method, uri, response.request, response, elapsed,
+                             streamed=kwargs.get('stream', False))
+            if metrics is not None:
+                metrics.finished(key, response.request, response, elapsed,
+                                 streamed=kwargs.get('stream', False))
+            if breaker is not None:
+                breaker.record(host, elapsed, response=response)
+        if self.compression is not None and not kwargs.get('stream'):
+            self.compression.record_response(response)
+        if self.recorder is not None:
+            self.recorder.record(response, kwargs.get('stream', False))
+        self.response = response
+        return response
+
     # You'd expect parameters to be a dictionary, but then it couldn't
     # have repeated keys, so it's an array.
     def uri(self, relation, name=None,
@@ -106,27 +293,92 @@ class Connection:
 
         return uri
 
-    def head(self, uri, accept="application/json"):
+    def _log_payload(self, headers, payload=None, content_type=None):
+        """Log request headers and payload if payload logging is enabled."""
+        if not self.payload_logger.isEnabledFor(logging.DEBUG):
+            return
+        self.payload_logger.debug("Headers:")
+        self.payload_logger.debug(json.dumps(headers, indent=2))
+        if payload is not None:
+            self.payload_logger.debug("Payload:")
+            if isinstance(payload, (dict, list)):
+                self.payload_logger.debug(json.dumps(payload, indent=2))
+            else:
+                self.payload_logger.debug(payload)
+
+    def head(self, uri, accept="application/json", idempotent=None):
         self.logger.debug("HEAD {0}...".format(uri))
-        self.response = requests.head(uri, auth=self.auth, verify=self.verify)
-        return self._response()
+        response = self._send("HEAD", uri, idempotent=idempotent)
+        return self._response(response)
+
+    def get(self, uri, accept="application/json", headers=None, stream=False,
+            idempotent=None):
+        """Perform an HTTP GET.
 
-    def get(self, uri, accept="application/json", headers=None):
+        If `stream` is True, the response body is not read. Iterate over
+        it with :meth:`iter_content`, or close the response when done,
+        so that its connection is returned to the pool.
+        """
         if headers is None:
             headers = {'accept': accept}
         else:
             headers['accept'] = accept
 
         self.logger.debug("GET  {0}...".format(uri))
-        self.payload_logger.debug("Headers:")
-        self.payload_logger.debug(json.dumps(headers, indent=2))
+        self._log_payload(headers)
+
+        response = self._send("GET", uri, idempotent=idempotent,
+                              headers=headers, stream=stream)
+        return self._response(response, stream)
+
+    def get_model(self, uri, unmarshal):
+        """Read a management resource and unmarshal it.
 
-        self.response = requests.get(uri, auth=self.auth, headers=headers,
-                                     verify=self.verify)
-        return self._response()
+        If the connection has a cache and the resource is in it, the
+        request is conditional; when the server reports that the resource
+        hasn't changed, a copy of the cached model is returned.
+
+        :param uri: The URI of the resource properties
+        :param unmarshal: A function that constructs a model from the
+        decoded JSON properties
+        :return: The model, with its etag set, or None if the resource
+        doesn't exist
+        """
+        cache = self.cache
+        headers = None
+        etag = None
+        if cache is not None:
+            etag = cache.etag(uri)
+            if etag is not None:
+                headers = {'if-none-match': etag}
+
+        response = self.get(uri, headers=headers)
+
+        if response.status_code == 304:
+            result = cache.get(uri, etag)
+            if result is not None:
+                self.logger.debug("{0} not modified".format(uri))
+                return result
+            # Evicted in the meantime; read it unconditionally
+            response = self.get(uri)
+
+        if response.status_code != 200:
+            return None
+
+        result = unmarshal(json.loads(response.text))
+        if 'etag' in response.headers:
+            result.etag = response.headers['etag']
+            if cache is not None:
+                cache.put(uri, result.etag, result)
+        return result
 
     def post(self, uri, payload=None, etag=None, headers=None,
-             content_type="application/json", accept="application/json"):
+             content_type="application/json", accept="application/json",
+             stream=False, idempotent=None):
+        """Perform an HTTP POST.
+
+        If `stream` is True, the response body is not read; see :meth:`get`.
+        """
 
         if headers is None:
             headers = {}
@@ -138,32 +390,27 @@ class Connection:
             headers['if-match'] = etag
 
         self.logger.debug("POST {0}...".format(uri))
-        self.payload_logger.debug("Headers:")
-        self.payload_logger.debug(json.dumps(headers, indent=2))
-        if payload is not None:
-            self.payload_logger.debug("Payload:")
-            if content_type == 'application/json':
-                self.payload_logger.debug(json.dumps(payload, indent=2))
-            else:
-                self.payload_logger.debug(payload)
+        self._log_payload(headers, payload, content_type)
 
         if payload is None:
-            self.response = requests.post(uri, auth=self.auth, headers=headers,
-                                          verify=self.verify)
+            response = self._send("POST", uri, idempotent=idempotent,
+                                  headers=headers, stream=stream)
         else:
-            if content_type == "application/json":
-                self.response = requests.post(uri, json=payload,
-                                              auth=self.auth, headers=headers,
-                                              verify=self.verify)
+            if (content_type == "application/json"
+                    and isinstance(payload, (dict, list))):
+                response = self._send("POST", uri, idempotent=idempotent,
+                                      json=payload, headers=headers,
+                                      stream=stream)
             else:
-                self.response = requests.post(uri, data=payload,
-                                              auth=self.auth, headers=headers,
-                                              verify=self.verify)
+                response = self._send("POST", uri, idempotent=idempotent,
+                                      data=payload, headers=headers,
+                                      stream=stream)
 
-        return self._response()
+        return self._response(response, stream)
 
     def put(self, uri, payload=None, etag=None,
-            content_type="application/json", accept="application/json"):
+            content_type="application/json", accept="application/json",
+            idempotent=None):
 
         headers = {'content-type': content_type,
                    'accept': accept}
@@ -171,32 +418,25 @@ class Connection:
             headers['if-match'] = etag
 
         self.logger.debug("PUT  {0}...".format(uri))
-        self.payload_logger.debug("Headers:")
-        self.payload_logger.debug(json.dumps(headers, indent=2))
-        if payload is not None:
-            self.payload_logger.debug("Payload:")
-            if content_type == 'application/json':
-                self.payload_logger.debug(json.dumps(payload, indent=2))
-            else:
-                self.payload_logger.debug(payload)
+        self._log_payload(headers, payload, content_type)
 
         if payload is None:
-            self.response = requests.put(uri, auth=self.auth, headers=headers,
-                                         verify=self.verify)
+            response = self._send("PUT", uri, idempotent=idempotent,
+                                  headers=headers)
         else:
-            if content_type == "application/json":
-                self.response = requests.put(uri, json=payload,
-                                             auth=self.auth, headers=headers,
-                                             verify=self.verify)
+            if (content_type == "application/json"
+                    and isinstance(payload, (dict, list))):
+                response = self._send("PUT", uri, idempotent=idempotent,
+                                      json=payload, headers=headers)
             else:
-                self.response = requests.put(uri, data=payload,
-                                             auth=self.auth, headers=headers,
-                                             verify=self.verify)
+                response = self._send("PUT", uri, idempotent=idempotent,
+                                      data=payload, headers=headers)
 
-        return self._response()
+        return self._response(response)
 
     def delete(self, uri, payload=None, etag=None,
-               content_type="application/json", accept="application/json"):
+               content_type="application/json", accept="application/json",
+               idempotent=None):
 
         headers = {'content-type': content_type,
                    'accept': accept}
@@ -204,35 +444,38 @@ class Connection:
             headers['if-match'] = etag
 
         self.logger.debug("DELETE {0}...".format(uri))
-        self.payload_logger.debug("Headers:")
-        self.payload_logger.debug(json.dumps(headers, indent=2))
-        if payload is not None:
-            self.payload_logger.debug("Payload:")
-            if content_type == 'application/json':
-                self.payload_logger.debug(json.dumps(payload, indent=2))
-            else:
-                self.payload_logger.debug(payload)
+        self._log_payload(headers, payload, content_type)
 
         if payload is None:
-            self.response = requests.delete(uri, auth=self.auth, headers=headers,
-                                            verify=self.verify)
+            response = self._send("DELETE", uri, idempotent=idempotent,
+                                  headers=headers)
         else:
-            self.response = requests.delete(uri, json=payload,
-                                            auth=self.auth, headers=headers,
-                                            verify=self.verify)
+            response = self._send("DELETE", uri, idempotent=idempotent,
+                                  json=payload, headers=headers)
 
-        return self._response()
+        return self._response(response)
 
-    def _response(self):
-        response = self.response
+    def _response(self, response=None, stream=False):
+        # The response is passed explicitly because self.response is
+        # shared by every thread using this connection.
+        if response is None:
+            response = self.response
+
+        # A streamed response is left unread unless it reports an error
+        # or a restart; those bodies are small.
 
         self.logger.debug("Status code: {0}".format(response.status_code))
-        self.payload_logger.debug(response.text)
+        if self.payload_logger.isEnabledFor(logging.DEBUG):
+            if stream:
+                self.payload_logger.debug("<streamed response>")
+            else:
+                self.payload_logger.debug(response.text)
 
-        if response.status_code < 300:
+        if response.status_code < 300 or response.status_code == 304:
             pass
         elif response.status_code == 404:
-            pass
+            if stream:
+                response.close()
         elif response.status_code == 401:
             raise UnauthorizedAPIRequest(response.text)
         else:
@@ -242,60 +485,81 @@ class Connection:
             data = json.loads(response.text)
             # restart isn't in data, for example, if you execute a shutdown
             if "restart" in data:
-                self.wait_for_restart(data["restart"]["last-startup"][0]["value"])
+                self.wait_for_restart(data["restart"]["last-startup"])
 
         return response
 
-    def wait_for_restart(self, last_startup, timestamp_uri="/admin/v1/timestamp"):
-        """Wait for the host to restart.
+    def iter_content(self, response, chunk_size=64 * 1024):
+        """Iterate over the body of a streamed response in chunks.
 
-        :param last_startup: The last startup time reported in the
-        restart message
+        The response is closed, and its connection returned to the pool,
+        when the iteration finishes or is abandoned.
+        """
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+    def host_ids(self, refresh=False, timeout=None):
+        """Return a dictionary mapping host IDs to host names.
+
+        The hosts are listed once and remembered; pass `refresh=True`
+        to list them again. If `timeout` is not None, listing them
+        times out after that many seconds.
         """
+        if refresh or not self._host_ids:
+            response = self._response(self._send(
+                "GET", self.uri("hosts"),
+                headers={'accept': "application/json"}, timeout=timeout))
+            data = json.loads(response.text)
+            items = data['host-default-list']['list-items']
+            for item in items.get('list-item', []):
+                self._host_ids[item['idref']] = item['nameref']
+        return dict(self._host_ids)
 
-        uri = "{0}://{1}:8001{2}".format(self.protocol, self.host,
-                                         timestamp_uri)
+    def wait_for_restart(self, last_startup, timestamp_uri="/admin/v1/timestamp",
+                         deadline=None):
+        """Wait for the hosts to restart.
 
-        done = False
-        count = 24
-        while not done:
-            try:
-                self.logger.debug("Waiting for restart of {0}"
-                                  .format(self.host))
-                response = requests.get(uri, auth=self.auth,
-                                        headers={'accept': 'application/json'},
-                                        verify=self.verify)
-                done = (response.status_code == 200
-                        and response.text != last_startup)
-            except TypeError:
-                self.logger.debug("{0}: {1}".format(response.status_code,
-                                                    response.text))
-                pass
-            except BadStatusLine:
-                self.logger.debug("{0}: {1}".format(response.status_code,
-                                                    response.text))
-                pass
-            except ProtocolError:
-                self.logger.debug("{0}: {1}".format(response.status_code,
-                                                    response.text))
-                pass
-            except ReadTimeoutError:
-                self.logger.debug("ReadTimeoutError error...")
-                pass
-            except ReadTimeout:
-                self.logger.debug("ReadTimeout error...")
-                pass
-            except ConnectionError:
-                self.logger.debug("Connection error...")
-                pass
-            time.sleep(4)  # Sleep one more time even after success...
-            count -= 1
-
-            if count <= 0:
-                raise UnexpectedManagementAPIResponse("Restart hung?")
-
-        self.logger.debug("{0} restarted".format(self.host))
+        All of the hosts named in the restart message are polled
+        concurrently by the connection's
+        :class:`marklogic.restart.RestartWaiter`.
+
+        :param last_startup: The last startup time reported in the
+        restart message, or the list of last startups (one per host)
+        :param deadline: The number of seconds to wait, overriding the
+        waiter's default
+        """
+        if isinstance(last_startup, str):
+            last_startup = [{'value': last_startup}]
+
+        hosts = []
+        ids = [startup['host-id'] for startup in last_startup
+               if 'host-id' in startup]
+        if ids:
+            names = dict(self._host_ids)
+            if any(hostid not in names for hostid in ids):
+                # The cluster is restarting, so don't wait long for it
+                try:
+                    names = self.host_ids(refresh=True,
+                                          timeout=self.restart_waiter.timeout)
+                except RestartWaiter.ERRORS + (
+                        CircuitOpenError, UnauthorizedAPIRequest,
+                        UnexpectedManagementAPIResponse, ValueError,
+                        KeyError) as err:
+                    self.logger.debug("Cannot list the hosts: {0}"
+                                      .format(type(err).__name__))
+            hosts = [names[hostid] for hostid in ids if hostid in names]
+            if len(hosts) < len(ids):
+                self.logger.warning("Cannot name every restarting host")
+        if not hosts:
+            hosts = [self.host]
+
+        self.restart_waiter.wait(self, hosts,
+                                 [startup['value'] for startup in last_startup],
+                                 timestamp_uri, deadline)
 
     @classmethod
-    def make_connection(cls, host, username, password):
-        return Connection(host, HTTPDigestAuth(username, password))
+    def make_connection(cls, host, username, password, **kwargs):
+        return Connection(host, DigestAuth(username, password), **kwargs)
@@ -71,3 +71,14 @@ class UnexpectedAPIResponse(MLManageException):
     REST api responses when dealing with search or documents.
     """
     pass
+
+
+class CircuitOpenError(MLManageException):
+    """This exception class is for requests refused without being sent
+    because the circuit breaker for the host is open.
+    """
+    def __init__(self, host, retry_at=None):
+        super(CircuitOpenError, self).__init__(
+            "Circuit to {0} is open".format(host))
+        self.host = host
+        self.retry_at = retry_at
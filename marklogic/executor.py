@@ -0,0 +1,113 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Concurrent execution of batches of requests.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchResult:
+    """
+    The result of one item in a batch: either a value or an error.
+    """
+    def __init__(self, item, value=None, error=None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    def ok(self):
+        """Return True if the item succeeded."""
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is None:
+            return "BatchResult({0!r}: {1!r})".format(self.item, self.value)
+        return "BatchResult({0!r}: error {1!r})".format(self.item, self.error)
+
+
+class BatchExecutor:
+    """
+    The BatchExecutor class runs batches of operations against a
+    connection on a bounded pool of threads.
+
+    Results are returned in submission order. An operation that raises
+    an exception doesn't abort the batch; the exception is recorded in
+    its :class:`BatchResult`.
+    """
+    def __init__(self, connection, max_workers=8):
+        self.connection = connection
+        self.max_workers = max_workers
+        self.logger = logging.getLogger("marklogic.executor")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        """Shut down the worker threads."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _call(self, func, item):
+        try:
+            if isinstance(item, tuple):
+                return BatchResult(item, func(self.connection, *item))
+            return BatchResult(item, func(self.connection, item))
+        except Exception as err:
+            self.logger.debug("{0!r} failed: {1!r}".format(item, err))
+            return BatchResult(item, error=err)
+
+    def map(self, func, items):
+        """
+        Call ``func(connection, item)`` for each item concurrently.
+
+        An item that is a tuple is passed as several arguments.
+
+        :return: A list of :class:`BatchResult` objects, one per item,
+        in the order of `items`
+        """
+        futures = [self._executor.submit(self._call, func, item)
+                   for item in items]
+        return [future.result() for future in futures]
+
+    def run(self, operations):
+        """
+        Run a batch of arbitrary operations concurrently.
+
+        Each operation is a callable that takes the connection as its
+        only argument.
+
+        :return: A list of :class:`BatchResult` objects, one per
+        operation, in order
+        """
+        return self.map(lambda connection, operation: operation(connection),
+                        operations)
+
+    def lookup(self, klass, names):
+        """
+        Look up several resources of the same kind concurrently.
+
+        :param klass: A model class with a `lookup` classmethod
+        :param names: The names (or tuples of lookup arguments)
+        :return: A list of :class:`BatchResult` objects in order
+        """
+        return self.map(klass.lookup, names)
@@ -0,0 +1,626 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+An in-process stand-in for a MarkLogic server, for testing without one.
+"""
+
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, unquote
+from requests_toolbelt import MultipartDecoder
+from marklogic.client.multipart import encode_multipart, parse_disposition
+from marklogic.connection import Connection
+from marklogic.recording import Recorder, _decode_body
+
+# The management resources that are emulated: the plural used in URIs,
+# the singular used in list names, and the property that names them.
+_KINDS = {'databases': ('database', 'database-name'),
+          'forests': ('forest', 'forest-name'),
+          'servers': ('server', 'server-name'),
+          'groups': ('group', 'group-name'),
+          'hosts': ('host', 'host-name'),
+          'users': ('user', 'user-name'),
+          'roles': ('role', 'role-name'),
+          'privileges': ('privilege', 'privilege-name'),
+          'amps': ('amp', 'local-name')}
+
+_COLLECTION = re.compile(r"<(?:\w+:)?collection>([^<]*)</(?:\w+:)?collection>")
+
+
+def _document_format(content_type):
+    if content_type is None:
+        return "binary"
+    if "json" in content_type:
+        return "json"
+    if "xml" in content_type:
+        return "xml"
+    if content_type.startswith("text/"):
+        return "text"
+    return "binary"
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        self.server.fake.logger.debug(format % args)
+
+    def _body(self):
+        if "chunked" in self.headers.get('transfer-encoding', "").lower():
+            body = self._chunked_body()
+        else:
+            length = int(self.headers.get('content-length', 0))
+            if length <= 0:
+                return b""
+            body = self.rfile.read(length)
+            self.server.fake._throttle(len(body))
+        encoding = self.headers.get('content-encoding')
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        return body
+
+    def _chunked_body(self):
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers
+                while self.rfile.readline().strip():
+                    pass
+                break
+            body += self.rfile.read(size)
+            self.rfile.readline()
+        self.server.fake._throttle(len(body))
+        return bytes(body)
+
+    def _handle(self):
+        fake = self.server.fake
+        body = self._body()
+        try:
+            status, headers, content = fake.handle(self.command, self.path,
+                                                   self.headers, body)
+        except Exception as err:
+            fake.logger.exception("Fake server failed")
+            status, headers, content = fake._error(500, "INTERNAL",
+                                                   repr(err))
+        if fake.latency:
+            time.sleep(fake.latency)
+        self.send_response(status)
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            fake._write(self.wfile, content)
+
+    do_GET = _handle
+    do_HEAD = _handle
+    do_PUT = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+
+
+class FakeMarkLogic:
+    """
+    The FakeMarkLogic class runs a small HTTP server, in a background
+    thread, that stands in for MarkLogic when measuring or testing the
+    client.
+
+    It emulates enough of the Management API (``/manage/v2`` lists and
+    properties of databases, forests, servers, groups, hosts, users,
+    roles, privileges and amps) and of the Client API
+    (``/v1/documents``, ``/v1/eval`` and ``/v1/transactions``) for the
+    models and client classes to work. Documents are kept in memory.
+    Transactions are tracked but don't isolate anything, and eval only
+    understands the code registered with :meth:`add_eval`; ``cts:uris``,
+    the collection and directory deletes of
+    :meth:`marklogic.client.ClientUtils.delete_documents` and the forest
+    assignments of :class:`marklogic.client.routing.ForestRouter` are
+    registered by default.
+
+    Every response is delayed by `latency` seconds and, if `bandwidth`
+    is not None, bodies are sent and received at `bandwidth` bytes per
+    second.
+
+    If a `recording` (a :class:`marklogic.recording.Recorder`, a list of
+    exchanges or a file name) is given, requests that match a recorded
+    exchange by method, path and query are answered from the recording
+    and the rest are emulated.
+
+    Management and client requests are served on the same `port`; use
+    :meth:`connection` to make a connection to the server.
+    """
+    def __init__(self, latency=0.0, bandwidth=None, recording=None,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host = host
+        self.logger = logging.getLogger("marklogic.fakeserver")
+        self._lock = threading.RLock()
+        self._etag = 0
+        self._thread = None
+        self.request_count = 0
+
+        self._recorded = {}
+        if recording is not None:
+            if isinstance(recording, str):
+                recording = Recorder.load(recording)
+            if isinstance(recording, Recorder):
+                recording = recording.exchanges
+            for exchange in recording:
+                parsed = urlparse(exchange['uri'])
+                key = (exchange['method'], parsed.path, parsed.query)
+                self._recorded.setdefault(key, []).append(exchange)
+
+        self._server = _ThreadingServer((host, port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+
+        self.resources = {kind: {} for kind in _KINDS}
+        self.documents = {}
+        self.transactions = {}
+        self._evals = []
+        self.add_eval(r"cts:uris\(\)", self._eval_uris)
+        self.add_eval(r"xdmp:document-delete\(\$uri\)", self._eval_delete)
+        self.add_eval(r"xdmp:document-assign\(", self._eval_assign)
+        self._bootstrap()
+
+    def _bootstrap(self):
+        self._create('groups', {'group-name': "Default"})
+        self._create('hosts', {'host-name': self.host, 'group': "Default",
+                               'host-id': "1"})
+        self._create('forests', {'forest-name': "Documents",
+                                 'host': self.host, 'database': "Documents"})
+        self._create('databases', {'database-name': "Documents",
+                                   'forest': ["Documents"]})
+        self._create('servers', {'server-name': "App-Services",
+                                 'group-name': "Default",
+                                 'server-type': "http", 'port': self.port,
+                                 'content-database': "Documents"})
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            kwargs={'poll_interval': 0.05},
+                                            name="marklogic-fakeserver")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def connection(self, auth=None, **kwargs):
+        """Return a connection to this server."""
+        return Connection(self.host, auth, port=self.port,
+                          management_port=self.port, **kwargs)
+
+    def add_eval(self, pattern, func):
+        """
+        Emulate the evaluation of code that matches `pattern`.
+
+        `func` is called with the fake server and the form fields of the
+        request (``xquery`` or ``javascript``, ``vars``, ``database``)
+        and returns the list of values to return. Strings are returned
+        as text, other values as JSON. Later registrations win.
+        """
+        self._evals.insert(0, (re.compile(pattern), func))
+
+    def _throttle(self, length):
+        if self.bandwidth:
+            time.sleep(length / float(self.bandwidth))
+
+    def _write(self, wfile, content):
+        if not self.bandwidth:
+            wfile.write(content)
+            return
+        chunk_size = 16 * 1024
+        for start in range(0, len(content), chunk_size):
+            chunk = content[start:start + chunk_size]
+            wfile.write(chunk)
+            self._throttle(len(chunk))
+
+    def _next_etag(self):
+        self._etag += 1
+        return '"{0}"'.format(self._etag)
+
+    def _error(self, status, code, message):
+        body = json.dumps({'errorResponse': {'statusCode': status,
+                                             'messageCode': code,
+                                             'message': message}})
+        return status, {'Content-Type': "application/json"}, \
+            body.encode("utf-8")
+
+    def _json(self, status, data, headers=None):
+        if headers is None:
+            headers = {}
+        headers['Content-Type'] = "application/json"
+        return status, headers, json.dumps(data).encode("utf-8")
+
+    def handle(self, method, path, headers, body):
+        """
+        Answer a request.
+
+        :return: The status, a dictionary of headers, and the body
+        """
+        parsed = urlparse(path)
+        with self._lock:
+            self.request_count += 1
+            queue = self._recorded.get((method, parsed.path, parsed.query))
+            if queue:
+                exchange = queue.pop(0) if len(queue) > 1 else queue[0]
+                return (exchange['status'],
+                        dict(exchange['response-headers']),
+                        _decode_body(exchange['response-body'],
+                                     exchange['response-body-encoding']))
+
+        params = parse_qs(parsed.query, keep_blank_values=True)
+        segments = [unquote(seg) for seg in parsed.path.split("/") if seg]
+        if segments[:2] == ["manage", "v2"]:
+            return self._manage(method, segments[2:], params, headers, body)
+        if segments[:1] == ["v1"] and len(segments) > 1:
+            if segments[1] == "documents":
+                return self._documents(method, params, headers, body)
+            if segments[1] == "eval":
+                return self._eval(method, body)
+            if segments[1] == "transactions":
+                return self._transactions(method, segments[2:], params)
+        return self._error(404, "RESTAPI-NOTFOUND",
+                           "{0} {1} is not emulated".format(method, path))
+
+    # Management API
+
+    def _key(self, kind, name, params, config=None):
+        if kind != 'servers':
+            return name
+        group = params.get('group-id', [None])[0]
+        if group is None and config is not None:
+            group = config.get('group-name')
+        if group is None:
+            group = "Default"
+        return "{0}|{1}".format(group, name)
+
+    def _create(self, kind, config, params=None):
+        name = config.get(_KINDS[kind][1])
+        if name is None:
+            return self._error(400, "MANAGE-INVALIDPAYLOAD",
+                               "No {0}".format(_KINDS[kind][1]))
+        key = self._key(kind, name, params or {}, config)
+        with self._lock:
+            if key in self.resources[kind]:
+                return self._error(400, "MANAGE-OBJEXISTS",
+                                   "{0} exists".format(name))
+            if kind == 'servers':
+                config.setdefault('group-name', key.split("|")[0])
+            self.resources[kind][key] = (config, self._next_etag())
+        return 201, {'Location': "/manage/v2/{0}/{1}".format(kind, name)}, b""
+
+    def _manage(self, method, segments, params, headers, body):
+        if not segments or segments[0] not in _KINDS:
+            return self._error(404, "MANAGE-NOTFOUND", "Not emulated")
+        kind = segments[0]
+        singular = _KINDS[kind][0]
+
+        if len(segments) == 1:
+            if method == "POST":
+                return self._create(kind, json.loads(body.decode("utf-8")),
+                                    params)
+            if method not in ["GET", "HEAD"]:
+                return self._error(405, "MANAGE-BADMETHOD", method)
+            with self._lock:
+                items = []
+                for key in sorted(self.resources[kind]):
+                    config = self.resources[kind][key][0]
+                    item = {'nameref': config[_KINDS[kind][1]],
+                            'idref': config.get(singular + "-id", key)}
+                    if kind == 'servers':
+                        item['groupnameref'] = config['group-name']
+                        item['kindref'] = config.get('server-type', "http")
+                    items.append(item)
+            return self._json(200, {singular + "-default-list": {
+                'list-items': {'list-count': {'value': len(items)},
+                               'list-item': items}}})
+
+        key = self._key(kind, segments[1], params)
+        with self._lock:
+            if key not in self.resources[kind]:
+                return self._error(404, "MANAGE-OBJNOTFOUND",
+                                   "No such {0}: {1}".format(singular,
+                                                             segments[1]))
+            config, etag = self.resources[kind][key]
+
+            if method == "DELETE":
+                del self.resources[kind][key]
+                return 204, {}, b""
+            if method == "PUT":
+                if_match = headers.get('if-match')
+                if if_match is not None and if_match != etag:
+                    return self._error(412, "MANAGE-PRECONDFAILED",
+                                       "Etag mismatch")
+                update = json.loads(body.decode("utf-8"))
+                config = dict(config)
+                config.update(update)
+                etag = self._next_etag()
+                del self.resources[kind][key]
+                key = self._key(kind, config[_KINDS[kind][1]], params, config)
+                self.resources[kind][key] = (config, etag)
+                return 204, {'ETag': etag}, b""
+            if method not in ["GET", "HEAD"]:
+                return self._error(405, "MANAGE-BADMETHOD", method)
+
+            if headers.get('if-none-match') == etag:
+                return 304, {'ETag': etag}, b""
+            return self._json(200, config, {'ETag': etag})
+
+    # Client API: documents
+
+    def _metadata(self, document, form):
+        if document['metadata'] is not None:
+            return document['metadata']
+        if form == "json":
+            return "application/json", json.dumps(
+                {'collections': document['collections'],
+                 'permissions': [], 'properties': {},
+                 'quality': 0}).encode("utf-8")
+        xml = '<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api">'
+        xml += "<rapi:collections>"
+        for collection in document['collections']:
+            xml += "<rapi:collection>{0}</rapi:collection>".format(collection)
+        xml += "</rapi:collections></rapi:metadata>"
+        return "application/xml", xml.encode("utf-8")
+
+    def _store(self, uri, content, content_type, collections=None,
+               metadata=None):
+        if collections is None:
+            collections = []
+        if metadata is not None:
+            try:
+                text = metadata[1].decode("utf-8")
+            except UnicodeDecodeError:
+                text = ""
+            if "json" in metadata[0]:
+                try:
+                    collections = json.loads(text).get('collections', [])
+                except (ValueError, AttributeError):
+                    pass
+            else:
+                collections = _COLLECTION.findall(text)
+        with self._lock:
+            created = uri not in self.documents
+            self.documents[uri] = {'content': content,
+                                   'content-type': content_type,
+                                   'collections': collections,
+                                   'metadata': metadata}
+        return created
+
+    def _documents(self, method, params, headers, body):
+        uris = params.get('uri', [])
+        if method == "POST":
+            return self._bulk(headers, body)
+        if not uris:
+            return self._error(400, "REST-REQUIREDPARAM", "No uri")
+
+        if method == "PUT":
+            created = self._store(uris[0], body,
+                                  headers.get('content-type',
+                                              "application/octet-stream"),
+                                  params.get('collection', []))
+            return (201 if created else 204), {}, b""
+
+        if method == "DELETE":
+            with self._lock:
+                for uri in uris:
+                    self.documents.pop(uri, None)
+            return 204, {}, b""
+
+        if method not in ["GET", "HEAD"]:
+            return self._error(405, "REST-UNSUPPORTEDMETHOD", method)
+
+        categories = params.get('category', ["content"])
+        form = params.get('format', [None])[0]
+        if form is None:
+            form = "json" if "json" in headers.get('accept', "") else "xml"
+
+        with self._lock:
+            found = [(uri, self.documents[uri]) for uri in uris
+                     if uri in self.documents]
+        if not found:
+            return self._error(404, "RESTAPI-NODOCUMENT",
+                               "Document not found")
+
+        multipart = headers.get('accept', "").startswith("multipart/mixed")
+        if len(uris) == 1 and categories == ["content"] and not multipart:
+            document = found[0][1]
+            return 200, {'Content-Type': document['content-type']}, \
+                document['content']
+
+        if len(uris) == 1 and "content" not in categories and not multipart:
+            content_type, metadata = self._metadata(found[0][1], form)
+            return 200, {'Content-Type': content_type}, metadata
+
+        parts = []
+        for uri, document in found:
+            if [cat for cat in categories if cat != "content"]:
+                content_type, metadata = self._metadata(document, form)
+                parts.append(({'Content-Type': content_type,
+                               'Content-Disposition':
+                               'attachment; filename="{0}"; category=metadata;'
+                               ' format={1}'.format(
+                                   uri, _document_format(content_type))},
+                              metadata))
+            if "content" in categories:
+                content_type = document['content-type']
+                parts.append(({'Content-Type': content_type,
+                               'Content-Disposition':
+                               'attachment; filename="{0}"; category=content;'
+                               ' format={1}'.format(
+                                   uri, _document_format(content_type))},
+                              document['content']))
+        body, content_type = encode_multipart(parts)
+        return 200, {'Content-Type': content_type}, body
+
+    def _bulk(self, headers, body):
+        decoder = MultipartDecoder(body, headers.get('content-type'))
+        default = None
+        pending = {}
+        written = []
+        for part in decoder.parts:
+            part_headers = {key.decode("utf-8").lower(): value.decode("utf-8")
+                            for key, value in part.headers.items()}
+            disposition = parse_disposition(
+                part_headers.get('content-disposition'))
+            uri = disposition.get('filename')
+            content_type = part_headers.get('content-type',
+                                            "application/octet-stream")
+            if disposition.get('category') == "metadata":
+                if uri is None:
+                    default = (content_type, part.content)
+                else:
+                    pending[uri] = (content_type, part.content)
+                continue
+            if uri is None:
+                continue
+            self._store(uri, part.content, content_type,
+                        metadata=pending.pop(uri, default))
+            written.append({'uri': uri, 'mime-type': content_type,
+                            'category': ["metadata", "content"]})
+        return self._json(200, {'documents': written})
+
+    # Client API: eval
+
+    def _eval_uris(self, fake, fields):
+        code = fields.get('xquery', fields.get('javascript', ""))
+        match = re.search(r"starts-with\(\.,\s*'([^']*)'\)", code)
+        with self._lock:
+            uris = sorted(self.documents)
+        if match:
+            root = match.group(1).replace("&apos;", "'")
+            uris = [uri for uri in uris if uri.startswith(root)]
+        return uris
+
+    def _eval_delete(self, fake, fields):
+        variables = json.loads(fields.get('vars', "{}"))
+        if variables.get('query'):
+            raise ValueError("Deleting by query is not emulated")
+        collection = variables.get('collection')
+        directory = variables.get('directory')
+        with self._lock:
+            matches = sorted(
+                uri for uri in self.documents
+                if (not collection
+                    or collection in self.documents[uri]['collections'])
+                and (not directory or uri.startswith(directory)))
+            deleted = matches[:variables['limit']]
+            for uri in deleted:
+                del self.documents[uri]
+        return [len(deleted), len(matches) - len(deleted)]
+
+    def _eval_assign(self, fake, fields):
+        # Not MarkLogic's hash, but as stable as one
+        variables = json.loads(fields.get('vars', "{}"))
+        uris = json.loads(variables['uris'])
+        database = fields.get('database', "Documents")
+        with self._lock:
+            forests = self.resources['databases'][database][0]['forest']
+        if isinstance(forests, str):
+            forests = [forests]
+        return [forests[zlib.crc32(uri.encode("utf-8")) % len(forests)]
+                for uri in uris]
+
+    def _eval(self, method, body):
+        if method != "POST":
+            return self._error(405, "REST-UNSUPPORTEDMETHOD", method)
+        fields = {key: values[0] for key, values
+                  in parse_qs(body.decode("utf-8")).items()}
+        code = fields.get('xquery', fields.get('javascript', ""))
+        for pattern, func in self._evals:
+            if pattern.search(code):
+                values = func(self, fields)
+                break
+        else:
+            return self._error(500, "XDMP-UNEMULATED",
+                               "The fake server can't evaluate that")
+        if not values:
+            return 200, {}, b""
+        parts = []
+        for value in values:
+            if isinstance(value, str):
+                parts.append(({'Content-Type': "text/plain",
+                               'X-Primitive': "string"},
+                              value.encode("utf-8")))
+            else:
+                parts.append(({'Content-Type': "application/json",
+                               'X-Primitive': "node()"},
+                              json.dumps(value).encode("utf-8")))
+        body, content_type = encode_multipart(parts)
+        return 200, {'Content-Type': content_type}, body
+
+    # Client API: transactions
+
+    def _transactions(self, method, segments, params):
+        if not segments:
+            if method != "POST":
+                return self._error(405, "REST-UNSUPPORTEDMETHOD", method)
+            txid = uuid.uuid4().hex[:16]
+            with self._lock:
+                self.transactions[txid] = {
+                    'transaction-id': txid,
+                    'transaction-name': params.get('name', [""])[0],
+                    'time-limit': params.get('timeLimit', ["600"])[0],
+                    'host': {'host-name': self.host}}
+            return 303, {'Location': "/v1/transactions/" + txid}, b""
+
+        txid = segments[0]
+        with self._lock:
+            status = self.transactions.get(txid)
+            if status is None:
+                return self._error(404, "REST-INVALIDPARAM",
+                                   "No such transaction: " + txid)
+            if method == "POST" and 'result' in params:
+                del self.transactions[txid]
+                return 204, {}, b""
+        if method in ["GET", "HEAD"]:
+            return self._json(200, {'transaction-status': status})
+        return self._error(405, "REST-UNSUPPORTEDMETHOD", method)
@@ -0,0 +1,327 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Connections that spread requests across the hosts in a cluster.
+"""
+
+import json
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from requests.exceptions import ConnectionError, Timeout
+from marklogic.connection import Connection
+from marklogic.exceptions import CircuitOpenError
+from marklogic.exceptions import InvalidAPIRequest
+from marklogic.models.cluster import LocalCluster
+from marklogic.models.host import Host
+
+
+class _HostState:
+    """
+    The load balancer's view of one host.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.down_since = None
+
+
+class LoadBalancer:
+    """
+    The LoadBalancer class chooses a host for each request.
+
+    The `strategy` is either ``round-robin`` or ``least-outstanding``
+    (the host with the fewest requests in flight). Hosts marked down
+    are skipped until they are marked up again. If every host is down,
+    requests go to the host that has been down longest, rather than
+    failing outright.
+    """
+    ROUND_ROBIN = "round-robin"
+    LEAST_OUTSTANDING = "least-outstanding"
+
+    def __init__(self, hosts, strategy=ROUND_ROBIN):
+        if strategy not in [self.ROUND_ROBIN, self.LEAST_OUTSTANDING]:
+            raise InvalidAPIRequest("Unknown strategy: {0}".format(strategy))
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._next = 0
+        self._hosts = []
+        self.set_hosts(hosts)
+
+    def set_hosts(self, hosts):
+        """Replace the hosts, keeping the state of those already known."""
+        with self._lock:
+            known = {state.name: state for state in self._hosts}
+            self._hosts = [known.get(name, _HostState(name))
+                           for name in hosts]
+            if not self._hosts:
+                raise InvalidAPIRequest("A load balancer needs hosts")
+
+    def hosts(self):
+        """Return the names of all the hosts."""
+        return [state.name for state in self._hosts]
+
+    def healthy_hosts(self):
+        """Return the names of the hosts not marked down."""
+        return [state.name for state in self._hosts if state.healthy]
+
+    def unhealthy_hosts(self):
+        """Return the names of the hosts marked down."""
+        return [state.name for state in self._hosts if not state.healthy]
+
+    def outstanding(self):
+        """Return a dictionary of the requests in flight to each host."""
+        return {state.name: state.outstanding for state in self._hosts}
+
+    def _state(self, name):
+        for state in self._hosts:
+            if state.name == name:
+                return state
+        return None
+
+    def acquire(self, preferred=None, exclude=None):
+        """
+        Choose a host for a request and count the request as in flight.
+
+        If `preferred` names a known host, it is always chosen. Hosts
+        in `exclude` are avoided unless no other host is healthy.
+        """
+        with self._lock:
+            state = None
+            if preferred is not None:
+                state = self._state(preferred)
+            if state is None:
+                candidates = [state for state in self._hosts if state.healthy]
+                if exclude:
+                    preferable = [state for state in candidates
+                                  if state.name not in exclude]
+                    if preferable:
+                        candidates = preferable
+                if not candidates:
+                    candidates = sorted(self._hosts,
+                                        key=lambda state: state.down_since)
+                    state = candidates[0]
+                elif self.strategy == self.LEAST_OUTSTANDING:
+                    state = min(candidates,
+                                key=lambda state: state.outstanding)
+                else:
+                    state = candidates[self._next % len(candidates)]
+                    self._next += 1
+            state.outstanding += 1
+            return state.name
+
+    def release(self, name, ok=True):
+        """
+        Count a request to `name` as finished. A failed request
+        marks the host down; if `ok` is None, the request wasn't sent
+        and says nothing about the host.
+        """
+        with self._lock:
+            state = self._state(name)
+            if state is None:
+                return
+            state.outstanding -= 1
+            if ok is None:
+                pass
+            elif ok:
+                state.failures = 0
+            else:
+                state.failures += 1
+                if state.healthy:
+                    state.healthy = False
+                    state.down_since = time.time()
+
+    def mark_up(self, name):
+        """Put a host back into rotation."""
+        with self._lock:
+            state = self._state(name)
+            if state is not None:
+                state.healthy = True
+                state.failures = 0
+                state.down_since = None
+
+    def mark_down(self, name):
+        """Take a host out of rotation."""
+        with self._lock:
+            state = self._state(name)
+            if state is not None and state.healthy:
+                state.healthy = False
+                state.down_since = time.time()
+
+
+class ClusterConnection(Connection):
+    """
+    The ClusterConnection class is a connection that spreads requests
+    to the client API port across several hosts.
+
+    Requests whose URI addresses `host` on the client port are sent to
+    a host chosen by a :class:`LoadBalancer`; management requests are
+    balanced as well if `balance_management` is True. Other requests,
+    for example to the admin port of a specific host, are sent as is.
+
+    If `hosts` is None, the hosts are discovered with :meth:`discover`.
+
+    A host that fails with a connection error or timeout is taken out
+    of rotation. Every `probe_interval` seconds a background thread
+    checks the hosts that are down and puts back those that respond.
+
+    Requests in a multi-statement transaction are sent to the host on
+    which the transaction was created.
+
+    If the connection has a :class:`marklogic.breaker.CircuitBreaker`,
+    hosts whose circuits are open are avoided.
+    """
+    def __init__(self, host, auth, hosts=None,
+                 strategy=LoadBalancer.ROUND_ROBIN, probe_interval=30,
+                 probe_timeout=5, balance_management=False, **kwargs):
+        super(ClusterConnection, self).__init__(host, auth, **kwargs)
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.balance_management = balance_management
+        self._affinity = {}
+        self._affinity_lock = threading.Lock()
+        self._prober = None
+        self.balancer = LoadBalancer([host], strategy)
+        if hosts is None:
+            self.discover()
+        else:
+            self.balancer.set_hosts(hosts)
+
+    def discover(self, use_bootstrap_hosts=False):
+        """
+        Find the hosts in the cluster.
+
+        By default, the hosts are listed with :meth:`Host.list`. If
+        `use_bootstrap_hosts` is True, the bootstrap hosts of the local
+        cluster are used instead.
+
+        :return: The list of host names
+        """
+        if use_bootstrap_hosts:
+            cluster = LocalCluster(connection=self).read()
+            hosts = [bhost.host_name() for bhost in cluster.bootstrap_hosts()]
+        else:
+            hosts = Host.list(self)
+        self.balancer.set_hosts(hosts)
+        return hosts
+
+    def _balanced(self, parsed):
+        if parsed.hostname != self.host:
+            return False
+        port = parsed.port
+        if port == int(self.port):
+            return True
+        return self.balance_management and port == int(self.management_port)
+
+    def _txid(self, parsed):
+        txid = parse_qs(parsed.query).get('txid')
+        if txid:
+            return txid[0]
+        if "/transactions/" in parsed.path:
+            return parsed.path.rsplit("/", 1)[1]
+        return None
+
+    def _send_once(self, method, uri, **kwargs):
+        parsed = urlparse(uri)
+        if not self._balanced(parsed):
+            return super(ClusterConnection, self)._send_once(method, uri,
+                                                             **kwargs)
+
+        txid = self._txid(parsed)
+        with self._affinity_lock:
+            preferred = self._affinity.get(txid)
+
+        exclude = None
+        if self.breaker is not None and preferred is None:
+            exclude = [name for name in self.balancer.hosts()
+                       if not self.breaker.available(name)]
+
+        target = self.balancer.acquire(preferred, exclude)
+        target_uri = parsed._replace(
+            netloc="{0}:{1}".format(target, parsed.port)).geturl()
+        try:
+            response = super(ClusterConnection, self)._send_once(
+                method, target_uri, **kwargs)
+        except CircuitOpenError:
+            self.balancer.release(target, None)
+            raise
+        except (ConnectionError, Timeout):
+            self.balancer.release(target, False)
+            self._start_prober()
+            raise
+        self.balancer.release(target, True)
+
+        self._track_transaction(method, parsed, txid, target, response)
+        return response
+
+    def _track_transaction(self, method, parsed, txid, target, response):
+        """Remember which host owns a transaction."""
+        if method != "POST" or response.status_code >= 300:
+            return
+        if parsed.path.endswith("/transactions"):
+            txid = None
+            location = response.headers.get('location')
+            if location is not None:
+                txid = location.rsplit("/", 1)[1]
+            else:
+                try:
+                    data = json.loads(response.text)
+                    txid = data['transaction-status']['transaction-id']
+                except (ValueError, KeyError):
+                    pass
+            if txid is not None:
+                with self._affinity_lock:
+                    self._affinity[txid] = target
+        elif txid is not None and "result=" in parsed.query:
+            with self._affinity_lock:
+                self._affinity.pop(txid, None)
+
+    def probe(self):
+        """
+        Check every host that is down and put back those that respond.
+
+        :return: The names of the hosts that are still down
+        """
+        for name in self.balancer.unhealthy_hosts():
+            uri = "{0}://{1}:{2}/".format(self.protocol, name, self.port)
+            try:
+                self.session.head(uri, verify=self.verify,
+                                  timeout=self.probe_timeout)
+                self.logger.debug("{0} is back".format(name))
+                self.balancer.mark_up(name)
+            except (ConnectionError, Timeout):
+                self.logger.debug("{0} is still down".format(name))
+        return self.balancer.unhealthy_hosts()
+
+    def _start_prober(self):
+        if self.probe_interval is None or self.probe_interval <= 0:
+            return
+        with self._affinity_lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop,
+                                            name="marklogic-prober")
+            self._prober.daemon = True
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            if not self.probe():
+                return
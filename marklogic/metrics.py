@@ -0,0 +1,245 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Latency and throughput metrics for connections.
+"""
+
+import copy
+import re
+import threading
+from urllib.parse import urlparse
+
+_VERSION = re.compile(r"^(v[0-9]+|LATEST)$")
+
+
+def endpoint(uri):
+    """
+    Return the logical endpoint of a URI.
+
+    The endpoint is the path up to the resource type that follows the
+    API version, so ``/manage/v2/databases/Documents/properties`` is
+    ``manage/v2/databases`` and ``/v1/documents`` is ``v1/documents``.
+    """
+    segments = [seg for seg in urlparse(uri).path.split("/") if seg]
+    for index, seg in enumerate(segments):
+        if _VERSION.match(seg):
+            return "/".join(segments[:index + 2])
+    return "/".join(segments[:1])
+
+
+class _EndpointMetrics:
+    """
+    The metrics for one method and endpoint.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.statuses = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.in_flight = 0
+
+    def observe(self, elapsed):
+        self.count += 1
+        self.latency_sum += elapsed
+        if elapsed > self.latency_max:
+            self.latency_max = elapsed
+        index = 0
+        while index < len(self.buckets) and elapsed > self.buckets[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+
+    def snapshot(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'in-flight': self.in_flight,
+                'latency-sum': self.latency_sum,
+                'latency-max': self.latency_max,
+                'latency-buckets': list(zip(list(self.buckets)
+                                            + [float("inf")],
+                                            self.bucket_counts)),
+                'statuses': copy.copy(self.statuses),
+                'request-bytes': self.request_bytes,
+                'response-bytes': self.response_bytes}
+
+
+class Metrics:
+    """
+    The Metrics class records latency histograms, status code counts,
+    byte counts and requests in flight for a connection, keyed by HTTP
+    method and logical endpoint (see :func:`endpoint`).
+
+    Pass an instance to a :class:`marklogic.connection.Connection` as
+    `metrics`; several connections may share one.
+
+    Latencies are in seconds. The `buckets` are the upper bounds of
+    the histogram buckets.
+
+    Byte counts come from the ``Content-Length`` of each body. A body
+    sent or received with chunked transfer encoding is counted if its
+    length is known anyway: a request body held in memory or with a
+    known length, or a response that wasn't streamed. The bodies of
+    streamed responses, and of requests sent from iterators, count as 0.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+               5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = self.BUCKETS
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, key):
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            metrics = _EndpointMetrics(self.buckets)
+            self._metrics[key] = metrics
+        return metrics
+
+    def started(self, method, uri):
+        """
+        Record the start of a request.
+
+        :return: The key to pass to :meth:`finished`
+        """
+        key = (method, endpoint(uri))
+        with self._lock:
+            self._get(key).in_flight += 1
+        return key
+
+    def finished(self, key, request, response, elapsed, error=None,
+                 streamed=False):
+        """
+        Record the end of a request.
+
+        :param key: The key returned by :meth:`started`
+        :param request: The prepared request, or None
+        :param response: The response, or None if the request failed
+        :param elapsed: The elapsed time in seconds
+        :param error: The exception raised, if any
+        :param streamed: True if the body of the response hasn't been read
+        """
+        request_bytes = 0
+        if request is not None and request.body is not None:
+            length = request.headers.get('content-length')
+            body = request.body
+            if length is not None:
+                request_bytes = int(length)
+            elif isinstance(body, (bytes, bytearray)):
+                request_bytes = len(body)
+            elif isinstance(body, str):
+                request_bytes = len(body.encode("utf-8"))
+            elif isinstance(getattr(body, 'length', None), int):
+                request_bytes = body.length
+        response_bytes = 0
+        if response is not None:
+            length = response.headers.get('content-length')
+            if length is not None:
+                response_bytes = int(length)
+            elif not streamed:
+                response_bytes = len(response.content)
+
+        with self._lock:
+            metrics = self._get(key)
+            metrics.in_flight -= 1
+            metrics.observe(elapsed)
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+            if error is not None or response is None:
+                metrics.errors += 1
+            else:
+                status = response.status_code
+                metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """
+        Return the current metrics.
+
+        :return: A dictionary mapping (method, endpoint) tuples to
+        dictionaries of metrics
+        """
+        with self._lock:
+            return {key: self._metrics[key].snapshot()
+                    for key in self._metrics}
+
+    def reset(self):
+        """Discard all the metrics, except requests still in flight."""
+        with self._lock:
+            metrics = {}
+            for key in self._metrics:
+                if self._metrics[key].in_flight:
+                    fresh = _EndpointMetrics(self.buckets)
+                    fresh.in_flight = self._metrics[key].in_flight
+                    metrics[key] = fresh
+            self._metrics = metrics
+
+    def exposition(self, prefix="marklogic_client"):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        snapshot = self.snapshot()
+        keys = sorted(snapshot)
+
+        def labels(key, extra=""):
+            return '{{method="{0}",endpoint="{1}"{2}}}'.format(key[0], key[1],
+                                                              extra)
+
+        name = prefix + "_request_duration_seconds"
+        lines.append("# TYPE {0} histogram".format(name))
+        for key in keys:
+            data = snapshot[key]
+            total = 0
+            for bound, count in data['latency-buckets']:
+                total += count
+                if bound == float("inf"):
+                    bound = "+Inf"
+                lines.append("{0}_bucket{1} {2}".format(
+                    name, labels(key, ',le="{0}"'.format(bound)), total))
+            lines.append("{0}_sum{1} {2}".format(name, labels(key),
+                                                 data['latency-sum']))
+            lines.append("{0}_count{1} {2}".format(name, labels(key),
+                                                   data['count']))
+
+        name = prefix + "_responses_total"
+        lines.append("# TYPE {0} counter".format(name))
+        for key in keys:
+            for status in sorted(snapshot[key]['statuses']):
+                lines.append("{0}{1} {2}".format(
+                    name, labels(key, ',status="{0}"'.format(status)),
+                    snapshot[key]['statuses'][status]))
+
+        for metric, kind, field in [("errors_total", "counter", 'errors'),
+                                    ("request_bytes_total", "counter",
+                                     'request-bytes'),
+                                    ("response_bytes_total", "counter",
+                                     'response-bytes'),
+                                    ("requests_in_flight", "gauge",
+                                     'in-flight')]:
+            name = "{0}_{1}".format(prefix, metric)
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for key in keys:
+                lines.append("{0}{1} {2}".format(name, labels(key),
+                                                 snapshot[key][field]))
+
+        return "\n".join(lines) + "\n"
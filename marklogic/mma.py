@@ -6,7 +6,7 @@ import os
 import re
 import shlex
 import sys
-from requests.auth import HTTPDigestAuth
+from marklogic.auth import DigestAuth
 from requests.auth import HTTPBasicAuth
 from marklogic.connection import Connection
 from marklogic.cli.template import Template
@@ -161,7 +161,7 @@ class MMA():
                                              management_port=mgmt_port)
             else:
                 self.connection = Connection(host,
-                                             HTTPDigestAuth(username, password),
+                                             DigestAuth(username, password),
                                              management_port=mgmt_port)
 
         # do it!
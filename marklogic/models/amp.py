@@ -257,14 +257,7 @@ class Amp(Model, PropertyLists):
             params.append("modules-database="+modules_database)
 
         uri = connection.uri("amps", local_name, parameters=params)
-        response = connection.get(uri)
-        if response.status_code == 200:
-            result = Amp.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, Amp.unmarshal)
 
     @classmethod
     def list(cls, connection):
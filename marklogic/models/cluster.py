@@ -112,6 +112,8 @@ class LocalCluster(Model):
         uri = "{0}://{1}:{2}/manage/v2".format(
             connection.protocol, connection.host, connection.management_port)
         struct = {'operation': 'restart-local-cluster'}
+        # Name the hosts now, so they can be found while they restart
+        connection.host_ids()
         response = connection.post(uri, payload=struct)
         return self
 
@@ -129,14 +131,7 @@ class LocalCluster(Model):
     def lookup(cls, connection):
         uri = "{0}://{1}:{2}/manage/v2/properties".format(
             connection.protocol, connection.host, connection.management_port)
-        response = connection.get(uri)
-        if response.status_code == 200:
-            result = LocalCluster.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, LocalCluster.unmarshal)
 
     @classmethod
     def unmarshal(cls, config):
@@ -177,7 +172,8 @@ class LocalCluster(Model):
         xml = host._get_server_config()
         cfgzip = self._post_server_config(xml, connection)
 
-        host_connection = Connection(host.host_name(), connection.auth)
+        host_connection = Connection(host.host_name(), connection.auth,
+                                     session=connection.session)
         host._post_cluster_config(cfgzip, host_connection)
 
     def remove_host(self, host, connection=None):
@@ -437,15 +433,7 @@ class ForeignCluster(Model):
     @classmethod
     def lookup(cls, connection, name):
         uri = connection.uri("clusters", name)
-        response = connection.get(uri)
-
-        if response.status_code == 200:
-            result = ForeignCluster.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, ForeignCluster.unmarshal)
 
     @classmethod
     def unmarshal(cls, config):
@@ -3220,8 +3220,9 @@ class Database(Model,PropertyLists):
 
         with open(path) as data_file:
             file_data = data_file.read()
-            response = requests.put(doc_url, data=file_data, auth=connection.auth,
-                                    headers={'content-type': content_type})
+            response = connection.session.put(doc_url, data=file_data,
+                                              auth=connection.auth,
+                                              headers={'content-type': content_type})
             if response.status_code > 299:
                 raise UnexpectedAPIResponse(response.text)
 
@@ -3291,15 +3292,7 @@ class Database(Model,PropertyLists):
         uri = connection.uri("databases", name)
 
         logger.debug("Reading database configuration: {0}".format(name))
-        response = connection.get(uri)
-
-        result = None
-        if response.status_code == 200:
-            result = Database.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-
-        return result
+        return connection.get_model(uri, Database.unmarshal)
 
     @classmethod
     def list(cls, connection):
@@ -3969,8 +3962,8 @@ class Database(Model,PropertyLists):
         doc_url = "http://{0}:{1}/v1/documents?uri={2}&database={3}" \
           .format(connection.host, connection.port, document_uri, self.name)
 
-        response = requests.get(doc_url, auth=connection.auth,
-                                headers={'accept': content_type})
+        response = connection.session.get(doc_url, auth=connection.auth,
+                                          headers={'accept': content_type})
         if response.status_code == 404:
             return None
         elif response.status_code == 200:
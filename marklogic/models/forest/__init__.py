@@ -343,15 +343,9 @@ class Forest(Model,PropertyLists):
         :return: The Forest object
         """
         uri = connection.uri("forests", name)
-        response = connection.get(uri)
-
-        result = None
-        if response.status_code == 200:
-            result = Forest.unmarshal(json.loads(response.text))
+        result = connection.get_model(uri, Forest.unmarshal)
+        if result is not None:
             result.name = name
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-
         return result
 
     @classmethod
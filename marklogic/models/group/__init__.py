@@ -317,15 +317,7 @@ class Group(Model, PropertyLists):
         :return: The group
         """
         uri = connection.uri("groups", name)
-        response = connection.get(uri)
-
-        if response.status_code == 200:
-            result = Group.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, Group.unmarshal)
 
     # Below this point are machine generated methods for getting
     # and setting atomic values
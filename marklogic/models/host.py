@@ -187,6 +187,8 @@ class Host(Model):
 
         uri = connection.uri("hosts", self.name, properties=None)
         struct = {'operation': 'restart'}
+        # Name the hosts now, so they can be found while they restart
+        connection.host_ids()
         response = connection.post(uri, payload=struct)
         return self
 
@@ -216,14 +218,7 @@ class Host(Model):
         :return: The host information
         """
         uri = connection.uri("hosts", name)
-        response = connection.get(uri)
-        if response.status_code == 200:
-            result = Host.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, Host.unmarshal)
 
     @classmethod
     def list(cls, connection):
@@ -269,7 +264,8 @@ class Host(Model):
 
         xml = self._get_server_config()
         cfgzip = cluster._post_server_config(xml, cluster_connection)
-        connection = Connection(self.host_name(), cluster_connection.auth)
+        connection = Connection(self.host_name(), cluster_connection.auth,
+                                session=cluster_connection.session)
         self._post_cluster_config(cfgzip, connection)
 
     def _get_server_config(self):
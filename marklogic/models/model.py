@@ -22,6 +22,7 @@
 from abc import ABCMeta
 from marklogic.utilities.validators import ValidationError
 from marklogic.exceptions import UnsupportedOperation
+from marklogic.executor import BatchExecutor
 
 
 class Model:
@@ -32,6 +33,24 @@ class Model:
     """
     __metaclass__ = ABCMeta
 
+    @classmethod
+    def lookup_many(cls, connection, names, max_workers=8):
+        """
+        Look up several resources concurrently.
+
+        Each name is passed to the `lookup` method of the class; pass a
+        tuple to supply several arguments, for example a name and group.
+        A lookup that fails doesn't stop the others.
+
+        :param connection: The server connection
+        :param names: The names to look up
+        :param max_workers: The number of requests to send at once
+        :return: A list of :class:`marklogic.executor.BatchResult`
+        objects, in the order of `names`
+        """
+        with BatchExecutor(connection, max_workers) as executor:
+            return executor.lookup(cls, names)
+
     def _get_config_property(self, key):
         if key in self._config:
             return self._config[key]
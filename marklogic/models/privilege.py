@@ -370,14 +370,7 @@ class Privilege(Model, PropertyLists):
             return cls._lookup_action(connection, action, kind)
         else:
             uri = connection.uri("privileges", name, parameters=["kind="+kind])
-            response = connection.get(uri)
-            if response.status_code == 200:
-                result = Privilege.unmarshal(json.loads(response.text))
-                if 'etag' in response.headers:
-                    result.etag = response.headers['etag']
-                return result
-            else:
-                return None
+            return connection.get_model(uri, Privilege.unmarshal)
 
     @classmethod
     def _lookup_action(cls, conn, action, kind):
@@ -363,12 +363,4 @@ class Role(Model, PropertyLists):
         :return: The role
         """
         uri = connection.uri("roles", name)
-        response = connection.get(uri)
-
-        if response.status_code == 200:
-            result = Role.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, Role.unmarshal)
@@ -1476,16 +1476,10 @@ class Server(Model,PropertyLists):
             raise validate_custom("Unparseable server name")
 
         uri = connection.uri("servers", name, parameters=["group-id="+group])
-        response = connection.get(uri)
-
-        if response.status_code == 200:
-            result = Server.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
+        result = connection.get_model(uri, Server.unmarshal)
+        if result is not None:
             result.name = result._config['server-name']
-            return result
-        else:
-            return None
+        return result
 
     @classmethod
     def unmarshal(cls, config, connection=None, save_connection=True):
@@ -345,14 +345,7 @@ class Task(Model, PropertyLists):
         :return: The task information
         """
         uri = connection.uri("tasks", taskid, parameters=["group-id="+group])
-        response = connection.get(uri)
-        if response.status_code == 200:
-            result = Task.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, Task.unmarshal)
 
     @classmethod
     def list(cls, connection):
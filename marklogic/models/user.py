@@ -335,15 +335,7 @@ class User(Model, PropertyLists):
         :return: The user
         """
         uri = connection.uri("users", name)
-        response = connection.get(uri)
-
-        if response.status_code == 200:
-            result = User.unmarshal(json.loads(response.text))
-            if 'etag' in response.headers:
-                result.etag = response.headers['etag']
-            return result
-        else:
-            return None
+        return connection.get_model(uri, User.unmarshal)
 
     # Below this point are machine generated methods for getting
     # and setting atomic values
@@ -0,0 +1,220 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Recording requests and responses, and replaying them without a server.
+"""
+
+import base64
+import io
+import json
+import threading
+import requests
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Headers that describe the body on the wire rather than the body
+_WIRE_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding',
+                 'connection']
+
+
+def _encode_body(body):
+    if body is None:
+        return None, None
+    if isinstance(body, str):
+        return body, "text"
+    if not isinstance(body, (bytes, bytearray)):
+        return None, None
+    try:
+        return body.decode("utf-8"), "text"
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode("ascii"), "base64"
+
+
+def _decode_body(body, encoding):
+    if body is None:
+        return b""
+    if encoding == "base64":
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+class Recorder:
+    """
+    The Recorder class captures the requests a connection sends and the
+    responses it receives.
+
+    Pass an instance to a :class:`marklogic.connection.Connection` as
+    `recorder`. Each exchange is a dictionary with the method, URI,
+    headers and body of the request and the status, headers and body of
+    the response. Authorization headers are not recorded. The body of
+    a streamed response is recorded as it is read; if it isn't read to
+    the end, the exchange is recorded without a body.
+
+    Save the exchanges with :meth:`save` and replay them with
+    :func:`replay_session` or :class:`marklogic.fakeserver.FakeMarkLogic`.
+    """
+    def __init__(self, exchanges=None):
+        self._lock = threading.Lock()
+        if exchanges is None:
+            exchanges = []
+        self.exchanges = exchanges
+
+    def record(self, response, streamed=False):
+        """Record the request that produced `response` and the response."""
+        request = response.request
+        headers = {key: request.headers[key] for key in request.headers
+                   if key.lower() != 'authorization'}
+        request_body, request_encoding = _encode_body(request.body)
+        response_headers = {key: response.headers[key]
+                            for key in response.headers
+                            if key.lower() not in _WIRE_HEADERS}
+        if streamed:
+            response_body, response_encoding = None, None
+        else:
+            response_body, response_encoding = _encode_body(response.content)
+        exchange = {'method': request.method,
+                    'uri': request.url,
+                    'request-headers': headers,
+                    'request-body': request_body,
+                    'request-body-encoding': request_encoding,
+                    'status': response.status_code,
+                    'reason': response.reason,
+                    'response-headers': response_headers,
+                    'response-body': response_body,
+                    'response-body-encoding': response_encoding,
+                    'streamed': streamed}
+        with self._lock:
+            self.exchanges.append(exchange)
+        if streamed:
+            self._tee(response, exchange)
+
+    def _tee(self, response, exchange):
+        """
+        Record the body of a streamed response when it has been read.
+        """
+        iter_content = response.iter_content
+
+        def tee(chunk_size=1, decode_unicode=False):
+            body = bytearray()
+            for chunk in iter_content(chunk_size, decode_unicode):
+                if isinstance(chunk, str):
+                    body += chunk.encode(response.encoding or "utf-8")
+                else:
+                    body += chunk
+                yield chunk
+            encoded, encoding = _encode_body(bytes(body))
+            with self._lock:
+                exchange['response-body'] = encoded
+                exchange['response-body-encoding'] = encoding
+
+        response.iter_content = tee
+
+    def clear(self):
+        """Discard the recorded exchanges."""
+        with self._lock:
+            self.exchanges = []
+
+    def save(self, filename):
+        """Save the recorded exchanges to a JSON file."""
+        with self._lock:
+            exchanges = list(self.exchanges)
+        with open(filename, "w") as recording:
+            json.dump(exchanges, recording, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        """Load exchanges saved with :meth:`save`."""
+        with open(filename) as recording:
+            return cls(json.load(recording))
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    The ReplayAdapter class is a transport adapter that answers requests
+    with recorded responses instead of sending them.
+
+    Requests are matched by method and URI. If the same request was
+    recorded several times, the responses are replayed in order and the
+    last one is repeated. A request with no recorded response raises
+    a :class:`requests.exceptions.ConnectionError`. A streamed response
+    whose body wasn't recorded is replayed with an empty body.
+    """
+    def __init__(self, exchanges):
+        super(ReplayAdapter, self).__init__()
+        self._lock = threading.Lock()
+        self._responses = {}
+        for exchange in exchanges:
+            key = (exchange['method'], exchange['uri'])
+            self._responses.setdefault(key, []).append(exchange)
+
+    def _next(self, key):
+        with self._lock:
+            queue = self._responses.get(key)
+            if not queue:
+                return None
+            if len(queue) > 1:
+                return queue.pop(0)
+            return queue[0]
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        exchange = self._next((request.method, request.url))
+        if exchange is None:
+            raise ConnectionError("No recorded response for {0} {1}"
+                                  .format(request.method, request.url),
+                                  request=request)
+
+        body = _decode_body(exchange['response-body'],
+                            exchange['response-body-encoding'])
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.headers = CaseInsensitiveDict(exchange['response-headers'])
+        response.headers['content-length'] = str(len(body))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+def replay_session(recording):
+    """
+    Return a :class:`requests.Session` that replays a recording.
+
+    Pass it to a :class:`marklogic.connection.Connection` as `session`.
+
+    :param recording: A :class:`Recorder`, a list of exchanges, or the
+    name of a file saved with :meth:`Recorder.save`
+    """
+    if isinstance(recording, str):
+        recording = Recorder.load(recording)
+    if isinstance(recording, Recorder):
+        recording = recording.exchanges
+    session = requests.Session()
+    adapter = ReplayAdapter(recording)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
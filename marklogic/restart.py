@@ -0,0 +1,119 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Waiting for hosts to restart.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import BadStatusLine
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
+from requests.packages.urllib3.exceptions import ProtocolError
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+
+
+class RestartWaiter:
+    """
+    The RestartWaiter class waits for one or more hosts to restart.
+
+    Each host's ``/admin/v1/timestamp`` endpoint on `admin_port` is
+    polled until it reports a startup time different from the ones
+    reported before the restart. The hosts are polled concurrently,
+    first after `initial_delay` seconds, then with the delay growing
+    by `backoff` up to `max_delay`. Each poll times out after `timeout`
+    seconds.
+
+    If the hosts haven't all restarted within `deadline` seconds,
+    :class:`marklogic.exceptions.UnexpectedManagementAPIResponse` is
+    raised.
+    """
+    ERRORS = (ConnectionError, ChunkedEncodingError, Timeout,
+              BadStatusLine, ProtocolError)
+
+    def __init__(self, deadline=120, initial_delay=0.25, max_delay=4.0,
+                 backoff=1.5, timeout=5, admin_port=8001, max_workers=32):
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.admin_port = admin_port
+        self.max_workers = max_workers
+        self.logger = logging.getLogger("marklogic.restart")
+
+    def wait(self, connection, hosts, last_startups,
+             timestamp_uri="/admin/v1/timestamp", deadline=None):
+        """
+        Wait for `hosts` to restart.
+
+        :param connection: The connection whose session and credentials
+        are used to poll the hosts
+        :param hosts: The names of the hosts
+        :param last_startups: The startup times reported before the
+        restart
+        :param deadline: The number of seconds to wait, overriding the
+        default
+        :return: A dictionary mapping each host to its new startup time
+        """
+        if deadline is None:
+            deadline = self.deadline
+        until = time.time() + deadline
+        old = frozenset(last_startups)
+        hosts = list(hosts)
+
+        workers = max(1, min(len(hosts), self.max_workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {host: executor.submit(self._wait_for_host, connection,
+                                             host, old, timestamp_uri, until)
+                       for host in hosts}
+            startups = {host: futures[host].result() for host in hosts}
+
+        hung = [host for host in hosts if startups[host] is None]
+        if hung:
+            raise UnexpectedManagementAPIResponse(
+                "Restart hung? No new startup time from {0} after {1}s"
+                .format(", ".join(hung), deadline))
+        return startups
+
+    def _wait_for_host(self, connection, host, old, timestamp_uri, until):
+        uri = "{0}://{1}:{2}{3}".format(connection.protocol, host,
+                                        self.admin_port, timestamp_uri)
+        delay = self.initial_delay
+        while True:
+            remaining = until - time.time()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(self.max_delay, delay * self.backoff)
+
+            self.logger.debug("Waiting for restart of {0}".format(host))
+            try:
+                response = connection.session.get(
+                    uri, auth=connection.auth,
+                    headers={'accept': 'application/json'},
+                    verify=connection.verify,
+                    timeout=max(0.1, min(self.timeout, until - time.time())))
+            except self.ERRORS as err:
+                self.logger.debug("{0}: {1}".format(host, type(err).__name__))
+                continue
+
+            if response.status_code == 200 and response.text not in old:
+                self.logger.debug("{0} restarted".format(host))
+                return response.text
@@ -0,0 +1,176 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Retry policies for connections.
+"""
+
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from requests.exceptions import ConnectionError
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import Timeout
+
+
+class RetryBudget:
+    """
+    A RetryBudget limits retries to a fraction of the requests sent.
+
+    Every request deposits `ratio` tokens, up to `capacity`; every retry
+    withdraws one. When the budget is empty, failures are not retried,
+    so a struggling server isn't hit with a storm of retries.
+    """
+    def __init__(self, ratio=0.2, capacity=100, initial=10):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = min(initial, capacity)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Record a request."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Take a token for a retry. Return False if there are none."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def tokens(self):
+        """Return the number of tokens available."""
+        return self._tokens
+
+
+class RetryPolicy:
+    """
+    The RetryPolicy class decides whether, and after how long, a failed
+    request is sent again.
+
+    A request is retried if it fails with a connection error or timeout,
+    if the status code is in `statuses`, or if the error response has
+    a MarkLogic message code in `codes`. Only `methods` are retried by
+    default; other requests (typically POST) are retried only if the
+    caller says they are idempotent. A request carrying an etag
+    (``if-match``) is also considered idempotent.
+
+    The delay before retry `n` (counting from 0) is
+    ``backoff * 2 ** n`` seconds, capped at `max_backoff`, with "full
+    jitter" if `jitter` is True. A ``Retry-After`` header from the server
+    takes precedence if `respect_retry_after` is True.
+    """
+    IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+    RETRY_STATUSES = frozenset([502, 503, 504])
+    RETRY_CODES = frozenset(["XDMP-FORESTNOTOPEN", "XDMP-FORESTMNT",
+                             "XDMP-XDQPNOSESSION", "XDMP-XDQPDISC",
+                             "XDMP-NOTMASTER", "XDMP-FORESTERR"])
+    ERRORS = (ConnectionError, ChunkedEncodingError, Timeout)
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30.0,
+                 jitter=True, statuses=None, codes=None, methods=None,
+                 respect_retry_after=True, budget=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        if statuses is None:
+            statuses = self.RETRY_STATUSES
+        self.statuses = frozenset(statuses)
+        if codes is None:
+            codes = self.RETRY_CODES
+        self.codes = frozenset(codes)
+        if methods is None:
+            methods = self.IDEMPOTENT_METHODS
+        self.methods = frozenset(methods)
+        self.respect_retry_after = respect_retry_after
+        self.budget = budget
+        self._random = random.Random()
+
+    def applies(self, method, headers=None, idempotent=None):
+        """
+        Decide whether a request may be retried at all.
+
+        :param method: The HTTP method
+        :param headers: The request headers
+        :param idempotent: True or False to override the method check
+        """
+        if idempotent is not None:
+            return idempotent
+        if method.upper() in self.methods:
+            return True
+        return headers is not None and 'if-match' in headers
+
+    def message_code(self, response):
+        """Return the MarkLogic message code of an error response, if any."""
+        try:
+            data = json.loads(response.text)
+            return data['errorResponse']['messageCode']
+        except (ValueError, KeyError, TypeError):
+            pass
+        for code in self.codes:
+            if code in response.text:
+                return code
+        return None
+
+    def should_retry(self, attempt, response=None, error=None):
+        """
+        Decide whether to retry after `attempt` retries have been made.
+        """
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            retry = isinstance(error, self.ERRORS)
+        elif response.status_code in self.statuses:
+            retry = True
+        elif response.status_code >= 500:
+            retry = self.message_code(response) in self.codes
+        else:
+            retry = False
+        if retry and self.budget is not None:
+            retry = self.budget.withdraw()
+        return retry
+
+    def retry_after(self, response):
+        """Return the delay requested by a Retry-After header, or None."""
+        if response is None or not self.respect_retry_after:
+            return None
+        value = response.headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def delay(self, attempt, response=None):
+        """Return the number of seconds to wait before the next attempt."""
+        delay = self.retry_after(response)
+        if delay is not None:
+            return min(delay, self.max_backoff)
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = self._random.uniform(0, delay)
+        return delay
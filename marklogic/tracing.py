@@ -0,0 +1,123 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Request tracing for connections.
+"""
+
+import json
+import logging
+import random
+
+
+class Tracer:
+    """
+    The Tracer class records a structured event for each request sent
+    by a connection.
+
+    A connection without a tracer does no tracing work at all. With a
+    tracer, only a `sample_rate` fraction of requests is traced. Request
+    and response bodies are included only if `include_bodies` is True,
+    and then are clipped to `max_body_size` bytes.
+
+    Each event is a dictionary passed to `sink`. The default sink logs
+    the event as JSON on the ``marklogic.connection.trace`` logger at
+    debug level.
+    """
+    def __init__(self, sink=None, sample_rate=1.0, include_bodies=False,
+                 max_body_size=1024):
+        self.sample_rate = sample_rate
+        self.include_bodies = include_bodies
+        self.max_body_size = max_body_size
+        self.logger = logging.getLogger("marklogic.connection.trace")
+        if sink is None:
+            sink = self._log
+        self.sink = sink
+        self._random = random.Random()
+
+    def sampled(self):
+        """Decide whether the next request should be traced."""
+        if self.sample_rate >= 1.0:
+            return True
+        return self._random.random() < self.sample_rate
+
+    def _clip(self, body):
+        if body is None:
+            return None
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if not isinstance(body, (bytes, bytearray)):
+            return "<{0}>".format(type(body).__name__)
+        clipped = bytes(body[:self.max_body_size]).decode("utf-8", "replace")
+        if len(body) > self.max_body_size:
+            clipped += "...[{0} bytes]".format(len(body))
+        return clipped
+
+    @staticmethod
+    def _length(body):
+        if body is None:
+            return 0
+        if isinstance(body, (str, bytes, bytearray)):
+            return len(body)
+        return None
+
+    def trace(self, method, uri, request, response, elapsed, error=None,
+              streamed=False):
+        """
+        Record one request.
+
+        :param method: The HTTP method
+        :param uri: The request URI
+        :param request: The prepared request, or None if it wasn't sent
+        :param response: The response, or None if the request failed
+        :param elapsed: The elapsed time in seconds
+        :param error: The exception raised, if any
+        :param streamed: True if the response body must be left unread
+        """
+        event = {'method': method,
+                 'uri': uri,
+                 'elapsed': elapsed}
+
+        if request is not None:
+            event['request-bytes'] = self._length(request.body)
+            if self.include_bodies:
+                headers = dict(request.headers)
+                if 'Authorization' in headers:
+                    headers['Authorization'] = "<redacted>"
+                event['request-headers'] = headers
+                event['request-body'] = self._clip(request.body)
+
+        if response is not None:
+            event['status'] = response.status_code
+            length = response.headers.get('content-length')
+            if length is not None:
+                length = int(length)
+            event['response-bytes'] = length
+            if self.include_bodies:
+                event['response-headers'] = dict(response.headers)
+                if streamed:
+                    event['response-body'] = "<streamed>"
+                else:
+                    event['response-body'] = self._clip(response.content)
+
+        if error is not None:
+            event['error'] = repr(error)
+
+        self.sink(event)
+
+    def _log(self, event):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(json.dumps(event, default=str))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import requests
+from mlconfig import MLConfig
+from marklogic.auth import DigestAuth
+from marklogic.breaker import CircuitBreaker
+from marklogic.connection import Connection
+from marklogic.fakeserver import FakeMarkLogic
+from marklogic.exceptions import CircuitOpenError
+from marklogic.loadbalancer import LoadBalancer
+
+class TestBreaker(MLConfig):
+    """
+    Circuit breaker tests that don't require a server.
+    """
+    def _response(self, status):
+        response = requests.Response()
+        response.status_code = status
+        return response
+
+    def test_open_and_close(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        error = requests.exceptions.ConnectionError()
+
+        breaker.acquire("host1")
+        breaker.record("host1", 0.1, error=error)
+        assert CircuitBreaker.CLOSED == breaker.state("host1")
+        breaker.acquire("host1")
+        breaker.record("host1", 0.1, response=self._response(503))
+        assert CircuitBreaker.OPEN == breaker.state("host1")
+        assert ["host1"] == breaker.open_hosts()
+        assert not breaker.available("host1")
+        assert breaker.available("host2")
+
+        try:
+            breaker.acquire("host1")
+            assert False
+        except CircuitOpenError as err:
+            assert "host1" == err.host
+
+        time.sleep(0.1)
+        assert CircuitBreaker.HALF_OPEN == breaker.state("host1")
+        breaker.acquire("host1")
+        assert not breaker.available("host1")
+        breaker.record("host1", 0.1, response=self._response(200))
+        assert CircuitBreaker.CLOSED == breaker.state("host1")
+        assert 0 == breaker.states()["host1"]['consecutive-failures']
+        assert 2 == breaker.states()["host1"]['failures']
+
+    def test_failed_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.acquire("host1")
+        breaker.record("host1", 0.1, error=requests.exceptions.Timeout())
+        time.sleep(0.1)
+        breaker.acquire("host1")
+        breaker.record("host1", 0.1, error=requests.exceptions.Timeout())
+        assert CircuitBreaker.OPEN == breaker.state("host1")
+
+    def test_failed_preauthentication(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        with FakeMarkLogic() as fake:
+            port = fake.port
+        conn = Connection("127.0.0.1", DigestAuth("admin", "admin"),
+                          port=port, management_port=port, breaker=breaker,
+                          preauthenticate=True)
+        # The failed HEAD trips the circuit, and then fails the probe
+        for attempt in range(2):
+            try:
+                conn.post(conn.client_uri("documents"), payload="<doc/>",
+                          content_type="application/xml")
+                assert False
+            except requests.exceptions.ConnectionError:
+                pass
+            assert CircuitBreaker.OPEN == breaker.state("127.0.0.1")
+            time.sleep(0.1)
+        breaker.acquire("127.0.0.1")
+
+    def test_slow_calls(self):
+        breaker = CircuitBreaker(failure_threshold=1, slow_threshold=1.0)
+        breaker.acquire("host1")
+        breaker.record("host1", 0.5, response=self._response(200))
+        assert CircuitBreaker.CLOSED == breaker.state("host1")
+        breaker.record("host1", 2.5, response=self._response(200))
+        assert CircuitBreaker.OPEN == breaker.state("host1")
+        assert 0.9 == round(breaker.states()["host1"]['latency'], 2)
+
+    def test_exclude(self):
+        balancer = LoadBalancer(["host1", "host2"])
+        for i in range(4):
+            name = balancer.acquire(exclude=["host1"])
+            assert "host2" == name
+            balancer.release(name, None)
+        # If every host is excluded, one is chosen anyway
+        assert balancer.acquire(exclude=["host1", "host2"]) in ["host1", "host2"]
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from mlconfig import MLConfig
+import asyncio
+import socket
+import time
+import requests
+from marklogic.auth import DigestAuth
+from marklogic.cache import ResponseCache
+from marklogic.asyncconnection import AsyncConnection
+from marklogic.compression import Compression
+from marklogic.connection import Connection
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+from marklogic.executor import BatchExecutor
+from marklogic.models.database import Database
+from marklogic.restart import RestartWaiter
+from marklogic.tracing import Tracer
+
+class TestConnection(MLConfig):
+    """
+    Connection tests that don't require a server.
+    """
+    def test_pooled_session(self):
+        conn = Connection("localhost", None, pool_connections=3,
+                          pool_maxsize=7)
+        adapter = conn.session.get_adapter("http://localhost:8002/")
+        assert 3 == adapter._pool_connections
+        assert 7 == adapter._pool_maxsize
+        assert 'keep-alive' == conn.session.headers['connection']
+        conn.close()
+
+    def test_unpooled_session(self):
+        conn = Connection("localhost", None, pooling=False)
+        assert 'close' == conn.session.headers['connection']
+
+    def test_shared_session(self):
+        conn = Connection("host1", None)
+        other = Connection("host2", None, session=conn.session)
+        assert conn.session is other.session
+
+    def test_digest_nonce_reuse(self):
+        auth = DigestAuth("admin", "admin")
+        uri = "http://localhost:8002/manage/v2/databases"
+        assert not auth.has_challenge(uri)
+
+        req = requests.Request("GET", uri).prepare()
+        auth(req)
+        assert 'Authorization' not in req.headers
+
+        # Simulate the challenge from the first 401 response
+        auth._thread_local.chal = {'realm': 'public', 'nonce': 'abc',
+                                   'qop': 'auth'}
+        auth._thread_local.challenged = True
+        auth.build_digest_header("GET", uri)
+        auth._thread_local.challenged = False
+        assert auth.has_challenge(uri)
+
+        req = requests.Request("GET", uri + "/Documents").prepare()
+        auth(req)
+        assert 'nc=00000002' in req.headers['Authorization']
+
+        req = requests.Request("GET", "http://localhost:8000/v1/documents") \
+          .prepare()
+        auth(req)
+        assert 'Authorization' not in req.headers
+
+    def test_async_lookup(self):
+        class Named:
+            @classmethod
+            def lookup(cls, connection, name):
+                return (connection, name)
+
+        aconn = AsyncConnection.from_connection(self.connection,
+                                                max_in_flight=4)
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(
+                aconn.lookup_many(Named, ["a", "b", "c"]))
+        finally:
+            loop.close()
+            aconn.close()
+
+        assert [(self.connection, "a"), (self.connection, "b"),
+                (self.connection, "c")] == result
+
+    def test_async_close(self):
+        closed = []
+        conn = Connection("localhost", None)
+        conn.close = lambda: closed.append(conn)
+        AsyncConnection.from_connection(conn).close()
+        assert [] == closed
+
+        aconn = AsyncConnection("localhost", None)
+        aconn.connection.close = lambda: closed.append(aconn.connection)
+        aconn.close()
+        assert [aconn.connection] == closed
+
+    def test_tracer(self):
+        events = []
+        tracer = Tracer(sink=events.append, include_bodies=True,
+                        max_body_size=4)
+        request = requests.Request("POST", "http://localhost:8000/v1/eval",
+                                   data="abcdefgh",
+                                   headers={'Authorization': 'secret'}) \
+                                   .prepare()
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"{}"
+        tracer.trace("POST", request.url, request, response, 0.5)
+
+        assert 1 == len(events)
+        assert 200 == events[0]['status']
+        assert 8 == events[0]['request-bytes']
+        assert events[0]['request-body'].startswith("abcd...")
+        assert "<redacted>" == events[0]['request-headers']['Authorization']
+
+        tracer = Tracer(sample_rate=0.0)
+        assert not tracer.sampled()
+
+    def test_compression(self):
+        compression = Compression(threshold=100)
+        kwargs = {'json': {'text': 'x' * 1000}, 'headers': {}}
+        compression.prepare(kwargs)
+        assert 'json' not in kwargs
+        assert 'gzip' == kwargs['headers']['content-encoding']
+        assert len(kwargs['data']) < 100
+
+        kwargs = {'data': 'small'}
+        compression.prepare(kwargs)
+        assert 'small' == kwargs['data']
+        assert 'content-encoding' not in kwargs['headers']
+
+        stats = compression.stats()
+        assert 1 == stats['requests-compressed']
+        assert 1 == stats['requests-skipped']
+        assert stats['request-ratio'] > 10
+
+    def test_batch_executor(self):
+        def operation(connection, name):
+            if name == "bad":
+                raise ValueError(name)
+            return name.upper()
+
+        with BatchExecutor(self.connection, max_workers=3) as executor:
+            results = executor.map(operation, ["a", "bad", "c", "d"])
+
+        assert ["A", None, "C", "D"] == [result.value for result in results]
+        assert [True, False, True, True] == [result.ok() for result in results]
+        assert isinstance(results[1].error, ValueError)
+
+    def test_response_cache(self):
+        cache = ResponseCache(max_entries=2)
+        db = Database("cached-db", connection=self.connection)
+        cache.put("uri1", '"1"', db)
+        cache.put("uri2", '"2"', Database("other-db"))
+
+        copy = cache.get("uri1", '"1"')
+        assert copy is not db
+        assert "cached-db" == copy.database_name()
+        assert copy.connection is self.connection
+        assert cache.get("uri1", '"stale"') is None
+
+        # uri1 was used more recently than uri2, so uri2 is evicted
+        cache.put("uri3", '"3"', Database("third-db"))
+        assert cache.etag("uri2") is None
+        assert '"1"' == cache.etag("uri1")
+        assert 1 == cache.stats()['evictions']
+
+    def test_restart_waiter(self):
+        class Session:
+            def __init__(self):
+                self.polls = {}
+
+            def get(self, uri, **kwargs):
+                host = uri.split("/")[2].split(":")[0]
+                self.polls[host] = self.polls.get(host, 0) + 1
+                response = requests.Response()
+                response.status_code = 200
+                if self.polls[host] < 3:
+                    response._content = b"old-" + host.encode("utf-8")
+                else:
+                    response._content = b"new-" + host.encode("utf-8")
+                return response
+
+        conn = Connection("host1", None, session=Session())
+        waiter = RestartWaiter(deadline=5, initial_delay=0.01, max_delay=0.05)
+        startups = waiter.wait(conn, ["host1", "host2"],
+                               ["old-host1", "old-host2"])
+        assert {'host1': "new-host1", 'host2': "new-host2"} == startups
+
+        waiter = RestartWaiter(deadline=0.1, initial_delay=0.01)
+        try:
+            waiter.wait(conn, ["host3"], ["old-host3", "new-host3"])
+            assert False
+        except UnexpectedManagementAPIResponse:
+            pass
+
+    def test_restart_host_lookup(self):
+        # A server that accepts connections but never answers, like a
+        # cluster in the middle of a restart
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(8)
+        port = server.getsockname()[1]
+        try:
+            waiter = RestartWaiter(deadline=0.5, initial_delay=0.01,
+                                   timeout=0.2, admin_port=port)
+            conn = Connection("127.0.0.1", None, port=port,
+                              management_port=port, restart_waiter=waiter)
+            start = time.time()
+            try:
+                conn.wait_for_restart([{'host-id': "123", 'value': "old"}])
+                assert False
+            except UnexpectedManagementAPIResponse as err:
+                assert "127.0.0.1" in str(err)
+            assert time.time() - start < 5
+        finally:
+            server.close()
@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import json
+import mmap
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+from mlconfig import MLConfig
+from marklogic.client import BatchSizer, ClientUtils, Documents
+from marklogic.client import ForestRouter, MultipartReader
+from marklogic.client.bulkloader import BulkLoader
+from marklogic.client.content import ContentSource
+from marklogic.client.exceptions import InvalidAPIRequest
+from marklogic.compression import Compression
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+from requests.exceptions import ConnectionError
+from marklogic.fakeserver import FakeMarkLogic
+from marklogic.models.database import Database
+from marklogic.models.forest import Forest
+from marklogic.recording import Recorder
+
+class TestDocuments(MLConfig):
+    """
+    Document tests that run against a fake server.
+    """
+    def _load(self, conn, count, collection=None):
+        loader = BulkLoader(conn)
+        for index in range(count):
+            doc = Documents()
+            doc.set_uri("/doc/{0}.xml".format(index))
+            if collection is not None:
+                doc.set_collections([collection])
+            doc.set_content("<doc>{0}</doc>".format(index))
+            loader.add(doc)
+        loader.post()
+        return ["/doc/{0}.xml".format(index) for index in range(count)]
+
+    def test_fetch(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            uris = self._load(conn, 25)
+            docs = Documents(conn)
+            result = list(docs.fetch(iter(uris + ["/missing.xml"]),
+                                     batch_size=4, max_in_flight=3))
+            assert uris == [item[0] for item in result]
+            assert b"<doc>7</doc>" == result[7][2]
+            assert result[7][1] is None
+
+            docs.set_categories(["content", "metadata"])
+            result = list(docs.fetch(uris, batch_size=5, ordered=False))
+            assert sorted(uris) == sorted(item[0] for item in result)
+            assert result[0][1].startswith(b"<rapi:metadata")
+
+    def test_streamed_get(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            doc = Documents(conn)
+            doc.set_uri("/stream/big.xml")
+            content = "<doc>{0}</doc>".format("x" * 100000)
+            doc.put(data=content)
+
+            uri = conn.client_uri("documents") + "?uri=/stream/big.xml"
+            response = conn.get(uri, accept="application/xml", stream=True)
+            assert not response._content_consumed
+            chunks = list(conn.iter_content(response, 1000))
+            assert 1000 == len(chunks[0])
+            assert content.encode("utf-8") == b"".join(chunks)
+            assert response.raw.closed
+
+            # A missing document is closed at once
+            response = conn.get(uri.replace("big", "missing"),
+                                accept="application/xml", stream=True)
+            assert 404 == response.status_code
+            assert response.raw.closed
+
+            chunks = list(doc.iter_get(chunk_size=4096))
+            assert 4096 == len(chunks[0])
+            assert content.encode("utf-8") == b"".join(chunks)
+            assert [] == list(doc.iter_get("/stream/missing.xml"))
+
+    def test_split(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            uris = self._load(conn, 30)
+            docs = Documents(conn)
+            docs.max_url_length = 200
+            docs.set_uris(uris + ["/missing.xml"])
+            before = fake.request_count
+            response = docs.get()
+            assert fake.request_count - before > 1
+            reader = MultipartReader([response.content],
+                                     response.headers['content-type'])
+            result = [(uri, content.content)
+                      for uri, metadata, content in reader.documents()]
+            assert uris == [item[0] for item in result]
+            assert b"<doc>12</doc>" == result[12][1]
+
+            # A split GET can be streamed and closed like any other
+            response = docs.get(stream=True)
+            assert fake.request_count - before > 2
+            assert response.content == b"".join(response.iter_content(64))
+            response.close()
+            body = b"".join(docs.iter_get(chunk_size=100))
+            assert b"<doc>29</doc>" in body
+            fetched = [uri for uri, metadata, content
+                       in docs.fetch(uris, batch_size=30)]
+            assert uris == fetched
+
+            # A single document that doesn't come back as multipart
+            get = conn.get
+            def single(uri, **kwargs):
+                kwargs['accept'] = "application/xml"
+                return get(uri, **kwargs)
+            conn.get = single
+            docs.max_url_length = 60
+            docs.set_uris(uris[:2])
+            response = docs.get()
+            reader = MultipartReader([response.content],
+                                     response.headers['content-type'])
+            assert [(uris[1], b"<doc>1</doc>")] == \
+                [(uri, content.content)
+                 for uri, metadata, content in reader.documents()][1:]
+            conn.get = get
+            docs.max_url_length = 200
+
+            # A delete that needs one request is made on this thread
+            threads = []
+            delete = conn.delete
+            def recording(uri, **kwargs):
+                threads.append(threading.current_thread())
+                return delete(uri, **kwargs)
+            conn.delete = recording
+            docs.set_uris(uris[:1])
+            assert docs.delete().status_code == 204
+            assert [threading.current_thread()] == threads
+            conn.delete = delete
+
+            docs.set_uris(uris[:20])
+            response = docs.delete()
+            assert response.status_code == 204
+            assert 10 == len(fake.documents)
+
+            # A failure in any of the requests is reported
+            delete = conn.delete
+            def failing(uri, **kwargs):
+                if "/doc/25.xml" in uri:
+                    raise UnexpectedManagementAPIResponse("Failed")
+                return delete(uri, **kwargs)
+            conn.delete = failing
+            docs.set_uris(uris[20:])
+            docs.max_url_length = 100
+            try:
+                docs.delete()
+                assert False
+            except UnexpectedManagementAPIResponse:
+                pass
+            # The other requests still finished
+            assert "/doc/25.xml" in fake.documents
+            assert "/doc/29.xml" not in fake.documents
+
+    def test_delete_documents(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            self._load(conn, 25, collection="stale")
+            doc = Documents(conn)
+            doc.set_uri("/keep/1.xml")
+            doc.set_content("<keep/>")
+            doc.put()
+
+            utils = ClientUtils(conn)
+            progress = []
+            total = utils.delete_documents("Documents", collection="stale",
+                                           batch_size=10,
+                                           progress=lambda done, left:
+                                           progress.append((done, left)))
+            assert 25 == total
+            assert [(10, 15), (20, 5), (25, 0)] == progress
+            assert ["/keep/1.xml"] == list(fake.documents)
+
+            # No criteria, or only empty ones, must not delete everything
+            for criteria in [{}, {'collection': ""},
+                             {'collection': "", 'directory': "", 'query': ""}]:
+                try:
+                    utils.delete_documents("Documents", **criteria)
+                    assert False
+                except InvalidAPIRequest:
+                    pass
+            assert ["/keep/1.xml"] == list(fake.documents)
+
+            assert 1 == utils.delete_documents("Documents", directory="/keep/")
+            assert 0 == len(fake.documents)
+
+            try:
+                utils.delete_documents("Documents")
+                assert False
+            except InvalidAPIRequest:
+                pass
+
+    def test_metadata(self):
+        doc = Documents()
+        doc.set_collections(["a&b", "c"])
+        doc.add_permission("app-user", "read")
+        doc.add_permission("app-user", "update")
+        doc.add_property("note", "<x> & y")
+        doc.set_quality(2)
+        xml = ElementTree.fromstring(doc.metadata())
+        ns = {'rapi': "http://marklogic.com/rest-api",
+              'prop': "http://marklogic.com/xdmp/property"}
+        assert ["a&b", "c"] == [coll.text for coll in
+                                xml.findall("rapi:collections/rapi:collection",
+                                            ns)]
+        assert "<x> & y" == xml.find("prop:properties/note", ns).text
+
+        other = Documents()
+        other.set_collections(["a&b", "c"])
+        other.add_permissions([("app-user", "read"), ("app-user", "update")])
+        other.add_property("note", "<x> & y")
+        other.set_quality(2)
+        assert doc.metadata() is other.metadata()
+
+        # Pairs given as lists are cached like tuples
+        other.permissions = [["app-user", "read"], ["app-user", "update"]]
+        assert doc.metadata() is other.metadata()
+
+        doc.set_metadata_format("json")
+        assert "application/json" == doc.metadata_content_type()
+        data = json.loads(doc.metadata())
+        assert 2 == data['quality']
+        assert ["read", "update"] == data['permissions'][0]['capabilities']
+        assert {'note': "<x> & y"} == data['properties']
+
+    def test_shared_metadata(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            loader = BulkLoader(conn)
+            for index in range(10):
+                doc = Documents()
+                doc.set_uri("/doc/{0}.xml".format(index))
+                doc.set_content("<doc>{0}</doc>".format(index))
+                doc.set_collections(["odd" if index % 2 else "even"]
+                                    if index >= 6 else ["first"])
+                loader.add(doc)
+            # One metadata part for the first six and one for each after
+            assert 15 == len(loader.fields)
+            loader.post()
+            assert ["first"] == fake.documents["/doc/5.xml"]['collections']
+            assert ["odd"] == fake.documents["/doc/7.xml"]['collections']
+            assert ["even"] == fake.documents["/doc/8.xml"]['collections']
+
+    def test_file_content(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "doc.xml")
+            with open(path, "wb") as out:
+                out.write(b"<doc>file</doc>")
+
+            with FakeMarkLogic() as fake:
+                conn = fake.connection()
+                doc = Documents(conn)
+                doc.set_uri("/file/1.xml")
+                doc.set_content_file(path)
+                assert 15 == doc.content().length
+                doc.put()
+                assert b"<doc>file</doc>" == fake.documents["/file/1.xml"]['content']
+
+                with open(path, "r+b") as source:
+                    mapped = mmap.mmap(source.fileno(), 0)
+                    loader = BulkLoader(conn)
+                    sources = [pathlib.Path(path), open(path, "rb"),
+                               io.BytesIO(b"<doc>bytesio</doc>"),
+                               memoryview(b"<doc>memoryview</doc>"), mapped]
+                    for index, data in enumerate(sources):
+                        doc = Documents()
+                        doc.set_uri("/file/{0}.xml".format(index + 2))
+                        doc.set_content(data)
+                        assert isinstance(doc.content(), ContentSource)
+                        loader.add(doc)
+                    loader.post()
+                    sources[1].close()
+                    doc.clear()
+                    mapped.close()
+
+                contents = [fake.documents["/file/{0}.xml".format(index)]
+                            ['content'] for index in range(2, 7)]
+                assert [b"<doc>file</doc>", b"<doc>file</doc>",
+                        b"<doc>bytesio</doc>", b"<doc>memoryview</doc>",
+                        b"<doc>file</doc>"] == contents
+
+    def test_chunked_upload(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            loader = BulkLoader(conn)
+            loader.chunked = True
+            for index in range(3):
+                doc = Documents()
+                doc.set_uri("/chunked/{0}.xml".format(index))
+                doc.set_content(memoryview(b"<doc>chunked</doc>"))
+                loader.add(doc)
+            response = loader.post()
+            assert 'transfer-encoding' in response.request.headers
+            assert b"<doc>chunked</doc>" == \
+                fake.documents["/chunked/2.xml"]['content']
+
+            # A pipe has no length, so the body is chunked
+            read_fd, write_fd = os.pipe()
+            with os.fdopen(write_fd, "wb") as out:
+                out.write(b"<doc>pipe</doc>")
+            with os.fdopen(read_fd, "rb") as pipe:
+                doc = Documents()
+                doc.set_uri("/chunked/pipe.xml")
+                doc.set_content(pipe)
+                assert doc.content().length is None
+                loader = BulkLoader(conn)
+                loader.add(doc)
+                response = loader.post()
+            assert 'content-length' not in response.request.headers
+            assert b"<doc>pipe</doc>" == \
+                fake.documents["/chunked/pipe.xml"]['content']
+
+    def test_compressed_upload(self):
+        with FakeMarkLogic() as fake:
+            compression = Compression(threshold=1024)
+            conn = fake.connection(compression=compression)
+            loader = BulkLoader(conn)
+            for index in range(100):
+                doc = Documents()
+                doc.set_uri("/gzip/{0}.xml".format(index))
+                doc.set_content("<doc>{0}</doc>".format("x" * 200))
+                loader.add(doc)
+            loader.post()
+            assert 100 == len(fake.documents)
+            assert "x" * 200 in \
+                fake.documents["/gzip/7.xml"]['content'].decode("utf-8")
+            stats = compression.stats()
+            assert 1 == stats['requests-compressed']
+            assert stats['request-ratio'] > 10
+
+            doc.set_uri("/gzip/small.xml")
+            loader.add(doc)
+            loader.post()
+            assert 1 == compression.stats()['requests-skipped']
+
+    def test_auto_flush(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            with BulkLoader(conn, max_documents=4) as loader:
+                for index in range(10):
+                    doc = Documents()
+                    doc.set_uri("/auto/{0}.xml".format(index))
+                    doc.set_content("<doc>{0}</doc>".format(index))
+                    loader.add(doc)
+                assert loader.size() == 2
+            assert 10 == loader.posted
+            assert 10 == len(fake.documents)
+
+            loader = BulkLoader(conn, max_bytes=30, max_age=0.1)
+            doc = Documents()
+            doc.set_uri("/auto/big.xml")
+            doc.set_content("<doc>{0}</doc>".format("x" * 30))
+            loader.add(doc)
+            assert loader.size() == 0
+            doc.set_uri("/auto/old.xml")
+            doc.set_content("<old/>")
+            loader.add(doc)
+            deadline = time.time() + 5
+            while loader.posted < 2 and time.time() < deadline:
+                time.sleep(0.05)
+            assert "/auto/old.xml" in fake.documents
+            loader.close()
+
+        # The server is gone, so the upload fails
+        loader = BulkLoader(fake.connection(), max_documents=1)
+        doc.set_uri("/auto/fails.xml")
+        loader.add(doc)
+        try:
+            loader.close()
+            assert False
+        except ConnectionError:
+            pass
+
+        # A failed post keeps the documents
+        loader = BulkLoader(fake.connection())
+        loader.add(doc)
+        try:
+            loader.post()
+            assert False
+        except ConnectionError:
+            pass
+        assert 1 == loader.size()
+        with FakeMarkLogic() as fake:
+            loader.post(fake.connection())
+            assert 0 == loader.size()
+            assert ["/auto/fails.xml"] == list(fake.documents)
+
+    def test_pipeline(self):
+        with FakeMarkLogic(latency=0.05) as fake:
+            conn = fake.connection()
+            lock = threading.Lock()
+            in_flight = [0, 0]
+            post = conn.post
+            def counting(*args, **kwargs):
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                try:
+                    return post(*args, **kwargs)
+                finally:
+                    with lock:
+                        in_flight[0] -= 1
+            conn.post = counting
+            done = []
+            loader = BulkLoader(conn, max_documents=5, max_in_flight=4,
+                                on_batch=lambda response, uris:
+                                done.extend(uris))
+            with loader:
+                for index in range(40):
+                    doc = Documents()
+                    doc.set_uri("/pipe/{0}.xml".format(index))
+                    doc.set_content("<doc>{0}</doc>".format(index))
+                    loader.add(doc)
+                # The queue is bounded
+                assert 8 == loader._queue.maxsize
+            # Eight batches, several at a time
+            assert 1 < in_flight[1] <= 4
+            report = loader.report()
+            assert 40 == report['documents']
+            assert 8 == report['batches']
+            assert 0 == report['failed-batches']
+            assert 40 == len(fake.documents)
+            assert sorted(done) == sorted(fake.documents)
+
+        failed = []
+        loader = BulkLoader(fake.connection(), max_documents=2, retries=1,
+                            on_error=lambda err, uris: failed.extend(uris))
+        loader.add(doc)
+        report = loader.close()
+        assert ["/pipe/39.xml"] == failed
+        assert 1 == report['retries']
+        assert 1 == report['failed-documents']
+
+    def test_batch_sizer(self):
+        sizer = BatchSizer(initial=10, floor=4, ceiling=14, increase=2,
+                           target_latency=1.0)
+        assert 12 == sizer.record(0.5)
+        assert 14 == sizer.record(0.5)
+        assert 14 == sizer.record(0.5)
+        assert 7 == sizer.record(1.5)
+        assert 4 == sizer.record(0.1, failed=True)
+        assert 4 == sizer.record(0.1, failed=True)
+        stats = sizer.stats()
+        assert 6 == stats['batches']
+        assert 2 == stats['failures']
+        assert 1 == stats['slow']
+        assert (4, 14) == (stats['smallest'], stats['largest'])
+
+        # The default bounds depend on the unit
+        sizer = BatchSizer()
+        assert (100, 10, 10000) == (sizer.size, sizer.floor, sizer.ceiling)
+        sizer = BatchSizer(unit=BatchSizer.BYTES)
+        assert 1024 * 1024 == sizer.size
+        assert (64 * 1024, 64 * 1024 * 1024) == (sizer.floor, sizer.ceiling)
+        sizer = BatchSizer(initial=5)
+        assert (5, 5, 10000) == (sizer.size, sizer.floor, sizer.ceiling)
+        try:
+            BatchSizer(unit="pages")
+            assert False
+        except InvalidAPIRequest:
+            pass
+
+        with FakeMarkLogic() as fake:
+            sizer = BatchSizer(initial=2, floor=2, ceiling=8, increase=2)
+            with BulkLoader(fake.connection(), batch_sizer=sizer) as loader:
+                for index in range(20):
+                    doc = Documents()
+                    doc.set_uri("/sized/{0}.xml".format(index))
+                    doc.set_content("<doc>{0}</doc>".format(index))
+                    loader.add(doc)
+            # Batches of 2, 4, 6, 8 are posted as the size grows
+            assert 20 == len(fake.documents)
+            assert 8 == loader.report()['batch-size']
+
+    def test_forest_routing(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            Forest("Documents-2", host="localhost").create(connection=conn)
+            database = Database.lookup(conn, "Documents")
+            database.add_forest_name("Documents-2").update(connection=conn)
+
+            router = ForestRouter(conn, "Documents")
+            assert router.enabled()
+            uris = ["/routed/{0}.xml".format(index) for index in range(20)]
+            hosts = router.hosts(uris)
+            assert {fake.host, "localhost"} == set(hosts)
+
+            recorder = Recorder()
+            conn.recorder = recorder
+            loader = BulkLoader(conn, router=router)
+            for index, uri in enumerate(uris):
+                doc = Documents()
+                doc.set_uri(uri)
+                doc.set_content("<doc>{0}</doc>".format(index))
+                doc.set_collections(["even" if index % 2 == 0 else "odd"])
+                loader.add(doc)
+            response = loader.post()
+            assert 200 == response.status_code
+            assert 20 == len(response.json()['documents'])
+            assert response.content == b"".join(response.iter_content(64))
+            response.close()
+
+            posted = [exchange['uri'] for exchange in recorder.exchanges
+                      if exchange['method'] == "POST"
+                      and "/v1/documents" in exchange['uri']]
+            assert 2 == len(posted)
+            assert any("//localhost:" in uri for uri in posted)
+            assert 2 == loader.report()['batches']
+            for index, uri in enumerate(uris):
+                collections = fake.documents[uri]['collections']
+                assert ["even" if index % 2 == 0 else "odd"] == collections
+
+            # Neither a transaction nor another database is routed
+            for loader in [BulkLoader(conn, router=router).set_txid("1"),
+                           BulkLoader(conn, router=router)
+                           .set_database("Other")]:
+                recorder.clear()
+                for uri in uris:
+                    doc = Documents()
+                    doc.set_uri(uri)
+                    doc.set_content("<doc/>")
+                    loader.add(doc)
+                loader.post()
+                posted = [exchange['uri'] for exchange in recorder.exchanges
+                          if exchange['method'] == "POST"]
+                assert 1 == len(posted)
+                assert "//localhost:" not in posted[0]
+
+            placed = ForestRouter(conn, "Documents",
+                                  placement=lambda uri, forests: forests[0])
+            assert [fake.host] * 2 == placed.hosts(uris[:2])
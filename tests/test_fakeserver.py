@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from mlconfig import MLConfig
+from marklogic.client import ClientUtils, Documents, Transactions
+from marklogic.client.bulkloader import BulkLoader
+from marklogic.connection import Connection
+from marklogic.fakeserver import FakeMarkLogic
+from marklogic.models.database import Database
+from marklogic.recording import Recorder, replay_session
+
+class TestFakeServer(MLConfig):
+    """
+    Tests of the fake server, which don't require a real one.
+    """
+    def test_management(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            assert ["Documents"] == Database.list(conn)
+            Database("fake-db").create(conn)
+            assert ["Documents", "fake-db"] == Database.list(conn)
+            database = Database.lookup(conn, "fake-db")
+            assert "fake-db" == database.database_name()
+            assert database.etag is not None
+            assert Database.lookup(conn, "no-such-db") is None
+
+    def test_documents(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            loader = BulkLoader(conn)
+            for index in range(3):
+                doc = Documents()
+                doc.set_uri("/fake/{0}.xml".format(index))
+                doc.set_content("<doc>{0}</doc>".format(index))
+                doc.set_collection("fake")
+                loader.add(doc)
+            assert 200 == loader.post().status_code
+
+            response = Documents(conn).get("/fake/1.xml")
+            assert "<doc>1</doc>" == response.text
+            assert ["fake"] == fake.documents["/fake/1.xml"]['collections']
+
+            uris = ClientUtils(conn).uris("Documents", root="/fake/")
+            assert ["/fake/0.xml", "/fake/1.xml", "/fake/2.xml"] == uris
+
+            trans = Transactions(conn)
+            assert 200 == trans.create().status_code
+            assert trans.txid() in fake.transactions
+            assert 204 == trans.commit().status_code
+
+    def test_record_and_replay(self):
+        recorder = Recorder()
+        with FakeMarkLogic() as fake:
+            conn = fake.connection(recorder=recorder)
+            assert ["Documents"] == Database.list(conn)
+            port = fake.port
+
+        assert 1 == len(recorder.exchanges)
+        conn = Connection("127.0.0.1", None, port=port, management_port=port,
+                          session=replay_session(recorder))
+        assert ["Documents"] == Database.list(conn)
+
+    def test_replay_streamed(self):
+        recorder = Recorder()
+        with FakeMarkLogic() as fake:
+            conn = fake.connection(recorder=recorder)
+            for name in ["a", "b"]:
+                doc = Documents(conn)
+                doc.set_uri("/{0}.xml".format(name))
+                doc.put(data="<{0}/>".format(name))
+            # Read with streamed responses
+            uris = ClientUtils(conn).uris("Documents")
+            assert ["/a.xml", "/b.xml"] == uris
+            docs = Documents(conn)
+            docs.set_uris(uris)
+            body = b"".join(docs.iter_get())
+            port = fake.port
+
+        conn = Connection("127.0.0.1", None, port=port, management_port=port,
+                          session=replay_session(recorder))
+        assert uris == ClientUtils(conn).uris("Documents")
+        docs = Documents(conn)
+        docs.set_uris(uris)
+        assert body == b"".join(docs.iter_get())
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from urllib.parse import urlparse
+from mlconfig import MLConfig
+from marklogic.loadbalancer import LoadBalancer, ClusterConnection
+
+class TestLoadBalancer(MLConfig):
+    """
+    Load balancer tests that don't require a server.
+    """
+    def test_round_robin(self):
+        balancer = LoadBalancer(["a", "b", "c"])
+        chosen = [balancer.acquire() for i in range(6)]
+        assert ["a", "b", "c", "a", "b", "c"] == chosen
+
+    def test_least_outstanding(self):
+        balancer = LoadBalancer(["a", "b"], LoadBalancer.LEAST_OUTSTANDING)
+        assert "a" == balancer.acquire()
+        assert "b" == balancer.acquire()
+        balancer.release("b")
+        assert "b" == balancer.acquire()
+
+    def test_unhealthy(self):
+        balancer = LoadBalancer(["a", "b"])
+        balancer.release(balancer.acquire(), ok=False)
+        assert ["a"] == balancer.unhealthy_hosts()
+        assert ["b", "b"] == [balancer.acquire(), balancer.acquire()]
+        assert "a" == balancer.acquire("a")
+        balancer.mark_up("a")
+        assert ["a", "b"] == balancer.healthy_hosts()
+
+    def test_balanced_uris(self):
+        conn = ClusterConnection("seed", None, hosts=["h1", "h2"])
+        assert conn._balanced(urlparse(conn.client_uri("documents")))
+        assert not conn._balanced(urlparse(conn.uri("databases")))
+        assert not conn._balanced(urlparse("http://other:8000/v1/documents"))
+        assert "42" == conn._txid(urlparse(
+            conn.client_uri("documents") + "?uri=/a.xml&txid=42"))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import requests
+from mlconfig import MLConfig
+from marklogic.metrics import Metrics, endpoint
+
+class TestMetrics(MLConfig):
+    """
+    Metrics tests that don't require a server.
+    """
+    def test_endpoint(self):
+        assert "manage/v2/databases" \
+          == endpoint(self.connection.uri("databases", "Documents"))
+        assert "v1/documents" \
+          == endpoint(self.connection.client_uri("documents") + "?uri=/a")
+        assert "admin/v1/timestamp" \
+          == endpoint("http://localhost:8001/admin/v1/timestamp")
+
+    def test_record(self):
+        metrics = Metrics(buckets=[0.1, 1.0])
+        key = metrics.started("GET", self.connection.client_uri("eval"))
+        assert 1 == metrics.snapshot()[key]['in-flight']
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['content-length'] = "10"
+        metrics.finished(key, None, response, 0.5)
+
+        data = metrics.snapshot()[("GET", "v1/eval")]
+        assert 0 == data['in-flight']
+        assert {200: 1} == data['statuses']
+        assert 10 == data['response-bytes']
+        assert [(0.1, 0), (1.0, 1), (float("inf"), 0)] \
+          == data['latency-buckets']
+
+        text = metrics.exposition()
+        assert 'marklogic_client_responses_total{method="GET",' \
+          'endpoint="v1/eval",status="200"} 1' in text
+
+        metrics.reset()
+        assert {} == metrics.snapshot()
+
+    def test_chunked_bytes(self):
+        metrics = Metrics()
+        key = metrics.started("POST", self.connection.client_uri("documents"))
+        request = requests.Request("POST", "http://localhost/v1/documents",
+                                   data=iter([b"<doc/>"])).prepare()
+        request.body = b"<doc/>"
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(b'{"documents": []}')
+        metrics.finished(key, request, response, 0.1)
+        data = metrics.snapshot()[("POST", "v1/documents")]
+        assert 6 == data['request-bytes']
+        assert 17 == data['response-bytes']
+
+        # The body of a streamed response isn't read
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(b"<doc/>")
+        metrics.finished(key, None, response, 0.1, streamed=True)
+        assert 17 == metrics.snapshot()[key]['response-bytes']
+        assert b"<doc/>" == response.content
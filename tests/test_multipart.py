@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from mlconfig import MLConfig
+from marklogic.client import Documents
+from marklogic.client.content import ContentSource
+from marklogic.client.multipart import MultipartBody, MultipartReader
+from marklogic.client.multipart import encode_multipart
+from marklogic.fakeserver import FakeMarkLogic
+
+class TestMultipart(MLConfig):
+    """
+    Multipart decoder tests that don't require a server.
+    """
+    def test_chunk_boundaries(self):
+        awkward = b"\r\n--not-the-boundary\r\n" * 1000
+        body, content_type = encode_multipart(
+            [({'Content-Type': "text/plain"}, b"first"),
+             ({'Content-Type': "application/octet-stream"}, awkward),
+             ({'Content-Type': "text/plain"}, b"")])
+        for size in [1, 7, 1000, len(body)]:
+            chunks = [body[pos:pos + size] for pos in range(0, len(body), size)]
+            parts = [b"".join(part.iter_content(100))
+                     for part in MultipartReader(chunks, content_type)]
+            assert [b"first", awkward, b""] == parts
+
+    def test_part_length(self):
+        body, content_type = encode_multipart(
+            [({'Content-Type': "text/plain"}, "caf\u00e9")])
+        part = next(iter(MultipartReader([body], content_type)))
+        assert "5" == part.headers['Content-Length']
+        assert "caf\u00e9" == part.text
+
+    def test_read_after_content(self):
+        body, content_type = encode_multipart(
+            [({'Content-Type': "text/plain"}, b"0123456789")])
+        part = next(iter(MultipartReader([body], content_type)))
+        assert b"0123456789" == part.content
+        assert b"0123" == part.read(4)
+        assert [b"456", b"789"] == list(part.iter_content(3))
+        assert b"" == part.read()
+        assert b"0123456789" == part.content
+
+    def test_documents(self):
+        with FakeMarkLogic() as fake:
+            conn = fake.connection()
+            for name in ["a", "b"]:
+                doc = Documents(conn)
+                doc.set_uri("/{0}.xml".format(name))
+                doc.set_collection(name)
+                doc.put(data="<{0}/>".format(name))
+
+            docs = Documents(conn)
+            docs.set_uris(["/a.xml", "/b.xml"])
+            docs.set_categories(["content", "metadata"])
+            docs.set_accept("multipart/mixed")
+            response = docs.get(stream=True)
+            with MultipartReader.from_response(response, 4) as reader:
+                result = [(uri, metadata.text, content.text)
+                          for uri, metadata, content in reader.documents()]
+
+        assert ["/a.xml", "/b.xml"] == [item[0] for item in result]
+        assert "<rapi:collection>b</rapi:collection>" in result[1][1]
+        assert "<b/>" == result[1][2]
+
+    def test_body(self):
+        source = ContentSource(memoryview(b"<doc>two</doc>"))
+        body = MultipartBody([({'Content-Type': "text/plain"}, "one"),
+                              ({'Content-Type': "application/xml"}, source)])
+        data = body.read()
+        assert len(body) == len(data)
+        reader = MultipartReader([data], body.content_type)
+        assert [b"one", b"<doc>two</doc>"] == [part.content for part in reader]
+
+        body.seek(0)
+        chunks = []
+        while True:
+            chunk = body.read(7)
+            if not chunk:
+                break
+            chunks.append(bytes(chunk))
+        assert data == b"".join(chunks)
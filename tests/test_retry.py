@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import requests
+from mlconfig import MLConfig
+from marklogic.retry import RetryPolicy, RetryBudget
+
+class TestRetry(MLConfig):
+    """
+    Retry policy tests that don't require a server.
+    """
+    def _response(self, status, text="", headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response._content = text.encode("utf-8")
+        if headers is not None:
+            response.headers.update(headers)
+        return response
+
+    def test_applies(self):
+        policy = RetryPolicy()
+        assert policy.applies("GET")
+        assert policy.applies("PUT")
+        assert not policy.applies("POST")
+        assert policy.applies("POST", {'if-match': '1234'})
+        assert policy.applies("POST", idempotent=True)
+        assert not policy.applies("GET", idempotent=False)
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_retries=2)
+        assert policy.should_retry(0, response=self._response(503))
+        assert not policy.should_retry(2, response=self._response(503))
+        assert not policy.should_retry(0, response=self._response(400))
+
+        error = '{"errorResponse": {"messageCode": "XDMP-FORESTNOTOPEN"}}'
+        assert policy.should_retry(0, response=self._response(500, error))
+        error = '{"errorResponse": {"messageCode": "XDMP-UNDFUN"}}'
+        assert not policy.should_retry(0, response=self._response(500, error))
+
+        assert policy.should_retry(0, error=requests.exceptions.ConnectionError())
+
+    def test_delay(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+        assert 1 == policy.delay(0)
+        assert 4 == policy.delay(2)
+        assert 5 == policy.delay(8)
+        assert 3 == policy.delay(0, self._response(503, headers={'Retry-After': '3'}))
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, capacity=2, initial=1)
+        policy = RetryPolicy(budget=budget)
+        assert policy.should_retry(0, response=self._response(503))
+        assert not policy.should_retry(0, response=self._response(503))
+        budget.deposit()
+        budget.deposit()
+        assert policy.should_retry(0, response=self._response(503))